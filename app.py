@@ -1,13 +1,18 @@
 import os
 import logging
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, flash, session, abort
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, abort, jsonify
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-import secrets
-import string
 from sqlalchemy.orm import DeclarativeBase
+from cache import (cache, cached_learning_license, cached_driving_license,
+                   learning_license_key, driving_license_key)
+from passwords import hasher, HasherBusy, hash_timed
+from uploads import StreamingUploadRequest
+from ids import id_allocator
+from metrics import metrics, Gauge, observe_password_hash
+from querytrace import tracer
+from sqlitemode import sqlite_mode
+from responses import response_optimizer
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -19,6 +24,7 @@ class Base(DeclarativeBase):
 # Initialize Flask app and database
 db = SQLAlchemy(model_class=Base)
 app = Flask(__name__)
+app.request_class = StreamingUploadRequest
 app.secret_key = os.environ.get("SESSION_SECRET", "dev_key_for_development_only")
 
 # Configure database
@@ -27,20 +33,97 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+
+# SQLite production profile: WAL and tuned pragmas on every connection, a busy timeout, writes
+# in BEGIN IMMEDIATE transactions and optionally one writer at a time across threads and workers
+# (SQLITE_PROFILE=off keeps the driver defaults)
+app.config["SQLITE_PROFILE"] = os.environ.get("SQLITE_PROFILE", "production")
+app.config["SQLITE_JOURNAL_MODE"] = os.environ.get("SQLITE_JOURNAL_MODE", "wal")
+app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "normal")
+app.config["SQLITE_CACHE_SIZE_KB"] = int(os.environ.get("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+app.config["SQLITE_MMAP_SIZE"] = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+app.config["SQLITE_BUSY_TIMEOUT"] = float(os.environ.get("SQLITE_BUSY_TIMEOUT", "30"))
+app.config["SQLITE_SINGLE_WRITER"] = os.environ.get("SQLITE_SINGLE_WRITER", "0") == "1"
+if app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite") and app.config["SQLITE_PROFILE"] == "production":
+    # A local file needs no liveness ping on checkout and no recycling
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
 app.config["UPLOAD_FOLDER"] = "uploads"
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max upload
+app.config["UPLOAD_MAX_FILE_SIZE"] = int(os.environ.get("UPLOAD_MAX_FILE_SIZE", str(app.config["MAX_CONTENT_LENGTH"])))
+app.config["UPLOAD_ALLOWED_TYPES"] = {"pdf", "jpeg", "png"}
+app.config["DOCUMENT_STORE"] = os.environ.get("DOCUMENT_STORE", "local")  # local or bucket
+app.config["DOCUMENT_ACCEL_REDIRECT"] = os.environ.get("DOCUMENT_ACCEL_REDIRECT")  # e.g. /protected-documents
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+app.config["TEST_SLOT_CAPACITY"] = int(os.environ.get("TEST_SLOT_CAPACITY", "20"))  # Seats per test slot
+app.config["BATCH_MAX_ITEMS"] = int(os.environ.get("BATCH_MAX_ITEMS", "100"))  # Applications per batch API request
 
-# Initialize the app with the extension
-db.init_app(app)
+# Configure lookup cache (sqlite is shared by the web workers and the flask commands that change
+# licenses, so their invalidations reach every process; memory only suits a lone process with no
+# other writers; null disables it)
+app.config["CACHE_BACKEND"] = os.environ.get("CACHE_BACKEND", "sqlite")
+app.config["CACHE_TTL"] = int(os.environ.get("CACHE_TTL", "300"))
+app.config["CACHE_MAX_ENTRIES"] = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+
+# Configure password hashing (work factor, pool size and how many hashes may wait before shedding load)
+app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+app.config["PASSWORD_HASH_MAX_PENDING"] = int(os.environ.get("PASSWORD_HASH_MAX_PENDING",
+                                                             str(app.config["PASSWORD_HASH_WORKERS"] * 4)))
+
+# Configure request metrics (set METRICS_TOKEN to require a bearer token on /metrics, and
+# METRICS_DIR to a directory where every worker process writes its totals so /metrics covers all of them)
+app.config["METRICS_ENABLED"] = os.environ.get("METRICS_ENABLED", "1") == "1"
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+app.config["METRICS_DIR"] = os.environ.get("METRICS_DIR")
+
+# Trace SQL per request and log N+1 suspects (on in debug mode unless QUERY_TRACE says otherwise)
+if "QUERY_TRACE" in os.environ:
+    app.config["QUERY_TRACE"] = os.environ["QUERY_TRACE"] == "1"
+
+# Compress responses over COMPRESS_MIN_SIZE bytes (brotli when installed, else gzip), answer
+# unchanged pages with 304 through ETags, and cache fingerprinted static files for a year
+app.config["COMPRESS_ENABLED"] = os.environ.get("COMPRESS_ENABLED", "1") == "1"
+app.config["COMPRESS_MIN_SIZE"] = int(os.environ.get("COMPRESS_MIN_SIZE", "500"))
+app.config["COMPRESS_LEVEL"] = int(os.environ.get("COMPRESS_LEVEL", "6"))
+app.config["COMPRESS_BROTLI_QUALITY"] = int(os.environ.get("COMPRESS_BROTLI_QUALITY", "5"))
+app.config["RESPONSE_ETAGS"] = os.environ.get("RESPONSE_ETAGS", "1") == "1"
+app.config["STATIC_MAX_AGE"] = int(os.environ.get("STATIC_MAX_AGE", str(365 * 24 * 60 * 60)))
 
-# Create uploads directory if it doesn't exist
-if not os.path.exists(app.config["UPLOAD_FOLDER"]):
-    os.makedirs(app.config["UPLOAD_FOLDER"])
+# Card payments: off records applications as paid without a gateway, sync waits for the charge,
+# async creates them as "Payment Pending" and completes them from the gateway's signed callback
+app.config["PAYMENT_MODE"] = os.environ.get("PAYMENT_MODE", "off")
+app.config["PAYMENT_GATEWAY_URL"] = os.environ.get("PAYMENT_GATEWAY_URL", "http://127.0.0.1:8099")
+app.config["PAYMENT_GATEWAY_KEY"] = os.environ.get("PAYMENT_GATEWAY_KEY")
+app.config["PAYMENT_WEBHOOK_SECRET"] = os.environ.get("PAYMENT_WEBHOOK_SECRET")
+app.config["PAYMENT_CONNECT_TIMEOUT"] = float(os.environ.get("PAYMENT_CONNECT_TIMEOUT", "2"))
+app.config["PAYMENT_READ_TIMEOUT"] = float(os.environ.get("PAYMENT_READ_TIMEOUT", "8"))
+app.config["PAYMENT_RETRIES"] = int(os.environ.get("PAYMENT_RETRIES", "2"))
+app.config["PAYMENT_POOL_SIZE"] = int(os.environ.get("PAYMENT_POOL_SIZE", "10"))
 
-# Import models after db initialization to avoid circular imports
-with app.app_context():
-    from models import User, LearningLicense, DrivingLicense, LicenseRenewal, LicenseChangeRequest
-    db.create_all()
+# Officer search: results per page, deepest page served, most matches ranked by relevance
+# (broader searches list newest applicants first), and the accounts allowed to search
+app.config["SEARCH_PAGE_SIZE"] = int(os.environ.get("SEARCH_PAGE_SIZE", "20"))
+app.config["SEARCH_MAX_PAGE"] = int(os.environ.get("SEARCH_MAX_PAGE", "50"))
+app.config["SEARCH_RANK_LIMIT"] = int(os.environ.get("SEARCH_RANK_LIMIT", "1000"))
+app.config["OFFICER_USERNAMES"] = {name.strip() for name in os.environ.get("OFFICER_USERNAMES", "").split(",") if name.strip()}
+
+# Initialize the app with the extensions
+db.init_app(app)
+sqlite_mode.init_app(app)
+cache.init_app(app)
+hasher.init_app(app)
+id_allocator.init_app(app)
+metrics.init_app(app)
+tracer.init_app(app)
+response_optimizer.init_app(app)
+hash_timed.connect(observe_password_hash)
+metrics.add(Gauge('cache_hits_total', 'Lookup cache hits', lambda: cache.hits, kind='counter'))
+metrics.add(Gauge('cache_misses_total', 'Lookup cache misses', lambda: cache.misses, kind='counter'))
+
+# Import models after db initialization to avoid circular imports; the schema is
+# created and upgraded by "flask db-upgrade" once per deploy, not on import
+from models import (User, LearningLicense, DrivingLicense, ApplicantProfile, LicenseChangeRequest,
+                    Document, UNPAID_STATUSES)
 
 # Import forms
 from forms import (LoginForm, SignupForm, LearningLicenseForm, DrivingLicenseForm, 
@@ -49,13 +132,67 @@ from forms import (LoginForm, SignupForm, LearningLicenseForm, DrivingLicenseFor
 # Import utility functions
 from utils import generate_application_id, generate_license_number, is_logged_in
 
+# Import test slot inventory
+from slots import get_availability, slot_available, reserve_slot
+
+# Import application registry
+from registry import register_application, lookup_application
+
+# Keep sessions on the server (database, file, cache, memory or cookie for Flask's signed cookie)
+from sessions import init_sessions, regenerate_session
+app.config["SESSION_BACKEND"] = os.environ.get("SESSION_BACKEND", "database")
+app.config["SERVER_SESSION_TTL"] = int(os.environ.get("SERVER_SESSION_TTL", str(24 * 60 * 60)))
+init_sessions(app)
+
+# Import document storage
+from storage import documents
+documents.init_app(app)
+
+# Import dashboard queries
+from dashboard import application_page
+
+# Import background jobs, and export the queue for monitoring
+from jobs import enqueue, queue_depth, oldest_queued_seconds
+metrics.add(Gauge('jobs_queue_depth', 'Background jobs per lane and status (done jobs are not counted)', queue_depth,
+                  labels=('lane', 'status')))
+metrics.add(Gauge('jobs_oldest_queued_seconds', 'Wait of the oldest runnable queued job', oldest_queued_seconds))
+
+# Import officer search
+from search import search_index, SearchError
+search_index.init_app(app)
+
+# Import the batch API for driving schools
+from batchapi import token_user, submit_batch, BatchTooLarge
+
+# Import the payment gateway client
+from payments import gateway, FEES, start_payment, finish_payment, renew, PaymentDeclined, GatewayUnavailable
+gateway.init_app(app)
+
+# Register CLI commands
+import importer
+import transitions
+import expiry
+import migrations
+
 # Login route
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     form = LoginForm()
     if form.validate_on_submit():
         user = User.query.filter_by(username=form.username.data).first()
-        if user and check_password_hash(user.password_hash, form.password.data):
+        valid = False
+        if user:
+            try:
+                valid, new_hash = hasher.verify(user.password_hash, form.password.data)
+            except HasherBusy:
+                flash('The server is busy, please try again in a moment', 'warning')
+                return render_template('login.html', form=form), 503
+            if new_hash:
+                # Upgrade hashes created with outdated parameters
+                user.password_hash = new_hash
+                db.session.commit()
+        if valid:
+            regenerate_session()
             session['user_id'] = user.id
             session['username'] = user.username
             flash('Login successful!', 'success')
@@ -81,7 +218,11 @@ def signup():
             return render_template('signup.html', form=form)
             
         # Create new user
-        hashed_password = generate_password_hash(form.password.data)
+        try:
+            hashed_password = hasher.hash(form.password.data)
+        except HasherBusy:
+            flash('The server is busy, please try again in a moment', 'warning')
+            return render_template('signup.html', form=form), 503
         new_user = User(
             username=form.username.data,
             email=form.email.data,
@@ -98,8 +239,8 @@ def signup():
 # Logout route
 @app.route('/logout')
 def logout():
-    session.pop('user_id', None)
-    session.pop('username', None)
+    session.clear()
+    regenerate_session()
     flash('You have been logged out', 'info')
     return redirect(url_for('login'))
 
@@ -111,6 +252,56 @@ def home():
         return redirect(url_for('login'))
     return render_template('home.html', username=session.get('username'))
 
+# Dashboard route
+@app.route('/dashboard')
+def dashboard():
+    if not is_logged_in():
+        return redirect(url_for('login'))
+    
+    page = application_page(session['user_id'], request.args.get('cursor'), limit=25)
+    return render_template('dashboard.html', username=session.get('username'),
+                           applications=page['items'], next_cursor=page['next_cursor'])
+
+# Applications JSON route
+@app.route('/api/applications')
+def api_applications():
+    if not is_logged_in():
+        return jsonify({'error': 'Login required'}), 401
+    
+    limit = min(max(request.args.get('limit', 25, type=int), 1), 100)
+    return jsonify(application_page(session['user_id'], request.args.get('cursor'), limit=limit))
+
+# Batch applications JSON route for driving schools, authenticated with an API token
+@app.route('/api/batch/applications', methods=['POST'])
+def api_batch_applications():
+    user_id = token_user(request.headers.get('Authorization'))
+    if user_id is None:
+        return jsonify({'error': 'A valid API token is required'}), 401
+    
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('applications'), list):
+        return jsonify({'error': 'Expected a JSON object with an "applications" list'}), 400
+    
+    try:
+        created, results = submit_batch(user_id, payload['applications'], atomic=payload.get('atomic') is True)
+    except BatchTooLarge as e:
+        return jsonify({'error': str(e), 'limit': app.config['BATCH_MAX_ITEMS']}), 413
+    rejected = sum(result['status'] == 'rejected' for result in results)
+    return jsonify({'created': created, 'rejected': rejected, 'results': results}), 201 if created else 422
+
+# Officer search JSON route
+@app.route('/officer/search')
+def officer_search():
+    if not is_logged_in():
+        return jsonify({'error': 'Login required'}), 401
+    if session.get('username') not in app.config['OFFICER_USERNAMES']:
+        return jsonify({'error': 'Officers only'}), 403
+    
+    try:
+        return jsonify(search_index.search(request.args.get('q', ''), request.args.get('page', 1, type=int)))
+    except SearchError as e:
+        return jsonify({'error': str(e)}), 400
+
 # Learning License application route
 @app.route('/learning-license', methods=['GET', 'POST'])
 def learning_license():
@@ -138,13 +329,12 @@ def learning_license():
             'document_type': form.document_type.data
         }
         
-        # Handle document upload if provided
+        # Handle document upload if provided; it was streamed to a temp file while the request was parsed
         if form.document.data:
-            filename = secure_filename(form.document.data.filename)
-            random_string = ''.join(secrets.choice(string.ascii_letters + string.digits) for _ in range(8))
-            new_filename = f"{session['user_id']}_{random_string}_{filename}"
-            form.document.data.save(os.path.join(app.config['UPLOAD_FOLDER'], new_filename))
-            session['learning_license_data']['document_filename'] = new_filename
+            document = documents.save(form.document.data.stream)
+            session['learning_license_data']['document_filename'] = document.storage_key
+            session['learning_license_data']['document_sha256'] = document.sha256
+            session['learning_license_data']['document_size'] = document.size
         
         # Redirect to payment page
         return redirect(url_for('payment', license_type='learning'))
@@ -160,14 +350,20 @@ def driving_license():
     form = DrivingLicenseForm()
     if form.validate_on_submit():
         # Verify learning license exists
-        learning_license = LearningLicense.query.filter_by(
-            application_id=form.learning_license_id.data,
-            user_id=session['user_id']
-        ).first()
+        learning_license = cached_learning_license(form.learning_license_id.data, session['user_id'])
         
         if not learning_license:
             flash('Invalid Learning License ID or license does not belong to you', 'danger')
-            return render_template('driving_license.html', form=form)
+            return render_template('driving_license.html', form=form, availability=get_availability())
+        
+        if learning_license.status in UNPAID_STATUSES:
+            flash('The fee for this Learning License has not been paid', 'danger')
+            return render_template('driving_license.html', form=form, availability=get_availability())
+        
+        # Verify the selected slot still has seats
+        if not slot_available(form.test_date.data, form.test_time.data):
+            flash('The selected test slot is fully booked, please choose another', 'danger')
+            return render_template('driving_license.html', form=form, availability=get_availability())
         
         # Store data in session for payment
         session['driving_license_data'] = {
@@ -179,7 +375,19 @@ def driving_license():
         # Redirect to payment page
         return redirect(url_for('payment', license_type='driving'))
     
-    return render_template('driving_license.html', form=form)
+    return render_template('driving_license.html', form=form, availability=get_availability())
+
+# Test slot availability route
+@app.route('/test-slots')
+def test_slots():
+    if not is_logged_in():
+        return redirect(url_for('login'))
+    
+    availability = get_availability()
+    return jsonify({
+        test_date.strftime('%Y-%m-%d'): slots
+        for test_date, slots in availability.items()
+    })
 
 # Renew License route
 @app.route('/renew-license', methods=['GET', 'POST'])
@@ -190,15 +398,16 @@ def renew_license():
     form = RenewLicenseForm()
     if form.validate_on_submit():
         # Check if driving license exists
-        driving_license = DrivingLicense.query.filter_by(
-            license_number=form.license_number.data,
-            user_id=session['user_id']
-        ).first()
+        driving_license = cached_driving_license(form.license_number.data, session['user_id'])
         
         if not driving_license:
             flash('Invalid License Number or license does not belong to you', 'danger')
             return render_template('renew_license.html', form=form)
         
+        if driving_license.status in UNPAID_STATUSES:
+            flash('The fee for this license has not been paid', 'danger')
+            return render_template('renew_license.html', form=form)
+        
         # Store data in session for payment
         session['renewal_data'] = {
             'license_number': form.license_number.data,
@@ -221,10 +430,7 @@ def change_details():
     if request.method == 'POST' and 'license_number' in request.form and not form.address.data:
         # This is the license verification step
         license_number = request.form['license_number']
-        driving_license = DrivingLicense.query.filter_by(
-            license_number=license_number,
-            user_id=session['user_id']
-        ).first()
+        driving_license = cached_driving_license(license_number, session['user_id'])
         
         if not driving_license:
             flash('Invalid License Number or license does not belong to you', 'danger')
@@ -268,17 +474,23 @@ def change_details():
             status='Pending'
         )
         
-        # Update license details
+        # Update license details; the profile is shared with the learning license
         driving_license.address = form.address.data
         driving_license.city = form.city.data
         driving_license.state = form.state.data
         driving_license.zip_code = form.zip_code.data
         driving_license.phone = form.phone.data
         
+        application_id = generate_application_id()
         db.session.add(change_request)
+        search_index.update(driving_license.profile)
+        cache.invalidate_after_commit(db.session, driving_license_key(driving_license.license_number),
+                                      learning_license_key(driving_license.learning_license_id))
+        register_application(application_id, 'change', session['user_id'], 'Pending',
+                             license_number=form.license_number.data)
         db.session.commit()
         
-        flash('Your details have been updated successfully', 'success')
+        flash(f'Your details have been updated successfully. Application ID: {application_id}', 'success')
         return redirect(url_for('home'))
     
     return render_template('change_details.html', form=None)
@@ -293,39 +505,10 @@ def application_status():
     application = None
     
     if form.validate_on_submit():
-        application_id = form.application_id.data
-        
-        # Check for Learning License
-        learning_license = LearningLicense.query.filter_by(
-            application_id=application_id,
-            user_id=session['user_id']
-        ).first()
-        
-        if learning_license:
-            application = {
-                'type': 'Learning License',
-                'id': learning_license.application_id,
-                'status': learning_license.status,
-                'apply_date': learning_license.apply_date,
-                'estimate': '7-10 business days'
-            }
-        else:
-            # Check for Driving License
-            driving_license = DrivingLicense.query.filter_by(
-                application_id=application_id,
-                user_id=session['user_id']
-            ).first()
-            
-            if driving_license:
-                application = {
-                    'type': 'Driving License',
-                    'id': driving_license.application_id,
-                    'status': driving_license.status,
-                    'apply_date': driving_license.apply_date,
-                    'estimate': '14-21 business days'
-                }
-            else:
-                flash('Application not found or does not belong to you', 'danger')
+        # Single registry lookup covers every application kind
+        application = lookup_application(form.application_id.data, session['user_id'])
+        if not application:
+            flash('Application not found or does not belong to you', 'danger')
     
     return render_template('application_status.html', form=form, application=application)
 
@@ -337,6 +520,79 @@ def check_rc():
     
     return render_template('check_rc.html')
 
+# Document download route
+@app.route('/documents/<application_id>')
+def download_document(application_id):
+    if not is_logged_in():
+        return redirect(url_for('login'))
+    
+    learning_license = cached_learning_license(application_id, session['user_id'])
+    if not learning_license or not learning_license.document_path:
+        abort(404)
+    
+    file_type = os.path.splitext(learning_license.document_path)[1].lstrip('.') or None
+    if learning_license.document_sha256:
+        document = Document.query.filter_by(sha256=learning_license.document_sha256).first()
+        file_type = document.file_type if document else file_type
+    return documents.serve(
+        learning_license.document_path,
+        download_name=f"{application_id}.{file_type or 'bin'}",
+        file_type=file_type,
+        size=learning_license.document_size
+    )
+
+# Metrics route
+@app.route('/metrics')
+def metrics_endpoint():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Payment gateway callback route (async payment mode)
+@app.route('/payments/callback', methods=['POST'])
+def payment_callback():
+    if not gateway.verify(request.get_data(), request.headers.get('X-Gateway-Signature')):
+        abort(401)
+    
+    event = request.get_json(silent=True) or {}
+    if not event.get('payment_id') or event.get('status') not in ('succeeded', 'declined'):
+        return jsonify({'error': 'Expected a payment_id and a succeeded or declined status'}), 400
+    
+    # Repeated callbacks for a settled payment are acknowledged without effect
+    finish_payment(event['payment_id'], event['status'] == 'succeeded', reference=event.get('id'),
+                   error=event.get('reason'))
+    return jsonify({'received': True})
+
+def collect_payment(payment, form, license_type, session_key, **confirmation):
+    """Charge the card for a committed pending payment and show the outcome"""
+    card = {
+        'number': form.card_number.data,
+        'holder': form.card_holder.data,
+        'expiry': form.expiry_date.data,
+        'cvv': form.cvv.data
+    }
+    callback_url = url_for('payment_callback', _external=True) if gateway.mode == 'async' else None
+    try:
+        charge = gateway.charge(payment.payment_id, payment.amount, card,
+                                f'{license_type} {payment.application_id}', callback_url=callback_url)
+    except PaymentDeclined as e:
+        finish_payment(payment.payment_id, False, error=str(e))
+        flash(f'Your payment was declined ({e}), please try another card', 'danger')
+        return render_template('payment.html', form=form, license_type=payment.kind, amount=payment.amount), 402
+    except GatewayUnavailable:
+        # The charge may still have gone through; "flask payments-reconcile" settles it later
+        charge = {'status': 'pending'}
+    
+    session.pop(session_key, None)
+    if charge.get('status') == 'succeeded':
+        finish_payment(payment.payment_id, True, reference=charge.get('id'))
+    return render_template('confirmation.html',
+                           application_id=payment.application_id,
+                           license_type=license_type,
+                           payment_status='Paid' if charge.get('status') == 'succeeded' else 'Payment Pending',
+                           **confirmation)
+
 # Payment processing route
 @app.route('/payment/<license_type>', methods=['GET', 'POST'])
 def payment(license_type):
@@ -344,15 +600,9 @@ def payment(license_type):
         return redirect(url_for('login'))
     
     # Set payment amount based on license type
-    amount = 0
-    if license_type == 'learning':
-        amount = 500
-    elif license_type == 'driving':
-        amount = 1000
-    elif license_type == 'renewal':
-        amount = 750
-    else:
+    if license_type not in FEES:
         abort(404)
+    amount = FEES[license_type]
     
     form = PaymentForm()
     form.amount.data = amount
@@ -364,9 +614,7 @@ def payment(license_type):
             data = session['learning_license_data']
             application_id = generate_application_id()
             
-            new_application = LearningLicense(
-                application_id=application_id,
-                user_id=session['user_id'],
+            profile = ApplicantProfile(
                 name=data['name'],
                 dob=datetime.strptime(data['dob'], '%Y-%m-%d'),
                 gender=data['gender'],
@@ -377,17 +625,40 @@ def payment(license_type):
                 city=data['city'],
                 state=data['state'],
                 zip_code=data['zip_code'],
-                license_type=data['license_type'],
                 blood_group=data['blood_group'],
                 rh_factor=data['rh_factor'],
-                citizenship=data['citizenship'],
+                citizenship=data['citizenship']
+            )
+            
+            new_application = LearningLicense(
+                application_id=application_id,
+                user_id=session['user_id'],
+                profile=profile,
+                license_type=data['license_type'],
                 document_type=data['document_type'],
                 document_path=data.get('document_filename', ''),
-                status='Processing',
+                document_sha256=data.get('document_sha256'),
+                document_size=data.get('document_size'),
+                status='Payment Pending' if gateway.enabled else 'Processing',
                 apply_date=datetime.now()
             )
             
             db.session.add(new_application)
+            search_index.update(profile)
+            if new_application.document_sha256:
+                documents.add_reference(new_application.document_sha256)
+                enqueue('verify_document', key=f'verify_document:{application_id}', lane='high',
+                        application_id=application_id)
+            cache.invalidate_after_commit(db.session, learning_license_key(application_id))
+            register_application(application_id, 'learning', session['user_id'], new_application.status)
+            if gateway.enabled:
+                # Committed before the card is charged, so no transaction waits on the gateway
+                pending = start_payment('learning', application_id, session['user_id'], amount)
+                db.session.commit()
+                return collect_payment(pending, form, 'Learning License', 'learning_license_data')
+            
+            enqueue('send_confirmation', key=f'send_confirmation:{application_id}',
+                    application_id=application_id, license_type='Learning License', email=data['email'])
             db.session.commit()
             
             # Clear session data
@@ -404,38 +675,42 @@ def payment(license_type):
             license_number = generate_license_number()
             
             # Get learning license details
-            learning_license = LearningLicense.query.filter_by(
-                application_id=data['learning_license_id'],
-                user_id=session['user_id']
-            ).first()
+            learning_license = cached_learning_license(data['learning_license_id'], session['user_id'])
+            
+            # Take a seat in the test slot; committed together with the license below
+            test_date = datetime.strptime(data['test_date'], '%Y-%m-%d').date()
+            if not reserve_slot(test_date, data['test_time']):
+                db.session.rollback()
+                session.pop('driving_license_data', None)
+                flash('The selected test slot was booked out, please choose another', 'danger')
+                return redirect(url_for('driving_license'))
             
             new_license = DrivingLicense(
                 application_id=application_id,
                 license_number=license_number,
                 user_id=session['user_id'],
                 learning_license_id=data['learning_license_id'],
-                name=learning_license.name,
-                dob=learning_license.dob,
-                gender=learning_license.gender,
-                place_of_birth=learning_license.place_of_birth,
-                phone=learning_license.phone,
-                email=learning_license.email,
-                address=learning_license.address,
-                city=learning_license.city,
-                state=learning_license.state,
-                zip_code=learning_license.zip_code,
+                profile_id=learning_license.profile_id,
                 license_type='Driving License',
-                blood_group=learning_license.blood_group,
-                rh_factor=learning_license.rh_factor,
-                citizenship=learning_license.citizenship,
-                test_date=datetime.strptime(data['test_date'], '%Y-%m-%d'),
+                test_date=test_date,
                 test_time=data['test_time'],
-                status='Scheduled',
+                status='Payment Pending' if gateway.enabled else 'Scheduled',
                 apply_date=datetime.now(),
                 expiry_date=datetime.now().replace(year=datetime.now().year + 10)
             )
             
             db.session.add(new_license)
+            cache.invalidate_after_commit(db.session, driving_license_key(license_number))
+            register_application(application_id, 'driving', session['user_id'], new_license.status,
+                                 license_number=license_number)
+            if gateway.enabled:
+                pending = start_payment('driving', application_id, session['user_id'], amount)
+                db.session.commit()
+                return collect_payment(pending, form, 'Driving License', 'driving_license_data',
+                                       license_number=license_number)
+            
+            enqueue('send_confirmation', key=f'send_confirmation:{application_id}',
+                    application_id=application_id, license_type='Driving License', email=learning_license.email)
             db.session.commit()
             
             # Clear session data
@@ -456,28 +731,31 @@ def payment(license_type):
                 user_id=session['user_id']
             ).first()
             
-            # Update expiry date
-            current_expiry = driving_license.expiry_date
-            driving_license.expiry_date = current_expiry.replace(year=current_expiry.year + 10)
-            driving_license.status = 'Renewed'
-            
-            # Create renewal record
-            renewal = LicenseRenewal(
-                user_id=session['user_id'],
-                license_number=data['license_number'],
-                renewal_date=datetime.now(),
-                renewal_reason=data['renewal_reason'],
-                old_expiry_date=current_expiry,
-                new_expiry_date=driving_license.expiry_date
-            )
+            application_id = generate_application_id()
+            if gateway.enabled:
+                # The license is renewed once the payment succeeds
+                register_application(application_id, 'renewal', session['user_id'], 'Payment Pending',
+                                     license_number=data['license_number'])
+                pending = start_payment('renewal', application_id, session['user_id'], amount,
+                                        license_number=data['license_number'],
+                                        renewal_reason=data['renewal_reason'])
+                db.session.commit()
+                return collect_payment(pending, form, 'License Renewal', 'renewal_data',
+                                       license_number=data['license_number'])
             
-            db.session.add(renewal)
+            # Extend the expiry date and record the renewal
+            renew(driving_license, data['renewal_reason'], session['user_id'])
+            register_application(application_id, 'renewal', session['user_id'], 'Completed',
+                                 license_number=data['license_number'])
+            enqueue('send_confirmation', key=f'send_confirmation:{application_id}',
+                    application_id=application_id, license_type='License Renewal', email=driving_license.email)
             db.session.commit()
             
             # Clear session data
             session.pop('renewal_data', None)
             
             return render_template('confirmation.html',
+                                  application_id=application_id,
                                   license_number=data['license_number'],
                                   license_type='License Renewal')
         
@@ -488,4 +766,7 @@ def payment(license_type):
     return render_template('payment.html', form=form, license_type=license_type, amount=amount)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Development server; run server.py in production, after "flask db-upgrade"
+    with app.app_context():
+        migrations.upgrade()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "5000")), debug=os.environ.get("FLASK_DEBUG") == "1")
@@ -0,0 +1,184 @@
+import hashlib
+import secrets
+import uuid
+from datetime import datetime
+import click
+from flask import current_app
+from sqlalchemy import insert, select
+from app import app, db
+from models import User, LearningLicense, ApplicantProfile, ApiToken, Payment, APPLICANT_COLUMNS, UNPAID_STATUSES
+from forms import LearningLicenseForm, DrivingLicenseForm
+from importer import _validate, insert_rows
+from slots import reserve_slot
+from jobs import enqueue_many
+from ids import id_allocator
+from payments import gateway, FEES
+from utils import add_years
+
+# Item types accepted in a batch and the form whose rules they are checked with
+BATCH_FORMS = {'learning': LearningLicenseForm, 'driving': DrivingLicenseForm}
+
+class BatchTooLarge(Exception):
+    pass
+
+def _digest(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def token_user(authorization):
+    """Return the user ID for an 'Authorization: Bearer <token>' header, or None"""
+    if not authorization or not authorization.startswith('Bearer '):
+        return None
+    return db.session.execute(
+        select(ApiToken.user_id).where(ApiToken.token_sha256 == _digest(authorization[7:].strip()),
+                                       ApiToken.revoked_at.is_(None))
+    ).scalar()
+
+def _rejected(index, item, errors):
+    return {'index': index, 'reference': item.get('reference') if isinstance(item, dict) else None,
+            'status': 'rejected', 'errors': errors}
+
+def _check(items, forms):
+    """Validate every item with its form's rules; returns {index: (kind, values)} and {index: errors}"""
+    valid, errors = {}, {}
+    for index, item in enumerate(items):
+        kind = item.get('type') if isinstance(item, dict) else None
+        if kind not in BATCH_FORMS:
+            errors[index] = {'type': [f"Must be one of: {', '.join(BATCH_FORMS)}"]}
+            continue
+        form, item_errors = _validate(forms[kind], {k: v for k, v in item.items() if k in forms[kind]})
+        if item_errors:
+            errors[index] = item_errors
+        elif kind == 'learning':
+            values = {name: form[name].data for name in APPLICANT_COLUMNS}
+            values['document_type'] = form.document_type.data
+            valid[index] = (kind, values)
+        else:
+            valid[index] = (kind, {'learning_license_id': form.learning_license_id.data,
+                                   'test_date': form.test_date.data, 'test_time': form.test_time.data})
+    return valid, errors
+
+def submit_batch(user_id, items, atomic=False):
+    """Validate and create a batch of applications for one account in a single transaction.
+
+    Learning license items are checked against LearningLicenseForm and test bookings
+    against DrivingLicenseForm, the paid learning license they name and the seats left in
+    their slot. Valid items are inserted with one executemany per table; with atomic,
+    any rejected item rejects the whole batch. When payments are on, every application
+    waits as "Payment Pending" on an invoiced payment, settled with "flask payments-settle".
+    Returns (created, results), results in item order.
+    """
+    limit = current_app.config['BATCH_MAX_ITEMS']
+    if len(items) > limit:
+        raise BatchTooLarge(f'At most {limit} applications per request')
+
+    forms = {kind: form(formdata=None, meta={'csrf': False}) for kind, form in BATCH_FORMS.items()}
+    valid, errors = _check(items, forms)
+
+    # Test bookings must name a paid learning license of this account; one query for the batch
+    wanted = {values['learning_license_id'] for kind, values in valid.values() if kind == 'driving'}
+    learning = {row.application_id: row for row in db.session.execute(
+        select(LearningLicense.application_id, LearningLicense.profile_id, LearningLicense.status,
+               ApplicantProfile.email)
+        .join(ApplicantProfile, LearningLicense.profile_id == ApplicantProfile.id)
+        .where(LearningLicense.user_id == user_id, LearningLicense.application_id.in_(wanted)))} if wanted else {}
+    slots = {}
+    for index, (kind, values) in list(valid.items()):
+        if kind != 'driving':
+            continue
+        if values['learning_license_id'] not in learning:
+            errors[index] = {'learning_license_id': ['Learning license not found for this account']}
+            del valid[index]
+            continue
+        if learning[values['learning_license_id']].status in UNPAID_STATUSES:
+            errors[index] = {'learning_license_id': ['The fee for this learning license has not been paid']}
+            del valid[index]
+            continue
+        slots.setdefault((values['test_date'], values['test_time']), []).append(index)
+
+    if not (atomic and errors):
+        # IDs come first: leasing a block of them commits on its own connection, which would
+        # wait on this transaction once it has written
+        for kind, values in valid.values():
+            values['application_id'] = id_allocator.application_id()
+            if kind == 'driving':
+                values['license_number'] = id_allocator.license_number()
+
+        # All bookings for a slot take their seats with one conditional UPDATE, or none do
+        for (test_date, test_time), indexes in slots.items():
+            if not reserve_slot(test_date, test_time, seats=len(indexes)):
+                for index in indexes:
+                    errors[index] = {'test_date': ['Not enough free seats left in the selected test slot']}
+                    del valid[index]
+
+    if atomic and errors:
+        db.session.rollback()
+        return 0, [_rejected(index, item, errors[index]) if index in errors else
+                   {'index': index, 'reference': item.get('reference'), 'status': 'skipped'}
+                   for index, item in enumerate(items)]
+
+    now = datetime.now()
+    invoiced = gateway.enabled
+    rows = {'learning': [], 'driving': []}
+    results, confirmations, payments = [], [], []
+    for index, item in enumerate(items):
+        if index in errors:
+            results.append(_rejected(index, item, errors[index]))
+            continue
+        kind, values = valid[index]
+        values.update(user_id=user_id, apply_date=now)
+        result = {'index': index, 'reference': item.get('reference'), 'status': 'created',
+                  'application_id': values['application_id']}
+        if kind == 'learning':
+            email = values['email']
+            values.update(license_type='Learning License', document_path='',
+                          status='Payment Pending' if invoiced else 'Processing')
+        else:
+            parent = learning[values['learning_license_id']]
+            email = parent.email
+            values.update(profile_id=parent.profile_id,
+                          license_type='Driving License', status='Payment Pending' if invoiced else 'Scheduled',
+                          expiry_date=add_years(now, 10))
+            result['license_number'] = values['license_number']
+        rows[kind].append(values)
+        results.append(result)
+        if invoiced:
+            # Confirmed by finish_payment once the invoice is settled
+            result.update(payment_id=uuid.uuid4().hex, amount=FEES[kind])
+            payments.append({'payment_id': result['payment_id'], 'application_id': values['application_id'],
+                             'kind': kind, 'user_id': user_id, 'amount': result['amount'], 'method': 'invoice'})
+        else:
+            confirmations.append((f"send_confirmation:{values['application_id']}", {
+                'application_id': values['application_id'], 'license_type': values['license_type'], 'email': email}))
+
+    insert_rows('learning', rows['learning'])
+    insert_rows('driving', rows['driving'])
+    if payments:
+        db.session.execute(insert(Payment), payments)
+    enqueue_many('send_confirmation', confirmations)
+    db.session.commit()
+    return len(rows['learning']) + len(rows['driving']), results
+
+@app.cli.command('api-token-create')
+@click.argument('username')
+@click.option('--name', required=True, help='Who the token is for, e.g. the driving school.')
+def api_token_create(username, name):
+    """Create a batch API token for an account and print it; it cannot be shown again."""
+    user_id = db.session.execute(select(User.id).where(User.username == username)).scalar()
+    if user_id is None:
+        raise click.ClickException(f'Unknown user {username}')
+    token = secrets.token_urlsafe(32)
+    api_token = ApiToken(user_id=user_id, name=name, token_sha256=_digest(token))
+    db.session.add(api_token)
+    db.session.commit()
+    click.echo(f'Token {api_token.id} for {name}: {token}')
+
+@app.cli.command('api-token-revoke')
+@click.argument('token_id', type=int)
+def api_token_revoke(token_id):
+    """Revoke a batch API token by its ID."""
+    api_token = db.session.get(ApiToken, token_id)
+    if api_token is None:
+        raise click.ClickException(f'Unknown token {token_id}')
+    api_token.revoked_at = datetime.utcnow()
+    db.session.commit()
+    click.echo(f'Revoked token {token_id} ({api_token.name})')
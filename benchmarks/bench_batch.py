@@ -0,0 +1,130 @@
+"""Throughput of the batch applications API against the form flow, for a driving school.
+
+One school account submits --learners learning license applications and then books a
+driving test for each of them. The form flow posts every learner through
+/learning-license and /payment/learning and every booking through /driving-license
+and /payment/driving; the API sends them to /api/batch/applications in batches of
+--batch-size. Both run in-process through the Flask test client on their own SQLite
+file and report applications created per second.
+
+    python benchmarks/bench_batch.py --learners 500 --batch-size 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_flows import TestClientDriver, APPLICATION_ID, TIME_SLOTS, use_stub_templates
+
+CARD = {'card_number': '4111111111111111', 'card_holder': 'Bench School', 'expiry_date': '12/30', 'cvv': '123'}
+
+def learner(n):
+    return {
+        'name': f'Learner {n}', 'dob': '1995-06-15', 'gender': 'female', 'place_of_birth': 'Nagpur',
+        'phone': f'98{n:08d}', 'email': f'learner{n}@example.com', 'address': f'{n} School Road',
+        'city': 'Nagpur', 'state': 'MH', 'zip_code': '440001', 'blood_group': 'B+', 'rh_factor': 'positive',
+        'citizenship': 'Indian', 'document_type': 'aadhar',
+    }
+
+def booking(n, learning_id):
+    return {'learning_license_id': learning_id,
+            'test_date': (date.today() + timedelta(days=7 + n % 50)).isoformat(),
+            'test_time': TIME_SLOTS[n % len(TIME_SLOTS)]}
+
+def form_flow(app, learners):
+    driver = TestClientDriver(app)
+    user = f'school{uuid.uuid4().hex[:8]}'
+    driver.post('/signup', {'username': user, 'email': f'{user}@example.com',
+                            'password': 'school-password', 'confirm_password': 'school-password'})
+    driver.post('/login', {'username': user, 'password': 'school-password'})
+
+    requests = failed = 0
+    start = time.perf_counter()
+    learning_ids = []
+    for n in range(learners):
+        driver.post('/learning-license', learner(n))
+        _, body = driver.post('/payment/learning', CARD)
+        match = APPLICATION_ID.search(body)
+        requests += 2
+        if match:
+            learning_ids.append(match.group(0))
+        else:
+            failed += 1
+    for n, learning_id in enumerate(learning_ids):
+        driver.post('/driving-license', booking(n, learning_id))
+        _, body = driver.post('/payment/driving', CARD)
+        requests += 2
+        failed += APPLICATION_ID.search(body) is None
+    return learners * 2 - failed, failed, requests, time.perf_counter() - start
+
+def api_flow(app, learners, batch_size):
+    from app import db
+    from models import User
+    from batchapi import api_token_create
+
+    user = f'school{uuid.uuid4().hex[:8]}'
+    with app.app_context():
+        db.session.add(User(username=user, email=f'{user}@example.com', password_hash='-'))
+        db.session.commit()
+    output = app.test_cli_runner().invoke(api_token_create, [user, '--name', 'Bench School']).output
+    headers = {'Authorization': f'Bearer {output.split()[-1]}'}
+    client = app.test_client()
+
+    created = failed = requests = 0
+    start = time.perf_counter()
+    learning_ids = []
+    for first in range(0, learners, batch_size):
+        items = [dict(learner(n), type='learning') for n in range(first, min(first + batch_size, learners))]
+        results = client.post('/api/batch/applications', json={'applications': items}, headers=headers).json
+        requests += 1
+        learning_ids.extend(r['application_id'] for r in results['results'] if r['status'] == 'created')
+        created += results['created']
+        failed += results['rejected']
+    for first in range(0, len(learning_ids), batch_size):
+        items = [dict(booking(n, learning_ids[n]), type='driving')
+                 for n in range(first, min(first + batch_size, len(learning_ids)))]
+        results = client.post('/api/batch/applications', json={'applications': items}, headers=headers).json
+        requests += 1
+        created += results['created']
+        failed += results['rejected']
+    return created, failed, requests, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--learners', type=int, default=500)
+    parser.add_argument('--batch-size', type=int, default=100)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'batch.db')}"
+    os.environ['TEST_SLOT_CAPACITY'] = '100000'
+    os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+    os.environ['BATCH_MAX_ITEMS'] = str(max(args.batch_size, 1))
+
+    import logging
+    from app import app
+    from migrations import upgrade
+    logging.disable(logging.CRITICAL)
+    app.config['WTF_CSRF_ENABLED'] = False
+    use_stub_templates(app)
+    with app.app_context():
+        upgrade()
+
+    print(f'learners={args.learners} batch size={args.batch_size}')
+    failed = False
+    for label, run in (('form flow', lambda: form_flow(app, args.learners)),
+                       ('batch api', lambda: api_flow(app, args.learners, args.batch_size))):
+        created, rejected, requests, elapsed = run()
+        failed |= rejected > 0
+        print(f'{label:10} applications={created} failed={rejected} requests={requests} '
+              f'elapsed={elapsed:.2f}s applications/s={created / elapsed:.1f}')
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
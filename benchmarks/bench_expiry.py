@@ -0,0 +1,87 @@
+"""Throughput, memory and resume check for the nightly expiry sweep.
+
+Seeds --rows driving licenses with expiry dates spread over ten years, starts
+the sweep in a child process and kills it after --kill-after seconds, then
+resumes it in this process. Reports licenses/s and peak Python memory, and fails if
+any license in the window was missed or reminded twice.
+
+    python benchmarks/bench_expiry.py --rows 1000000 --days-ahead 365 --kill-after 2
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _sweep(days_ahead, batch_size):
+    from app import app, db
+    from expiry import sweep_expiring
+
+    with app.app_context():
+        db.engine.dispose()
+        sweep_expiring(days_ahead=days_ahead, batch_size=batch_size)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='rows per license table')
+    parser.add_argument('--days-ahead', type=int, default=365)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--kill-after', type=float, default=1.0, help='seconds before the first run is killed')
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'expiry.db')}"
+
+    from sqlalchemy import func
+    from app import app, db
+    from check_query_plans import seed
+    from expiry import sweep_expiring, SWEEP_NAME
+    from models import DrivingLicense, Job, SweepCheckpoint
+
+    with app.app_context():
+        seed(db, args.rows)
+        db.engine.dispose()
+
+    child = multiprocessing.Process(target=_sweep, args=(args.days_ahead, args.batch_size))
+    child.start()
+    child.join(args.kill_after)
+    if child.is_alive():
+        child.kill()
+        child.join()
+
+    with app.app_context():
+        db.engine.dispose()
+        checkpoint = db.session.get(SweepCheckpoint, SWEEP_NAME)
+        interrupted = checkpoint is not None and checkpoint.finished_at is None
+        print(f'rows={args.rows} killed after {args.kill_after}s interrupted={interrupted} '
+              f'checkpoint={checkpoint.processed if checkpoint else 0}')
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = sweep_expiring(days_ahead=args.days_ahead, batch_size=args.batch_size)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        checkpoint = db.session.get(SweepCheckpoint, SWEEP_NAME)
+        expected = DrivingLicense.query.filter(
+            DrivingLicense.expiry_date >= checkpoint.window_start,
+            DrivingLicense.expiry_date <= checkpoint.window_end,
+            DrivingLicense.status != 'Failed').count()
+        due = DrivingLicense.query.filter(DrivingLicense.renewal_due_for == DrivingLicense.expiry_date).count()
+        reminders = Job.query.filter_by(name='send_renewal_reminder').count()
+        keys = db.session.query(func.count(func.distinct(Job.key))).filter(Job.name == 'send_renewal_reminder').scalar()
+
+    print(f"resumed      scanned={result['scanned']} marked={result['marked']} elapsed={elapsed:.2f}s "
+          f"rate={result['marked'] / elapsed:.0f} licenses/s")
+    print(f'peak python memory={peak / 2 ** 20:.1f} MiB')
+    print(f'in window={expected} marked due={due} reminders={reminders} distinct={keys}')
+    return 0 if expected == due == reminders == keys else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""End-to-end benchmark of the licensing user journeys.
+
+Each journey walks signup -> login -> learning license with upload -> payment
+-> driving test booking -> payment -> renewal -> payment -> change details ->
+status check. Journeys run in-process through the Flask test client, or over
+HTTP against a running server from several processes. Reports p50/p95/p99
+latency and requests per second per route and saves the results as JSON so
+runs can be compared across commits.
+
+    python benchmarks/bench_flows.py --journeys 200 --output before.json
+    python benchmarks/bench_flows.py --database-url postgresql://localhost/dlbench --output pg.json
+    python benchmarks/bench_flows.py --base-url http://127.0.0.1:5000 --processes 8 --journeys 100
+    python benchmarks/bench_flows.py --journeys 200 --output after.json --compare before.json
+"""
+import argparse
+import http.cookiejar
+import json
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from datetime import date, timedelta
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPLICATION_ID = re.compile(r'APP\d{12}[0-9A-Z]{4}')
+LICENSE_NUMBER = re.compile(r'DL\d{8}[0-9A-Z]{6}')
+CSRF_TOKEN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+TIME_SLOTS = ['09:00', '10:00', '11:00', '12:00', '13:00', '14:00', '15:00', '16:00']
+DOCUMENT = b'%PDF-1.4\n' + b'0' * 200 * 1024
+
+class TestClientDriver:
+    """Requests through the Flask test client, in this process"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.get_data(as_text=True)
+
+    def post(self, path, data, files=None):
+        data = dict(data)
+        for name, (filename, content) in (files or {}).items():
+            data[name] = (BytesIO(content), filename)
+        response = self.client.post(path, data=data, content_type='multipart/form-data' if files else None)
+        return response.status_code, response.get_data(as_text=True)
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HttpDriver:
+    """Requests over HTTP with a cookie jar; CSRF tokens are taken from the preceding GET"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+        self.csrf_token = None
+
+    def _open(self, request):
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                status, body = response.status, response.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as error:
+            status, body = error.code, error.read().decode('utf-8', 'replace')
+        match = CSRF_TOKEN.search(body)
+        if match:
+            self.csrf_token = match.group(1)
+        return status, body
+
+    def get(self, path):
+        return self._open(urllib.request.Request(self.base_url + path))
+
+    def post(self, path, data, files=None):
+        if self.csrf_token is None:
+            self.get(path)
+        data = dict(data, csrf_token=self.csrf_token or '')
+        if not files:
+            body = urllib.parse.urlencode(data).encode()
+            content_type = 'application/x-www-form-urlencoded'
+        else:
+            boundary = uuid.uuid4().hex
+            parts = []
+            for name, value in data.items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+            for name, (filename, content) in files.items():
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; '
+                             f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+                parts.append(content + b'\r\n')
+            parts.append(f'--{boundary}--\r\n'.encode())
+            body = b''.join(parts)
+            content_type = f'multipart/form-data; boundary={boundary}'
+        request = urllib.request.Request(self.base_url + path, data=body, headers={'Content-Type': content_type})
+        return self._open(request)
+
+def journey(driver, n, timings, errors):
+    """One applicant's complete flow; every request is timed under its route name"""
+    def step(route, method, path, data=None, files=None, expect=(200, 302)):
+        start = time.perf_counter()
+        status, body = driver.get(path) if method == 'GET' else driver.post(path, data, files)
+        timings.setdefault(route, []).append(time.perf_counter() - start)
+        if status not in expect:
+            errors[route] = errors.get(route, 0) + 1
+        return body
+
+    user = f'bench{uuid.uuid4().hex[:12]}'
+    password = 'benchmark-password'
+    card = {'card_number': '4111111111111111', 'card_holder': 'Bench User', 'expiry_date': '12/30', 'cvv': '123'}
+    applicant = {
+        'name': 'Bench User', 'dob': '1990-01-01', 'gender': 'other', 'place_of_birth': 'Pune',
+        'phone': '9876543210', 'email': f'{user}@example.com', 'address': '1 Main Road', 'city': 'Pune',
+        'state': 'MH', 'zip_code': '411001', 'blood_group': 'O+', 'rh_factor': 'positive',
+        'citizenship': 'Indian', 'document_type': 'aadhar',
+    }
+
+    step('signup', 'POST', '/signup', {'username': user, 'email': f'{user}@example.com',
+                                      'password': password, 'confirm_password': password})
+    step('login', 'POST', '/login', {'username': user, 'password': password})
+    step('learning_license', 'POST', '/learning-license', applicant, files={'document': ('id.pdf', DOCUMENT)})
+    body = step('payment', 'POST', '/payment/learning', card)
+    learning_id = APPLICATION_ID.search(body)
+    if not learning_id:
+        errors['journey'] = errors.get('journey', 0) + 1
+        return
+
+    test_date = date.today() + timedelta(days=7 + n % 50)
+    step('driving_license', 'POST', '/driving-license', {'learning_license_id': learning_id.group(0),
+                                                         'test_date': test_date.isoformat(),
+                                                         'test_time': TIME_SLOTS[n % len(TIME_SLOTS)]})
+    body = step('payment', 'POST', '/payment/driving', card)
+    license_number = LICENSE_NUMBER.search(body)
+    if not license_number:
+        errors['journey'] = errors.get('journey', 0) + 1
+        return
+    license_number = license_number.group(0)
+
+    step('renew_license', 'POST', '/renew-license', {'license_number': license_number, 'renewal_reason': 'expiring'})
+    step('payment', 'POST', '/payment/renewal', card)
+    step('change_details', 'POST', '/change-details', {'license_number': license_number})
+    step('change_details', 'POST', '/change-details', {'license_number': license_number, 'address': '2 New Road',
+                                                       'city': 'Mumbai', 'state': 'MH', 'zip_code': '400001',
+                                                       'phone': '9876500000'})
+    step('application_status', 'POST', '/application-status', {'application_id': learning_id.group(0)})
+
+def use_stub_templates(app):
+    """Without the page templates, render the values the journey needs to continue"""
+    if os.path.isdir(os.path.join(app.root_path, app.template_folder)):
+        return
+    from jinja2 import DictLoader
+    page = '{{ application_id }} {{ license_number }}'
+    app.jinja_loader = DictLoader({name: page for name in (
+        'login.html', 'signup.html', 'home.html', 'learning_license.html', 'driving_license.html',
+        'renew_license.html', 'change_details.html', 'application_status.html', 'check_rc.html',
+        'payment.html', 'confirmation.html', 'dashboard.html')})
+
+def _http_worker(args):
+    base_url, journeys, offset = args
+    timings, errors = {}, {}
+    for n in range(journeys):
+        journey(HttpDriver(base_url), offset + n, timings, errors)
+    return timings, errors
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+def summarize(timings, errors, elapsed):
+    routes = {}
+    for route, values in sorted(timings.items()):
+        routes[route] = {
+            'count': len(values),
+            'errors': errors.get(route, 0),
+            'rps': len(values) / elapsed,
+            'mean_ms': sum(values) / len(values) * 1000,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+        }
+    return routes
+
+def run_test_client(args):
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'flows.db')}"
+    os.environ.setdefault('TEST_SLOT_CAPACITY', '100000')
+
+    import logging
+    from app import app
+    from migrations import upgrade
+    logging.disable(logging.CRITICAL)
+    with app.app_context():
+        upgrade()
+    app.config['WTF_CSRF_ENABLED'] = False
+    use_stub_templates(app)
+
+    timings, errors = {}, {}
+    journey(TestClientDriver(app), 0, {}, {})  # warm up
+    start = time.perf_counter()
+    for n in range(args.journeys):
+        journey(TestClientDriver(app), n, timings, errors)
+    return timings, errors, time.perf_counter() - start
+
+def run_http(args):
+    per_process = max(args.journeys // args.processes, 1)
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(_http_worker, [(args.base_url, per_process, i * per_process)
+                                          for i in range(args.processes)])
+    elapsed = time.perf_counter() - start
+    timings, errors = {}, {}
+    for process_timings, process_errors in results:
+        for route, values in process_timings.items():
+            timings.setdefault(route, []).extend(values)
+        for route, count in process_errors.items():
+            errors[route] = errors.get(route, 0) + count
+    return timings, errors, elapsed
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results, baseline=None):
+    print(f"commit={results['commit']} mode={results['mode']} database={results['database']} "
+          f"journeys={results['journeys']} elapsed={results['elapsed']:.1f}s")
+    print(f"{'route':20} {'count':>6} {'err':>4} {'req/s':>8} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8}"
+          + (f" {'p95 Δ':>8} {'req/s Δ':>8}" if baseline else ''))
+    for route, stats in results['routes'].items():
+        line = (f"{route:20} {stats['count']:6d} {stats['errors']:4d} {stats['rps']:8.1f} "
+                f"{stats['p50_ms']:8.1f} {stats['p95_ms']:8.1f} {stats['p99_ms']:8.1f}")
+        before = baseline['routes'].get(route) if baseline else None
+        if before:
+            line += (f" {(stats['p95_ms'] / before['p95_ms'] - 1) * 100:+7.1f}%"
+                     f" {(stats['rps'] / before['rps'] - 1) * 100:+7.1f}%")
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--journeys', type=int, default=100)
+    parser.add_argument('--base-url', help='benchmark a running server over HTTP instead of the test client')
+    parser.add_argument('--processes', type=int, default=4, help='load generator processes for --base-url')
+    parser.add_argument('--database-url', help='test client mode; defaults to a temporary SQLite file')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    if args.base_url:
+        timings, errors, elapsed = run_http(args)
+        mode, database = 'http', args.base_url
+    else:
+        timings, errors, elapsed = run_test_client(args)
+        mode, database = 'test-client', os.environ['DATABASE_URL'].split(':', 1)[0]
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mode': mode,
+        'database': database,
+        'journeys': args.journeys,
+        'elapsed': elapsed,
+        'journey_errors': errors.get('journey', 0),
+        'routes': summarize(timings, errors, elapsed),
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Multi-process collision check for the application ID and license number allocator.
+
+Each worker process allocates --count application IDs and license numbers as
+fast as it can; the script reports the combined rate and fails if any ID was
+issued twice.
+
+    python benchmarks/bench_ids.py --processes 8 --count 50000
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _allocate(count):
+    from app import app, db
+    from utils import generate_application_id, generate_license_number
+
+    with app.app_context():
+        db.engine.dispose()
+        start = time.perf_counter()
+        application_ids = [generate_application_id() for _ in range(count)]
+        license_numbers = [generate_license_number() for _ in range(count)]
+        elapsed = time.perf_counter() - start
+    return application_ids, license_numbers, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--count', type=int, default=50000, help='IDs of each kind per process')
+    parser.add_argument('--block-size', type=int, default=100)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'ids.db')}"
+
+    from app import app, db
+    app.config['ID_BLOCK_SIZE'] = args.block_size
+    from ids import id_allocator
+    id_allocator.init_app(app)
+    from migrations import upgrade
+    with app.app_context():
+        upgrade()
+        db.engine.dispose()
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        results = pool.map(_allocate, [args.count] * args.processes)
+    elapsed = time.perf_counter() - start
+
+    application_ids = [i for r in results for i in r[0]]
+    license_numbers = [i for r in results for i in r[1]]
+    total = len(application_ids) + len(license_numbers)
+    duplicates = (len(application_ids) - len(set(application_ids))) + (len(license_numbers) - len(set(license_numbers)))
+    too_long = sum(len(i) > 20 for i in application_ids + license_numbers)
+
+    print(f'processes={args.processes} ids={total} block_size={args.block_size}')
+    print(f'elapsed={elapsed:.2f}s rate={total / elapsed:.0f} ids/s')
+    print(f'sample {application_ids[0]} {license_numbers[0]}')
+    print(f'duplicates={duplicates} over_length={too_long}')
+    return 1 if duplicates or too_long else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""Overhead of the request metrics middleware.
+
+Drives a cheap database-backed route through the test client with metrics
+switched off and on, alternating rounds to cancel out warm-up effects, and
+reports the per-request cost of instrumentation.
+
+    python benchmarks/bench_metrics.py --requests 5000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000, help='requests per round')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'metrics.db')}"
+    os.environ['SESSION_BACKEND'] = 'cookie'
+
+    from app import app
+    from metrics import metrics
+    from migrations import upgrade
+    logging.disable(logging.CRITICAL)
+    with app.app_context():
+        upgrade()
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(args.requests):
+            client.get('/test-slots')
+        return (time.perf_counter() - start) / args.requests
+
+    run()
+    timings = {False: [], True: []}
+    for _ in range(args.rounds):
+        for enabled in (False, True):
+            metrics.enabled = enabled
+            timings[enabled].append(run())
+
+    off, on = min(timings[False]), min(timings[True])
+    print(f'route=/test-slots requests={args.requests} rounds={args.rounds}')
+    print(f'metrics off: {off * 1e6:8.1f} us/request  {1 / off:7.0f} req/s')
+    print(f'metrics on:  {on * 1e6:8.1f} us/request  {1 / on:7.0f} req/s')
+    print(f'overhead:    {(on - off) * 1e6:8.1f} us/request ({(on - off) / off * 100:.1f}%)')
+
+if __name__ == '__main__':
+    main()
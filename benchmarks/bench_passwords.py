@@ -0,0 +1,68 @@
+"""Password hashing throughput per work factor.
+
+Reports logins (hash verifications) per second on one core and through the
+PasswordHasher process pool for each cost setting.
+
+    python benchmarks/bench_passwords.py --workers 4 --logins 200
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import PasswordHasher, HasherBusy
+
+METHODS = [
+    'scrypt:16384:8:1',
+    'scrypt:32768:8:1',
+    'scrypt:65536:8:1',
+    'pbkdf2:sha256:260000',
+    'pbkdf2:sha256:600000',
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--logins', type=int, default=200, help='logins per cost setting')
+    parser.add_argument('--methods', nargs='*', default=METHODS)
+    args = parser.parse_args()
+
+    print(f"{'method':24} {'per core/s':>10} {'pool/s':>8} {'pool/s/core':>11} {'shed':>5}")
+    for method in args.methods:
+        stored = generate_password_hash('correct horse battery', method=method)
+
+        single = max(args.logins // 10, 5)
+        start = time.perf_counter()
+        for _ in range(single):
+            check_password_hash(stored, 'correct horse battery')
+        per_core = single / (time.perf_counter() - start)
+
+        app = Flask(__name__)
+        app.config.update(PASSWORD_HASH_METHOD=method, PASSWORD_HASH_WORKERS=args.workers,
+                          PASSWORD_HASH_MAX_PENDING=args.workers * 4, PASSWORD_HASH_TIMEOUT=60)
+        hasher = PasswordHasher(app)
+        hasher.verify(stored, 'warm up')
+
+        shed = 0
+        def login(_):
+            nonlocal shed
+            try:
+                hasher.verify(stored, 'correct horse battery')
+            except HasherBusy:
+                shed += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.workers * 4) as clients:
+            list(clients.map(login, range(args.logins)))
+        pooled = (args.logins - shed) / (time.perf_counter() - start)
+        hasher.shutdown()
+
+        print(f'{method:24} {per_core:10.1f} {pooled:8.1f} {pooled / args.workers:11.1f} {shed:5d}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""Payment flow against the local fake gateway: sync charges against async callbacks.
+
+Starts benchmarks/fake_gateway.py with the given latency and failure rates, then the
+pre-fork server once per payment mode with few threads, so it shows how long a
+gateway round trip holds a worker. Load generator processes submit learning license
+applications and pay for them while a probe keeps requesting /login; reports
+payment latency, probe latency (what other users see while workers wait on the
+gateway) and throughput. Afterwards every payment must be settled exactly once:
+none left pending in the database and no charge taken twice by the gateway.
+
+    python benchmarks/bench_payments.py --payments 200 --latency 0.4 --error-rate 0.05
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_flows import HttpDriver, APPLICATION_ID, percentile
+from bench_server import free_port, wait_for_port
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SECRET = 'bench-webhook-secret'
+CARD = {'card_number': '4111111111111111', 'card_holder': 'Bench User', 'expiry_date': '12/30', 'cvv': '123'}
+
+def _payer(args):
+    base_url, payments = args
+    driver = HttpDriver(base_url)
+    user = f'pay{uuid.uuid4().hex[:12]}'
+    driver.post('/signup', {'username': user, 'email': f'{user}@example.com',
+                            'password': 'benchmark-password', 'confirm_password': 'benchmark-password'})
+    driver.post('/login', {'username': user, 'password': 'benchmark-password'})
+    timings, failed = [], 0
+    for n in range(payments):
+        driver.post('/learning-license', {
+            'name': 'Bench User', 'dob': '1990-01-01', 'gender': 'other', 'place_of_birth': 'Pune',
+            'phone': '9876543210', 'email': f'{user}@example.com', 'address': '1 Main Road', 'city': 'Pune',
+            'state': 'MH', 'zip_code': '411001', 'blood_group': 'O+', 'rh_factor': 'positive',
+            'citizenship': 'Indian', 'document_type': 'aadhar'})
+        start = time.perf_counter()
+        status, body = driver.post('/payment/learning', CARD)
+        timings.append(time.perf_counter() - start)
+        # 402 is a declined card, which the gateway is set to do now and then
+        failed += status >= 500 or (status == 200 and not APPLICATION_ID.search(body))
+    return timings, failed
+
+def _probe(base_url, stop, timings):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            urllib.request.urlopen(f'{base_url}/login', timeout=60).read()
+        except OSError:
+            pass
+        timings.append(time.perf_counter() - start)
+        time.sleep(0.05)
+
+def _get_json(url):
+    with urllib.request.urlopen(url, timeout=10) as response:
+        return json.load(response)
+
+def run(mode, args, tmpdir, gateway_url):
+    database = os.path.join(tmpdir, f'{mode}.db')
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{database}', PAYMENT_MODE=mode,
+               PAYMENT_GATEWAY_URL=gateway_url, PAYMENT_WEBHOOK_SECRET=SECRET,
+               PAYMENT_READ_TIMEOUT=str(args.read_timeout), PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+               PASSWORD_HASH_MAX_PENDING='1000', WEB_CONCURRENCY=str(args.workers), WEB_THREADS=str(args.threads))
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, 'bench_server.py'), '--serve', 'prefork',
+                               '--port', str(port)], env=env, cwd=tmpdir,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f'http://127.0.0.1:{port}'
+    before = _get_json(f'{gateway_url}/stats')
+    try:
+        wait_for_port(port)
+        probe_timings, stop = [], threading.Event()
+        probe = threading.Thread(target=_probe, args=(base_url, stop, probe_timings))
+        probe.start()
+        per_process = max(args.payments // args.processes, 1)
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.map(_payer, [(base_url, per_process)] * args.processes)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        probe.join()
+
+        # Callbacks of async payments may still be on their way
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            with sqlite3.connect(database) as conn:
+                pending = conn.execute("SELECT count(*) FROM payment WHERE status = 'pending'").fetchone()[0]
+            if not pending:
+                break
+            time.sleep(0.5)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(60)
+
+    with sqlite3.connect(database) as conn:
+        statuses = dict(conn.execute('SELECT status, count(*) FROM payment GROUP BY status'))
+    after = _get_json(f'{gateway_url}/stats')
+    gateway = {name: after[name] - before[name] for name in after}
+    timings = [t for process_timings, _ in results for t in process_timings]
+    return {
+        'payments': len(timings),
+        'failed': sum(failed for _, failed in results),
+        'rps': len(timings) / elapsed,
+        'payment_p50_ms': percentile(timings, 0.50) * 1000,
+        'payment_p95_ms': percentile(timings, 0.95) * 1000,
+        'probe_p50_ms': percentile(probe_timings, 0.50) * 1000 if probe_timings else 0,
+        'probe_p95_ms': percentile(probe_timings, 0.95) * 1000 if probe_timings else 0,
+        'statuses': statuses,
+        'gateway': gateway,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--payments', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=8, help='load generator processes')
+    parser.add_argument('--workers', type=int, default=1, help='pre-fork worker processes')
+    parser.add_argument('--threads', type=int, default=4, help='threads per pre-fork worker')
+    parser.add_argument('--latency', type=float, default=0.4, help='gateway seconds per charge')
+    parser.add_argument('--error-rate', type=float, default=0.05, help='share of charges answered 503')
+    parser.add_argument('--decline-rate', type=float, default=0.02)
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='share of charges that stall')
+    parser.add_argument('--stall', type=float, default=3.0, help='seconds a stalled charge takes')
+    parser.add_argument('--read-timeout', type=float, default=8.0, help="the application's gateway read timeout")
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    gateway_port = free_port()
+    gateway_url = f'http://127.0.0.1:{gateway_port}'
+    gateway = subprocess.Popen([sys.executable, os.path.join(HERE, 'fake_gateway.py'), '--port', str(gateway_port),
+                                '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+                                '--decline-rate', str(args.decline_rate), '--timeout-rate', str(args.timeout_rate),
+                                '--stall', str(args.stall), '--webhook-secret', SECRET],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    failed = False
+    try:
+        wait_for_port(gateway_port)
+        print(f'payments={args.payments} load processes={args.processes} workers={args.workers} '
+              f'threads={args.threads} gateway latency={args.latency}s error rate={args.error_rate} '
+              f'decline rate={args.decline_rate} stall rate={args.timeout_rate}')
+        for mode in ('sync', 'async'):
+            stats = run(mode, args, tmpdir, gateway_url)
+            gw = stats['gateway']
+            twice = gw['charges'] != sum(stats['statuses'].values())
+            failed |= stats['failed'] > 0 or 'pending' in stats['statuses'] or twice
+            print(f"{mode:6} payments={stats['payments']} errors={stats['failed']} rps={stats['rps']:.1f} "
+                  f"payment p50={stats['payment_p50_ms']:.0f}ms p95={stats['payment_p95_ms']:.0f}ms "
+                  f"probe p50={stats['probe_p50_ms']:.0f}ms p95={stats['probe_p95_ms']:.0f}ms")
+            print(f"       settled={stats['statuses']} gateway charges={gw['charges']} 503s={gw['errors']} "
+                  f"replayed={gw['replayed']} connections={gw['connections']} callbacks={gw['callbacks']}")
+    finally:
+        gateway.send_signal(signal.SIGINT)
+        gateway.wait(10)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Storage and write throughput of shared applicant profiles against the old copied columns.
+
+Writes --rows learning licenses plus a driving license for each in the old
+layout, where every license carries its own copy of the applicant's details as
+strings, and in the normalized layout with one coded applicant profile per pair.
+Then migrates the old database in place and checks that every license kept its
+details, including addresses changed through the driving license.
+
+    python benchmarks/bench_profiles.py --rows 200000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Date, DateTime, Integer, MetaData, String, Table, create_engine, insert, text
+
+def legacy_metadata():
+    """The license tables as they were before applicant profiles"""
+    metadata = MetaData()
+
+    def person():
+        return [
+            Column('name', String(100), nullable=False), Column('dob', Date, nullable=False),
+            Column('gender', String(10), nullable=False), Column('place_of_birth', String(100), nullable=False),
+            Column('phone', String(15), nullable=False), Column('email', String(120), nullable=False),
+            Column('address', String(200), nullable=False), Column('city', String(50), nullable=False),
+            Column('state', String(50), nullable=False), Column('zip_code', String(10), nullable=False),
+            Column('blood_group', String(5), nullable=False), Column('rh_factor', String(10), nullable=False),
+            Column('citizenship', String(50), nullable=False),
+        ]
+
+    Table('learning_license', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('application_id', String(20), unique=True, nullable=False),
+          Column('user_id', Integer, nullable=False, index=True),
+          *person(),
+          Column('license_type', String(50)),
+          Column('document_type', String(50), nullable=False),
+          Column('document_path', String(255)),
+          Column('document_sha256', String(64)),
+          Column('document_size', Integer),
+          Column('status', String(20), index=True),
+          Column('apply_date', DateTime))
+    Table('driving_license', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('application_id', String(20), unique=True, nullable=False),
+          Column('license_number', String(20), unique=True, nullable=False),
+          Column('user_id', Integer, nullable=False, index=True),
+          Column('learning_license_id', String(20), nullable=False, index=True),
+          *person(),
+          Column('license_type', String(50)),
+          Column('test_date', Date, nullable=False),
+          Column('test_time', String(10), nullable=False),
+          Column('status', String(20), index=True),
+          Column('apply_date', DateTime),
+          Column('issue_date', DateTime),
+          Column('expiry_date', DateTime, nullable=False, index=True),
+          Column('renewal_due_for', DateTime))
+    return metadata
+
+def applicant(i):
+    return {
+        'name': f'Applicant {i}', 'dob': date(1980, 1, 1) + timedelta(days=i % 9000),
+        'gender': ('male', 'female', 'other')[i % 3], 'place_of_birth': 'Pune', 'phone': f'9{i:09d}',
+        'email': f'applicant{i}@example.com', 'address': f'{i} Main Road', 'city': 'Pune', 'state': 'Maharashtra',
+        'zip_code': '411001', 'blood_group': ('A+', 'B+', 'O+', 'AB-')[i % 4], 'rh_factor': 'positive',
+        'citizenship': 'Indian',
+    }
+
+def changed(i):
+    """Every tenth driving license had its address changed through change_details()"""
+    return {'address': f'{i} New Street', 'phone': f'8{i:09d}'} if i % 10 == 0 else {}
+
+def learning_row(i, now):
+    return {'id': i + 1, 'application_id': f'APP{i:012d}', 'user_id': i % 1000 + 1, 'license_type': 'Learning License',
+            'document_type': 'aadhar', 'document_path': '', 'status': ('Processing', 'Approved')[i % 2],
+            'apply_date': now}
+
+def driving_row(i, now):
+    return {'application_id': f'APD{i:012d}', 'license_number': f'DL{i:012d}', 'user_id': i % 1000 + 1,
+            'learning_license_id': f'APP{i:012d}', 'license_type': 'Driving License', 'test_date': date.today(),
+            'test_time': '10:00', 'status': ('Scheduled', 'Passed')[i % 2], 'apply_date': now,
+            'expiry_date': now + timedelta(days=3650)}
+
+def write(engine, rows, chunk_size, tables):
+    """Insert rows through each (table, make_row) in chunks; returns seconds taken"""
+    now = datetime.now()
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for first in range(0, rows, chunk_size):
+            indexes = range(first, min(first + chunk_size, rows))
+            for target, make_row in tables:
+                conn.execute(insert(target), [make_row(i, now) for i in indexes])
+    return time.perf_counter() - start
+
+def size(engine, path):
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text('VACUUM'))
+    return os.path.getsize(path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='learning and driving license pairs')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    legacy_path = os.path.join(tmpdir, 'legacy.db')
+    normalized_path = os.path.join(tmpdir, 'normalized.db')
+    os.environ['DATABASE_URL'] = f'sqlite:///{legacy_path}'
+
+    # Old layout, as databases created before applicant profiles have it
+    legacy_engine = create_engine(f'sqlite:///{legacy_path}')
+    legacy = legacy_metadata()
+    legacy.create_all(legacy_engine)
+    legacy_elapsed = write(legacy_engine, args.rows, args.chunk_size, [
+        (legacy.tables['learning_license'], lambda i, now: dict(learning_row(i, now), **applicant(i))),
+        (legacy.tables['driving_license'], lambda i, now: {**driving_row(i, now), **applicant(i), **changed(i)}),
+    ])
+    legacy_size = size(legacy_engine, legacy_path)
+    legacy_engine.dispose()
+
+    from app import app, db
+    from models import ApplicantProfile, LearningLicense, DrivingLicense
+    from migrations import upgrade
+
+    # New layout in its own database
+    normalized_engine = create_engine(f'sqlite:///{normalized_path}')
+    db.metadata.create_all(normalized_engine)
+    normalized_elapsed = write(normalized_engine, args.rows, args.chunk_size, [
+        (ApplicantProfile.__table__, lambda i, now: {**applicant(i), **changed(i), 'id': i + 1}),
+        (LearningLicense.__table__, lambda i, now: dict(learning_row(i, now), profile_id=i + 1)),
+        (DrivingLicense.__table__, lambda i, now: dict(driving_row(i, now), profile_id=i + 1)),
+    ])
+    normalized_size = size(normalized_engine, normalized_path)
+
+    with app.app_context():
+        start = time.perf_counter()
+        upgrade()
+        migrate_elapsed = time.perf_counter() - start
+        migrated_size = size(db.engine, legacy_path)
+
+        problems = 0
+        for i in range(0, args.rows, max(args.rows // 1000, 1)):
+            driving_license = DrivingLicense.query.filter_by(license_number=f'DL{i:012d}').one()
+            learning_license = driving_license.learning_license
+            expected = {**applicant(i), **changed(i)}
+            actual = {name: getattr(learning_license, name) for name in expected}
+            if (actual != expected or driving_license.profile_id != learning_license.profile_id
+                    or learning_license.status != ('Processing', 'Approved')[i % 2]
+                    or driving_license.status != ('Scheduled', 'Passed')[i % 2]):
+                problems += 1
+        profiles = db.session.query(ApplicantProfile).count()
+
+    pairs = args.rows
+    print(f'license pairs={pairs}')
+    for label, nbytes, elapsed in (('copied columns', legacy_size, legacy_elapsed),
+                                   ('shared profiles', normalized_size, normalized_elapsed)):
+        print(f'{label:16} size={nbytes / 2 ** 20:7.1f} MiB bytes/pair={nbytes / pairs:6.0f} '
+              f'write={pairs / elapsed:7.0f} pairs/s')
+    print(f'savings          size={1 - normalized_size / legacy_size:.0%} '
+          f'write time={1 - normalized_elapsed / legacy_elapsed:.0%}')
+    print(f'migration        elapsed={migrate_elapsed:.2f}s size after={migrated_size / 2 ** 20:.1f} MiB '
+          f'profiles={profiles} mismatches={problems}')
+    return 1 if problems or profiles != pairs else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
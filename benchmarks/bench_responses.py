@@ -0,0 +1,158 @@
+"""Bytes on the wire and latency of the GET pages, before and after the response layer.
+
+Signs up and walks one applicant through the journeys so the logged-in pages have
+content, then fetches every page as a mobile browser would (Accept-Encoding:
+gzip, deflate, br) with compression and ETags off ("before") and on ("after"),
+and revalidates each page with its ETag. Also times the first render of every
+page with cold template caches against after the startup warm-up.
+
+Without the page templates in the tree, pages render from stand-in templates of
+typical size: a shared layout with inline styles, navigation and footer, and each
+page's form fields.
+
+    python benchmarks/bench_responses.py --requests 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_flows import TestClientDriver, journey
+
+PAGES = ['/login', '/signup', '/home', '/check-rc', '/learning-license', '/driving-license', '/renew-license',
+         '/change-details', '/application-status', '/dashboard', '/api/applications']
+ANONYMOUS = {'/login', '/signup'}
+ACCEPT_ENCODING = 'gzip, deflate, br'
+
+STYLE = ''.join(f'.c{i}{{margin:{i % 7}px;padding:{i % 5}px;color:#{i * 2654435 % 0xffffff:06x};'
+                f'border:1px solid #ddd;font-size:{12 + i % 6}px}}\n' for i in range(120))
+LAYOUT = '''<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{% block title %}Smart DL Service{% endblock %}</title><style>''' + STYLE + '''</style></head>
+<body><nav class="navbar navbar-expand-lg navbar-dark bg-primary"><div class="container">
+<a class="navbar-brand" href="/home">Smart DL Service</a><ul class="navbar-nav">
+''' + ''.join(f'<li class="nav-item"><a class="nav-link" href="{path}">{path.strip("/").replace("-", " ").title()}</a></li>\n'
+              for path in PAGES) + '''</ul></div></nav>
+<main class="container my-4">
+{% for category, message in get_flashed_messages(with_categories=true) %}
+<div class="alert alert-{{ category }}">{{ message }}</div>{% endfor %}
+{% block content %}{% endblock %}</main>
+<footer class="footer bg-light py-3"><div class="container"><p class="text-muted">Smart Driving License Service.
+Applications are processed in the order received. For help contact your regional transport office.</p></div></footer>
+</body></html>'''
+PAGE = '''{% extends "base.html" %}{% block content %}
+<h1 class="mb-4">{{ license_type }}</h1><p>{{ application_id }} {{ license_number }}</p>
+{% if form %}<form method="post" enctype="multipart/form-data" class="card p-4">{{ form.hidden_tag() }}
+{% for field in form if field.widget.input_type != 'hidden' %}<div class="mb-3">{{ field.label(class_='form-label') }}
+{{ field(class_='form-control') }}<div class="form-text">Enter your {{ field.label.text|lower }} exactly as on your documents.</div></div>
+{% endfor %}</form>{% endif %}
+{% if application %}<dl>{% for key, value in application.items() %}<dt>{{ key }}</dt><dd>{{ value }}</dd>{% endfor %}</dl>{% endif %}
+{% for item in applications or [] %}<div class="card mb-2"><div class="card-body"><h5>{{ item.type }} {{ item.license_number }}</h5>
+<p>Status: {{ item.status }}, applied {{ item.apply_date }}, estimate {{ item.estimate }}</p></div></div>{% endfor %}
+{% endblock %}'''
+TEMPLATES = ['login.html', 'signup.html', 'home.html', 'learning_license.html', 'driving_license.html',
+             'renew_license.html', 'change_details.html', 'application_status.html', 'check_rc.html', 'payment.html',
+             'confirmation.html', 'dashboard.html']
+
+def use_sized_templates(app):
+    if os.path.isdir(os.path.join(app.root_path, app.template_folder)):
+        return
+    from jinja2 import DictLoader
+    app.jinja_loader = DictLoader({'base.html': LAYOUT, **{name: PAGE for name in TEMPLATES}})
+
+def wire_bytes(response):
+    headers = sum(len(name) + len(value) + 4 for name, value in response.headers.items())
+    return len(response.get_data()) + headers + len('HTTP/1.1 200 OK\r\n\r\n')
+
+def fetch(clients, path, headers=None):
+    client = clients['anonymous' if path in ANONYMOUS else 'user']
+    return client.get(path, headers=dict(headers or {}, **{'Accept-Encoding': ACCEPT_ENCODING}))
+
+def measure(clients, requests):
+    rows = {}
+    for path in PAGES:
+        first = fetch(clients, path)
+        etag = first.headers.get('ETag')
+        start = time.perf_counter()
+        for _ in range(requests):
+            fetch(clients, path)
+        latency = (time.perf_counter() - start) / requests
+        revalidated = fetch(clients, path, {'If-None-Match': etag}) if etag else first
+        rows[path] = {'status': first.status_code, 'bytes': wire_bytes(first), 'encoding': first.headers.get(
+            'Content-Encoding', '-'), 'latency_ms': latency * 1000, 'revalidated_status': revalidated.status_code,
+            'revalidated_bytes': wire_bytes(revalidated)}
+    return rows
+
+def first_renders(app, clients, warm):
+    from responses import response_optimizer
+    app.jinja_env.cache.clear()
+    if warm:
+        response_optimizer.warm_templates()
+    timings = []
+    for path in PAGES:
+        start = time.perf_counter()
+        fetch(clients, path)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per page')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'responses.db')}"
+    os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+
+    import logging
+    from app import app
+    from migrations import upgrade
+    from responses import response_optimizer, brotli
+    logging.disable(logging.CRITICAL)
+    app.config['WTF_CSRF_ENABLED'] = False
+    use_sized_templates(app)
+    with app.app_context():
+        upgrade()
+
+    driver = TestClientDriver(app)
+    errors = {}
+    journey(driver, 0, {}, errors)
+    if errors:
+        print(f'journey failed: {errors}')
+        return 1
+    clients = {'user': driver.client, 'anonymous': app.test_client()}
+
+    results = {}
+    for label, enabled in (('before', False), ('after', True)):
+        response_optimizer.compress = response_optimizer.etags = enabled
+        results[label] = measure(clients, args.requests)
+        results[label + '_cold'] = first_renders(app, clients, warm=False)
+        results[label + '_warm'] = first_renders(app, clients, warm=True)
+
+    before, after = results['before'], results['after']
+    print(f"brotli={'yes' if brotli else 'no (gzip only)'} requests per page={args.requests}")
+    print(f"{'page':20} {'before':>8} {'after':>8} {'enc':>5} {'304':>6} {'ms before':>10} {'ms after':>9}")
+    for path in PAGES:
+        b, a = before[path], after[path]
+        print(f"{path:20} {b['bytes']:8} {a['bytes']:8} {a['encoding']:>5} {a['revalidated_bytes']:6} "
+              f"{b['latency_ms']:10.2f} {a['latency_ms']:9.2f}")
+    total_before = sum(row['bytes'] for row in before.values())
+    total_after = sum(row['bytes'] for row in after.values())
+    total_304 = sum(row['revalidated_bytes'] for row in after.values())
+    print(f'total bytes: before={total_before} after={total_after} ({1 - total_after / total_before:.0%} less) '
+          f'revalidated={total_304} ({1 - total_304 / total_before:.0%} less)')
+    print(f"mean latency: before={sum(r['latency_ms'] for r in before.values()) / len(PAGES):.2f}ms "
+          f"after={sum(r['latency_ms'] for r in after.values()) / len(PAGES):.2f}ms")
+    cold, warm = results['after_cold'], results['after_warm']
+    print(f'first render of each page: cold templates={sum(cold) / len(cold) * 1000:.2f}ms '
+          f'warmed={sum(warm) / len(warm) * 1000:.2f}ms')
+    unchanged = [path for path in PAGES if after[path]['revalidated_status'] != 304]
+    print(f'pages that change on every request (no 304): {", ".join(unchanged) or "none"}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Officer search latency over a large applicant table, against a LIKE scan.
+
+Seeds --rows learning and driving licenses with check_query_plans.seed, gives
+every applicant a varied name, phone number and city, then times the
+search-rebuild of the index and reports p50/p95 per query kind: partial name,
+full name, phone fragment, city, a field filter, a deep page and a license number
+prefix. Each kind is compared with the '%term%' LIKE over applicant_profile that
+the search replaces, and the incremental index update of the write paths is timed
+as well.
+
+    python benchmarks/bench_search.py --rows 10000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_flows import percentile
+
+FIRST_NAMES = ['Aarav', 'Aditi', 'Akash', 'Ananya', 'Arjun', 'Deepak', 'Divya', 'Gaurav', 'Ishaan', 'Kavya',
+               'Lakshmi', 'Manoj', 'Meera', 'Neha', 'Nikhil', 'Pooja', 'Pradeep', 'Priya', 'Rahul', 'Rajesh',
+               'Ravi', 'Rohan', 'Sanjay', 'Shreya', 'Sneha', 'Suresh', 'Tanvi', 'Varun', 'Vikram', 'Yash']
+LAST_NAMES = ['Agarwal', 'Bhat', 'Chopra', 'Desai', 'Deshpande', 'Gupta', 'Iyer', 'Joshi', 'Kapoor', 'Kulkarni',
+              'Kumar', 'Mehta', 'Menon', 'Nair', 'Patel', 'Pillai', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh',
+              'Sinha', 'Thakur', 'Verma', 'Yadav']
+CITIES = ['Ahmedabad', 'Aurangabad', 'Bengaluru', 'Bhopal', 'Chennai', 'Coimbatore', 'Delhi', 'Hyderabad',
+          'Indore', 'Jaipur', 'Kochi', 'Kolhapur', 'Kolkata', 'Lucknow', 'Mumbai', 'Mysuru', 'Nagpur', 'Nashik',
+          'Patna', 'Pune', 'Solapur', 'Surat', 'Thane', 'Vadodara', 'Visakhapatnam']
+
+def applicant(i):
+    """Deterministic varied details for profile i; about one in ten thousand gets a rare surname
+    and as many are called Apparao, a name that starts like an application ID"""
+    rng = random.Random(i)
+    first = 'Apparao' if i % 10000 == 5000 else rng.choice(FIRST_NAMES)
+    last = f'Zorawar{i}' if i % 10000 == 0 else rng.choice(LAST_NAMES)
+    return {'id': i, 'name': f'{first} {last}', 'phone': f'9{rng.randrange(10 ** 9):09d}',
+            'city': rng.choice(CITIES)}
+
+def vary_profiles(db, rows, chunk_size=20000):
+    from sqlalchemy import text
+
+    stmt = text('UPDATE applicant_profile SET name = :name, phone = :phone, city = :city WHERE id = :id')
+    for start in range(1, rows + 1, chunk_size):
+        db.session.execute(stmt, [applicant(i) for i in range(start, min(start + chunk_size, rows + 1))])
+        db.session.commit()
+
+def timed(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000000, help='rows per license table')
+    parser.add_argument('--repeat', type=int, default=20, help='timed runs per query')
+    parser.add_argument('--scan-repeat', type=int, default=3, help='timed runs per LIKE scan')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='profiles per rebuild chunk')
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'search.db')}"
+
+    from sqlalchemy import text
+    from app import app, db
+    from check_query_plans import seed
+    from models import ApplicantProfile
+    from search import search_index
+
+    with app.app_context():
+        start = time.perf_counter()
+        seed(db, args.rows)
+        vary_profiles(db, args.rows)
+        print(f'rows={args.rows} seeded in {time.perf_counter() - start:.0f}s')
+
+        start = time.perf_counter()
+        indexed = search_index.rebuild(args.chunk_size)
+        print(f'search-rebuild indexed={indexed} in {time.perf_counter() - start:.1f}s '
+              f'({indexed / (time.perf_counter() - start):.0f} profiles/s)')
+
+        sample = applicant(args.rows // 2 + 1)
+        first, last = sample['name'].split()
+        rare = applicant(args.rows // 20000 * 10000 or 10000)['name'].split()[1]
+        # (label, search query, the columns and term a LIKE would scan for)
+        queries = [
+            ('partial name', first[:4].lower(), ('name',), first[:4]),
+            ('full name', sample['name'], ('name',), sample['name']),
+            ('rare name', rare, ('name',), rare),
+            ('name like ID', 'Apparao', ('name',), 'Apparao'),
+            ('phone', sample['phone'][2:8], ('phone',), sample['phone'][2:8]),
+            ('city', sample['city'][:5].lower(), ('city',), sample['city'][:5]),
+            ('field filter', f"city:{sample['city']} name:{last}", ('city', 'name'), sample['city']),
+            ('license prefix', f'DL{args.rows // 2:012d}'[:12], None, None),
+        ]
+        failed = False
+        for label, query, columns, term in queries:
+            timings, page = timed(lambda: search_index.search(query), args.repeat)
+            failed |= not page['results']
+            line = (f"{label:15} {query!r:28} results={len(page['results']):2} "
+                    f"p50={percentile(timings, 0.50) * 1000:7.2f}ms p95={percentile(timings, 0.95) * 1000:7.2f}ms")
+            if columns:
+                where = ' OR '.join(f'{column} LIKE :term' for column in columns)
+                scan = text(f'SELECT id FROM applicant_profile WHERE {where} LIMIT {search_index.page_size + 1}')
+                scan_timings, _ = timed(lambda: db.session.execute(scan, {'term': f'%{term}%'}).all(),
+                                        args.scan_repeat)
+                line += f'  LIKE scan p50={percentile(scan_timings, 0.50) * 1000:8.2f}ms'
+            print(line)
+            db.session.rollback()
+
+        deep = min(search_index.max_page, 10)
+        timings, page = timed(lambda: search_index.search(first[:4].lower(), deep), args.repeat)
+        print(f"{'page ' + str(deep):15} {first[:4].lower()!r:28} results={len(page['results']):2} "
+              f"p50={percentile(timings, 0.50) * 1000:7.2f}ms p95={percentile(timings, 0.95) * 1000:7.2f}ms")
+
+        # What payment() and change_details() add to their transaction
+        profiles = db.session.get(ApplicantProfile, 1), db.session.get(ApplicantProfile, args.rows)
+        def update():
+            for profile in profiles:
+                profile.city = random.choice(CITIES)
+                search_index.update(profile)
+            db.session.commit()
+        timings, _ = timed(update, args.repeat)
+        print(f"incremental update p50={percentile(timings, 0.50) * 1000 / 2:.2f}ms "
+              f"p95={percentile(timings, 0.95) * 1000 / 2:.2f}ms per profile, commit included")
+        page = search_index.search(f'city:{profiles[0].city} phone:{profiles[0].phone}')
+        failed |= [result['phone'] for result in page['results']] != [profiles[0].phone]
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Throughput of the pre-fork production server against the development server entry point.
+
+Starts each server on a temporary SQLite database, drives the licensing
+journeys from bench_flows over HTTP from --processes load generators and
+reports requests/s, latency and errors. Password hashing is allowed to queue
+rather than shed load, so both servers do the same work. The pre-fork run is sent SIGHUP
+halfway through to check that a reload drops no requests.
+
+    python benchmarks/bench_server.py --journeys 200 --processes 8 --workers 4 --threads 8
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_flows import _http_worker, percentile, use_stub_templates
+
+def serve(kind, port):
+    """Run one server in this process, as the benchmark's subprocess"""
+    from app import app
+    from migrations import upgrade
+    app.config['WTF_CSRF_ENABLED'] = False
+    use_stub_templates(app)
+    with app.app_context():
+        upgrade()
+    if kind == 'dev':
+        # What main.py did: the Werkzeug development server with the debugger on
+        app.run(host='127.0.0.1', port=port, debug=True, use_reloader=False)
+    else:
+        from server import main
+        os.environ.update(HOST='127.0.0.1', PORT=str(port))
+        main()
+
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not start')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def run(kind, args, env, cwd):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', kind, '--port', str(port)],
+                              env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        per_process = max(args.journeys // args.processes, 1)
+        reload_timer = None
+        if kind == 'prefork' and args.reload:
+            reload_timer = threading.Timer(args.reload, server.send_signal, (signal.SIGHUP,))
+            reload_timer.start()
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.map(_http_worker, [(f'http://127.0.0.1:{port}', per_process, i * per_process)
+                                              for i in range(args.processes)])
+        elapsed = time.perf_counter() - start
+        if reload_timer:
+            reload_timer.cancel()
+    finally:
+        # SIGINT lets the development server exit normally and stop its hashing pool
+        server.send_signal(signal.SIGINT if kind == 'dev' else signal.SIGTERM)
+        server.wait(60)
+
+    timings = [t for process_timings, _ in results for values in process_timings.values() for t in values]
+    errors = sum(count for _, process_errors in results for count in process_errors.values())
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'rps': len(timings) / elapsed,
+        'p50_ms': percentile(timings, 0.50) * 1000,
+        'p95_ms': percentile(timings, 0.95) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--journeys', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=8, help='load generator processes')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='pre-fork worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per pre-fork worker')
+    parser.add_argument('--reload', type=float, default=3.0,
+                        help='seconds into the pre-fork run to send SIGHUP (0 to skip)')
+    parser.add_argument('--serve', choices=['dev', 'prefork'], help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+        return 0
+
+    tmpdir = tempfile.mkdtemp()
+    failed = False
+    print(f'journeys={args.journeys} load processes={args.processes} '
+          f'workers={args.workers} threads={args.threads}')
+    for kind in ('dev', 'prefork'):
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, kind + '.db')}",
+                   TEST_SLOT_CAPACITY='100000', PASSWORD_HASH_MAX_PENDING='1000', WEB_CONCURRENCY=str(args.workers), WEB_THREADS=str(args.threads))
+        stats = run(kind, args, env, tmpdir)
+        failed |= kind == 'prefork' and stats['errors'] > 0
+        print(f"{kind:8} requests={stats['requests']} errors={stats['errors']} rps={stats['rps']:.1f} "
+              f"p50={stats['p50_ms']:.1f}ms p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Concurrency benchmark for test slot reservations.
+
+Spawns worker processes that all try to book the same driving test slot and
+reports bookings per second and whether the slot was ever overbooked.
+
+    python benchmarks/bench_slots.py --workers 8 --attempts 200 --capacity 500
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def _worker(args):
+    test_date, test_time, attempts = args
+    from sqlalchemy.exc import OperationalError
+    from app import app, db
+    from slots import reserve_slot
+
+    booked = failed = locked = 0
+    with app.app_context():
+        db.engine.dispose()
+        for _ in range(attempts):
+            try:
+                if reserve_slot(test_date, test_time):
+                    booked += 1
+                else:
+                    failed += 1
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                locked += 1
+    return booked, failed, locked
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--attempts', type=int, default=200, help='booking attempts per worker')
+    parser.add_argument('--capacity', type=int, default=500)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ.setdefault('DATABASE_URL', args.database_url or f"sqlite:///{os.path.join(tmpdir, 'bench.db')}")
+    os.environ['TEST_SLOT_CAPACITY'] = str(args.capacity)
+
+    from app import app, db
+    from migrations import upgrade
+    from models import TestSlot
+
+    test_date = datetime.now().date() + timedelta(days=14)
+    test_time = '10:00'
+    with app.app_context():
+        upgrade()
+        TestSlot.query.filter_by(test_date=test_date, test_time=test_time).delete()
+        db.session.commit()
+        db.engine.dispose()
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        results = pool.map(_worker, [(test_date, test_time, args.attempts)] * args.workers)
+    elapsed = time.perf_counter() - start
+
+    booked = sum(r[0] for r in results)
+    rejected = sum(r[1] for r in results)
+    locked = sum(r[2] for r in results)
+    with app.app_context():
+        slot = TestSlot.query.filter_by(test_date=test_date, test_time=test_time).one()
+
+    total = args.workers * args.attempts
+    print(f"workers={args.workers} attempts={total} capacity={args.capacity}")
+    print(f"booked={booked} rejected_full={rejected} lock_errors={locked}")
+    print(f"elapsed={elapsed:.2f}s throughput={total / elapsed:.0f} attempts/s {booked / elapsed:.0f} bookings/s")
+    print(f"slot.booked={slot.booked} slot.capacity={slot.capacity}")
+
+    overbooked = slot.booked > slot.capacity or slot.booked != booked
+    print('OVERBOOKED' if overbooked else 'no overbooking')
+    return 1 if overbooked else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
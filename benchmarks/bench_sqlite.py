@@ -0,0 +1,87 @@
+"""Signup and payment write paths on SQLite: driver defaults against the production profile.
+
+Runs the pre-fork server once per configuration, each on a fresh database file, and
+drives the full journeys over HTTP from several processes. Password hashing is
+made cheap so the database, not scrypt, is what the requests wait on. Reports
+p50/p95 latency and errors for the signup and payment routes and overall
+throughput; "database is locked" failures show up as errors.
+
+    python benchmarks/bench_sqlite.py --journeys 200 --processes 8 --workers 2 --threads 8
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_flows import _http_worker, percentile
+from bench_server import free_port, wait_for_port
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_server.py')
+
+CONFIGURATIONS = [
+    ('driver defaults', {'SQLITE_PROFILE': 'off'}),
+    ('wal profile', {'SQLITE_PROFILE': 'production'}),
+    ('wal + single writer', {'SQLITE_PROFILE': 'production', 'SQLITE_SINGLE_WRITER': '1'}),
+]
+
+ROUTES = ['signup', 'payment']
+
+def run(args, env, cwd):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, SERVER, '--serve', 'prefork', '--port', str(port)],
+                              env=env, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(port)
+        per_process = max(args.journeys // args.processes, 1)
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            results = pool.map(_http_worker, [(f'http://127.0.0.1:{port}', per_process, i * per_process)
+                                              for i in range(args.processes)])
+        elapsed = time.perf_counter() - start
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(60)
+
+    timings, errors = {}, {}
+    for process_timings, process_errors in results:
+        for route, values in process_timings.items():
+            timings.setdefault(route, []).extend(values)
+        for route, count in process_errors.items():
+            errors[route] = errors.get(route, 0) + count
+    return timings, errors, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--journeys', type=int, default=200)
+    parser.add_argument('--processes', type=int, default=8, help='load generator processes')
+    parser.add_argument('--workers', type=int, default=2, help='pre-fork worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='threads per pre-fork worker')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    print(f'journeys={args.journeys} load processes={args.processes} workers={args.workers} threads={args.threads}')
+    failed = False
+    for n, (label, settings) in enumerate(CONFIGURATIONS):
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, f'write{n}.db')}",
+                   TEST_SLOT_CAPACITY='100000', PASSWORD_HASH_METHOD='pbkdf2:sha256:1000',
+                   PASSWORD_HASH_MAX_PENDING='1000', WEB_CONCURRENCY=str(args.workers),
+                   WEB_THREADS=str(args.threads), **settings)
+        timings, errors, elapsed = run(args, env, tmpdir)
+        requests = sum(len(values) for values in timings.values())
+        print(f'{label:20} requests={requests} errors={sum(errors.values())} rps={requests / elapsed:.1f}')
+        for route in ROUTES:
+            values = timings.get(route, [])
+            print(f'    {route:8} count={len(values):5} errors={errors.get(route, 0):4} '
+                  f'p50={percentile(values, 0.50) * 1000:7.1f}ms p95={percentile(values, 0.95) * 1000:7.1f}ms '
+                  f'p99={percentile(values, 0.99) * 1000:7.1f}ms')
+        failed |= settings.get('SQLITE_PROFILE') == 'production' and sum(errors.values()) > 0
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""Startup time: importing the app and serving the first requests, with a budget.
+
+Every run is a fresh interpreter against a database that is already migrated, as a
+worker would start after "flask db-upgrade". Exits non-zero when the median import
+time, or the median of each run's slowest first request, is over its budget, so it
+can gate a deploy.
+
+    python benchmarks/bench_startup.py --runs 5 --import-budget 750 --first-request-budget 150
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Pages requested in order by each run; the slowest of them is held to the budget
+PATHS = ['/login', '/login', '/application-status']
+
+def measure(app_dir):
+    """Run in the child: time the import and each request, print them as JSON"""
+    import logging
+    start = time.perf_counter()
+    sys.path.insert(0, app_dir)
+    from app import app
+    import_ms = (time.perf_counter() - start) * 1000
+    logging.disable(logging.CRITICAL)
+    from bench_flows import use_stub_templates
+    use_stub_templates(app)
+
+    client = app.test_client()
+    requests = []
+    for path in PATHS:
+        start = time.perf_counter()
+        status = client.get(path).status_code
+        requests.append(((time.perf_counter() - start) * 1000, status))
+    print(json.dumps({'import_ms': import_ms, 'requests': requests}))
+
+def migrate(app_dir):
+    sys.path.insert(0, app_dir)
+    from app import app
+    from migrations import upgrade
+    with app.app_context():
+        upgrade()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget', type=float, default=750, help='milliseconds')
+    parser.add_argument('--first-request-budget', type=float, default=150, help='milliseconds')
+    parser.add_argument('--app-dir', default=ROOT, help='tree to measure, e.g. a checkout of an older commit')
+    parser.add_argument('--child', choices=['measure', 'migrate'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'measure':
+        return measure(args.app_dir)
+    if args.child == 'migrate':
+        return migrate(args.app_dir)
+
+    tmpdir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmpdir, 'startup.db')}")
+    command = [sys.executable, os.path.abspath(__file__), '--app-dir', args.app_dir, '--child']
+    if os.path.exists(os.path.join(args.app_dir, 'migrations.py')):
+        subprocess.run(command + ['migrate'], env=env, cwd=tmpdir, check=True, capture_output=True)
+
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run(command + ['measure'], env=env, cwd=tmpdir, check=True, capture_output=True,
+                                text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    import_ms = statistics.median(run['import_ms'] for run in runs)
+    print(f'runs={args.runs} import={import_ms:.0f}ms')
+    for n, path in enumerate(PATHS):
+        latencies = [run['requests'][n][0] for run in runs]
+        statuses = sorted({run['requests'][n][1] for run in runs})
+        print(f'request {n + 1} GET {path:14} median={statistics.median(latencies):6.1f}ms '
+              f'max={max(latencies):6.1f}ms status={statuses}')
+
+    first_ms = statistics.median(max(latency for latency, _ in run['requests']) for run in runs)
+    failures = [f'GET {path} returned {status}' for run in runs
+                for path, (_, status) in zip(PATHS, run['requests']) if status >= 500][:1]
+    if import_ms > args.import_budget:
+        failures.append(f'import {import_ms:.0f}ms over budget {args.import_budget:.0f}ms')
+    if first_ms > args.first_request_budget:
+        failures.append(f'first requests {first_ms:.0f}ms over budget {args.first_request_budget:.0f}ms')
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if not failures:
+        print('startup within budget')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
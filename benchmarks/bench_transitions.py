@@ -0,0 +1,58 @@
+"""Throughput of bulk status transitions against a per-row ORM loop.
+
+Seeds --rows records per license table, approves --orm-rows pending learning
+licenses one ORM object at a time (the way a naive back-office loop would),
+then approves the rest with the chunked set-based transition and reports
+rows/s for both.
+
+    python benchmarks/bench_transitions.py --rows 200000 --chunk-size 1000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000, help='rows per license table')
+    parser.add_argument('--orm-rows', type=int, default=5000, help='rows approved by the ORM baseline')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'transitions.db')}"
+
+    from app import app, db
+    from check_query_plans import seed
+    from models import LearningLicense
+    from registry import set_application_status
+    from transitions import apply_transition, count_matching
+
+    with app.app_context():
+        seed(db, args.rows)
+        pending = count_matching('learning-approve')
+        print(f'rows={args.rows} pending learning licenses={pending}')
+
+        start = time.perf_counter()
+        baseline = LearningLicense.query.filter_by(status='Processing').limit(args.orm_rows).all()
+        for learning_license in baseline:
+            learning_license.status = 'Approved'
+            set_application_status(learning_license.application_id, 'Approved')
+        db.session.commit()
+        elapsed = time.perf_counter() - start
+        print(f'orm loop     rows={len(baseline)} elapsed={elapsed:.2f}s rate={len(baseline) / elapsed:.0f} rows/s')
+
+        result = apply_transition('learning-approve', 'benchmark', chunk_size=args.chunk_size)
+        print(f"set-based    rows={result['rows']} chunks={result['chunks']} elapsed={result['elapsed']:.2f}s "
+              f"rate={result['rows_per_second']:.0f} rows/s")
+
+        remaining = count_matching('learning-approve')
+        print(f'remaining pending={remaining}')
+    return 1 if remaining else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
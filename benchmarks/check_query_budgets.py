@@ -0,0 +1,180 @@
+"""Query-count regression check for the routes in app.py.
+
+Walks one applicant through every route with the Flask test client on a temporary
+SQLite database, each request inside querytrace.assert_max_queries with the budget
+from BUDGETS, and exits non-zero when a route runs more statements than its budget
+or repeats a SELECT shape (an N+1 pattern). The lookup cache is off, so budgets
+count the uncached path. Raise a budget in the same change that needs it.
+
+    python benchmarks/check_query_budgets.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_flows import APPLICATION_ID, LICENSE_NUMBER, DOCUMENT, use_stub_templates
+
+# Most statements each request may run, by step; the first applicant also creates the ID
+# sequences and the test slot, so the first request of a kind sets the figure
+BUDGETS = {
+    'signup': 5,
+    'login': 5,
+    'home': 1,
+    'learning_license': 7,
+    'payment learning': 18,
+    'driving_license form': 2,
+    'driving_license': 4,
+    'payment driving': 19,
+    'test_slots': 2,
+    'renew_license': 3,
+    'payment renewal': 10,
+    'change_details lookup': 2,
+    'change_details': 7,
+    'application_status': 2,
+    'dashboard': 6,
+    'api_applications': 6,
+    'documents': 3,
+    'check_rc': 1,
+    'officer_search': 6,
+    'batch_api': 21,
+    'logout': 4,
+}
+
+USERNAME = 'budgetuser'
+
+# Applications on the account before the listing routes run, so per-row queries repeat
+LEARNERS = 4
+
+CARD = {'card_number': '4111111111111111', 'card_holder': 'Budget User', 'expiry_date': '12/30', 'cvv': '123'}
+
+def steps(user):
+    """(step, method, path, data, files) for one applicant; paths may use values found earlier"""
+    password = 'budget-password'
+    applicant = {
+        'name': 'Budget User', 'dob': '1990-01-01', 'gender': 'other', 'place_of_birth': 'Pune',
+        'phone': '9876543210', 'email': f'{user}@example.com', 'address': '1 Main Road', 'city': 'Pune',
+        'state': 'MH', 'zip_code': '411001', 'blood_group': 'O+', 'rh_factor': 'positive',
+        'citizenship': 'Indian', 'document_type': 'aadhar',
+    }
+    test_date = (date.today() + timedelta(days=10)).isoformat()
+
+    yield 'signup', 'POST', '/signup', {'username': user, 'email': f'{user}@example.com',
+                                        'password': password, 'confirm_password': password}, None
+    yield 'login', 'POST', '/login', {'username': user, 'password': password}, None
+    yield 'home', 'GET', '/home', None, None
+    for _ in range(LEARNERS):
+        yield 'learning_license', 'POST', '/learning-license', applicant, {'document': ('id.pdf', DOCUMENT)}
+        yield 'payment learning', 'POST', '/payment/learning', CARD, None
+    yield 'driving_license form', 'GET', '/driving-license', None, None
+    yield 'driving_license', 'POST', '/driving-license', {'learning_license_id': '{learning_id}',
+                                                          'test_date': test_date, 'test_time': '10:00'}, None
+    yield 'payment driving', 'POST', '/payment/driving', CARD, None
+    yield 'test_slots', 'GET', '/test-slots', None, None
+    yield 'renew_license', 'POST', '/renew-license', {'license_number': '{license_number}',
+                                                      'renewal_reason': 'expiring'}, None
+    yield 'payment renewal', 'POST', '/payment/renewal', CARD, None
+    yield 'change_details lookup', 'POST', '/change-details', {'license_number': '{license_number}'}, None
+    yield 'change_details', 'POST', '/change-details', {'license_number': '{license_number}',
+                                                        'address': '2 New Road', 'city': 'Mumbai', 'state': 'MH',
+                                                        'zip_code': '400001', 'phone': '9876500000'}, None
+    yield 'application_status', 'POST', '/application-status', {'application_id': '{learning_id}'}, None
+    yield 'dashboard', 'GET', '/dashboard', None, None
+    yield 'api_applications', 'GET', '/api/applications?limit=100', None, None
+    yield 'documents', 'GET', '/documents/{learning_id}', None, None
+    yield 'check_rc', 'GET', '/check-rc', None, None
+    yield 'officer_search', 'GET', '/officer/search?q=budget+pune', None, None
+    yield 'logout', 'GET', '/logout', None, None
+
+def batch_items(learning_id):
+    test_date = (date.today() + timedelta(days=11)).isoformat()
+    learner = {'type': 'learning', 'name': 'Batch Learner', 'dob': '1995-06-15', 'gender': 'female',
+               'place_of_birth': 'Nagpur', 'phone': '9800000001', 'email': 'learner@example.com',
+               'address': '1 School Road', 'city': 'Nagpur', 'state': 'MH', 'zip_code': '440001',
+               'blood_group': 'B+', 'rh_factor': 'positive', 'citizenship': 'Indian', 'document_type': 'aadhar'}
+    booking = {'type': 'driving', 'learning_license_id': learning_id, 'test_date': test_date, 'test_time': '11:00'}
+    return [learner] * LEARNERS + [booking]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--verbose', action='store_true', help='print the statements of every step')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.chdir(tmpdir)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tmpdir, 'budgets.db')}"
+    os.environ['CACHE_BACKEND'] = 'null'
+    os.environ['PAYMENT_MODE'] = 'off'
+    os.environ['OFFICER_USERNAMES'] = USERNAME
+
+    import logging
+    from app import app
+    from migrations import upgrade
+    from querytrace import assert_max_queries
+    logging.disable(logging.CRITICAL)
+    with app.app_context():
+        upgrade()
+    app.config['WTF_CSRF_ENABLED'] = False
+    use_stub_templates(app)
+
+    client = app.test_client()
+    found = {}
+    failures = 0
+
+    def run(step, method, path, data=None, files=None, **kwargs):
+        # Over budget still hands back the response, so the steps after it can go on
+        nonlocal failures
+        budget = BUDGETS[step]
+        response = trace = None
+        try:
+            with assert_max_queries(budget, label=step) as trace:
+                if method == 'GET':
+                    response = client.get(path, **kwargs)
+                else:
+                    response = client.post(path, data=data, content_type='multipart/form-data' if files else None,
+                                           **kwargs)
+        except AssertionError as e:
+            failures += 1
+            print(f'FAIL {step}: {e}')
+            return response
+        if response.status_code >= 400:
+            failures += 1
+            print(f'FAIL {step}: {method} {path} answered {response.status_code}')
+        else:
+            print(f'ok   {step}: {trace.count}/{budget} statements')
+            if args.verbose:
+                print(trace.report())
+        return response
+
+    for step, method, path, data, files in steps(USERNAME):
+        try:
+            path = path.format(**found)
+            data = {name: value.format(**found) for name, value in data.items()} if data else None
+        except KeyError as e:
+            failures += 1
+            print(f'FAIL {step}: no {e.args[0]} from an earlier step')
+            continue
+        for name, (filename, content) in (files or {}).items():
+            data[name] = (BytesIO(content), filename)
+        response = run(step, method, path, data, files)
+        body = response.get_data(as_text=True) if response is not None else ''
+        if step == 'payment learning' and APPLICATION_ID.search(body):
+            found.setdefault('learning_id', APPLICATION_ID.search(body).group(0))
+        elif step == 'payment driving' and LICENSE_NUMBER.search(body):
+            found['license_number'] = LICENSE_NUMBER.search(body).group(0)
+
+    with app.app_context():
+        output = app.test_cli_runner().invoke(args=['api-token-create', USERNAME, '--name', 'Budget School']).output
+    run('batch_api', 'POST', '/api/batch/applications',
+        json={'applications': batch_items(found.get('learning_id', 'APP'))},
+        headers={'Authorization': f"Bearer {output.rsplit(': ', 1)[-1].strip()}"})
+
+    print(f'{failures} routes over their query budget' if failures else 'all routes within their query budgets')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""Query-plan regression check for the lookups issued by the routes in app.py.
+
+Seeds a database with ``--rows`` license records, runs EXPLAIN QUERY PLAN
+(SQLite) or EXPLAIN (PostgreSQL) for every route query and exits non-zero
+when any of them falls back to a full table or index scan.
+
+    python benchmarks/check_query_plans.py --rows 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATUSES = {
+    'learning_license': ['Processing', 'Approved', 'Rejected', 'Expired'],
+    'driving_license': ['Scheduled', 'Passed', 'Failed', 'Renewed'],
+    'license_change_request': ['Pending', 'Approved', 'Rejected', 'Closed'],
+}
+
+def seed(db, rows, chunk_size=20000):
+    """Bulk insert ``rows`` records per license table with executemany chunks"""
+    from sqlalchemy import insert
+    from migrations import upgrade
+    from models import (User, LearningLicense, DrivingLicense, ApplicantProfile, LicenseRenewal, LicenseChangeRequest,
+                        Application)
+
+    upgrade()
+    users = max(rows // 10, 1)
+    now = datetime.now()
+
+    def chunks(total, make_row):
+        for start in range(0, total, chunk_size):
+            yield [make_row(i) for i in range(start, min(start + chunk_size, total))]
+
+    for batch in chunks(users, lambda i: {
+        'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': 'x', 'created_at': now,
+    }):
+        db.session.execute(insert(User), batch)
+
+    person = {
+        'name': 'Seed Applicant', 'dob': date(1990, 1, 1), 'gender': 'male', 'place_of_birth': 'Pune',
+        'phone': '9000000000', 'email': 'seed@example.com', 'address': '1 Main Road', 'city': 'Pune',
+        'state': 'MH', 'zip_code': '411001', 'blood_group': 'O+', 'rh_factor': 'positive', 'citizenship': 'Indian',
+    }
+    for batch in chunks(rows, lambda i: dict(person, id=i + 1)):
+        db.session.execute(insert(ApplicantProfile), batch)
+
+    # Each driving license shares the profile of its learning license
+    for batch in chunks(rows, lambda i: dict(
+        application_id=f'APP{i:012d}', user_id=i % users + 1, profile_id=i + 1, document_type='aadhar',
+        status=STATUSES['learning_license'][i % 4], apply_date=now,
+    )):
+        db.session.execute(insert(LearningLicense), batch)
+
+    for batch in chunks(rows, lambda i: dict(
+        application_id=f'APD{i:012d}', license_number=f'DL{i:012d}', user_id=i % users + 1, profile_id=i + 1,
+        learning_license_id=f'APP{i:012d}', test_date=date.today(), test_time='10:00',
+        status=STATUSES['driving_license'][i % 4], apply_date=now, expiry_date=now + timedelta(days=i % 3650),
+    )):
+        db.session.execute(insert(DrivingLicense), batch)
+
+    for batch in chunks(rows // 10, lambda i: {
+        'user_id': i % users + 1, 'license_number': f'DL{i:012d}', 'renewal_date': now,
+        'renewal_reason': 'expiring', 'old_expiry_date': now, 'new_expiry_date': now,
+    }):
+        db.session.execute(insert(LicenseRenewal), batch)
+
+    address = {'address': '1 Main Road', 'city': 'Pune', 'state': 'MH', 'zip': '411001', 'phone': '9000000000'}
+    for batch in chunks(rows // 10, lambda i: dict(
+        {f'old_{k}': v for k, v in address.items()}, **{f'new_{k}': v for k, v in address.items()},
+        user_id=i % users + 1, license_number=f'DL{i:012d}', request_date=now,
+        status=STATUSES['license_change_request'][i % 4],
+    )):
+        db.session.execute(insert(LicenseChangeRequest), batch)
+
+    for batch in chunks(rows, lambda i: {
+        'application_id': f'APP{i:012d}', 'kind': 'learning', 'user_id': i % users + 1,
+        'status': STATUSES['learning_license'][i % 4], 'apply_date': now,
+    }):
+        db.session.execute(insert(Application), batch)
+
+    db.session.commit()
+
+def route_queries():
+    """Return (route, description, query) for every lookup the routes issue"""
+    from sqlalchemy import tuple_
+    from models import (User, LearningLicense, DrivingLicense, LicenseRenewal, LicenseChangeRequest,
+                        TestSlot, Application)
+
+    today = date.today()
+    return [
+        ('login', 'user by username', User.query.filter_by(username='user42')),
+        ('signup', 'user by email', User.query.filter_by(email='user42@example.com')),
+        ('driving_license', 'learning license by application id and user',
+         LearningLicense.query.filter_by(application_id='APP000000000042', user_id=43)),
+        ('renew_license', 'driving license by license number and user',
+         DrivingLicense.query.filter_by(license_number='DL000000000042', user_id=43)),
+        ('application_status', 'registry entry by application id and user',
+         Application.query.filter_by(application_id='APP000000000042', user_id=43)),
+        ('payment', 'registry entry by application id', Application.query.filter_by(application_id='APP000000000042')),
+        ('dashboard', 'registry page by user after a keyset cursor',
+         Application.query.filter(Application.user_id == 43,
+                                  tuple_(Application.apply_date, Application.id) < tuple_(datetime.now(), 10 ** 9))
+         .order_by(Application.apply_date.desc(), Application.id.desc()).limit(26)),
+        ('driving_license', 'test slots in the booking window',
+         TestSlot.query.filter(TestSlot.test_date >= today, TestSlot.test_date <= today + timedelta(days=60))),
+        ('User.learning_licenses', 'learning licenses by user', LearningLicense.query.filter_by(user_id=43)),
+        ('User.driving_licenses', 'driving licenses by user', DrivingLicense.query.filter_by(user_id=43)),
+        ('User.license_renewals', 'renewals by user', LicenseRenewal.query.filter_by(user_id=43)),
+        ('User.change_requests', 'change requests by user', LicenseChangeRequest.query.filter_by(user_id=43)),
+        ('DrivingLicense.renewals', 'renewals by license number',
+         LicenseRenewal.query.filter_by(license_number='DL000000000042')),
+        ('DrivingLicense.changes', 'change requests by license number',
+         LicenseChangeRequest.query.filter_by(license_number='DL000000000042')),
+        ('back office', 'learning licenses by status', LearningLicense.query.filter_by(status='Approved')),
+        ('back office', 'driving licenses by status', DrivingLicense.query.filter_by(status='Passed')),
+        ('back office', 'change requests by status', LicenseChangeRequest.query.filter_by(status='Pending')),
+        ('back office', 'driving licenses expiring within 30 days',
+         DrivingLicense.query.filter(DrivingLicense.expiry_date >= datetime.now(),
+                                     DrivingLicense.expiry_date < datetime.now() + timedelta(days=30))),
+        ('officer search', 'learning licenses by application id prefix',
+         LearningLicense.query.filter(LearningLicense.application_id.between('APP0000000', 'APP0000000ZZZZZZZZZZ'))
+         .order_by(LearningLicense.application_id).limit(21)),
+        ('officer search', 'driving licenses by license number prefix',
+         DrivingLicense.query.filter(DrivingLicense.license_number.between('DL00000000', 'DL00000000ZZZZZZZZZZ'))
+         .order_by(DrivingLicense.license_number).limit(21)),
+    ]
+
+def explain(db, query):
+    """Return the plan lines for a query and whether any of them is a full table or index scan"""
+    from sqlalchemy import text
+
+    dialect = db.engine.dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'sqlite':
+        lines = [row[-1] for row in db.session.execute(text(f'EXPLAIN QUERY PLAN {sql}'))]
+        # Only SEARCH seeks; "SCAN t" reads the whole table and "SCAN t USING [COVERING] INDEX" the whole index
+        full_scan = any(line.startswith('SCAN ') for line in lines)
+    else:
+        lines = [row[0] for row in db.session.execute(text(f'EXPLAIN {sql}'))]
+        full_scan = any('Seq Scan' in line for line in lines)
+    return lines, full_scan
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='rows per license table')
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = args.database_url or f"sqlite:///{os.path.join(tmpdir, 'plans.db')}"
+
+    from sqlalchemy import text
+    from app import app, db
+
+    failures = 0
+    with app.app_context():
+        start = time.perf_counter()
+        seed(db, args.rows)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        print(f'seeded {args.rows} rows per table in {time.perf_counter() - start:.1f}s')
+
+        for route, description, query in route_queries():
+            lines, full_scan = explain(db, query)
+            failures += full_scan
+            print(f"{'FAIL' if full_scan else 'ok  '} {route}: {description}")
+            for line in lines:
+                print(f'       {line}')
+
+    print(f'{failures} queries fall back to a full scan' if failures else 'all route queries use an index')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Local stand-in for the card gateway, for offline load tests of the payment flow.
+
+Speaks the API payments.PaymentGateway uses over keep-alive HTTP/1.1:
+
+    POST /charges          charge a card; Idempotency-Key header required. Answers 200
+                           succeeded or 402 declined after --latency, or with a
+                           callback_url 202 pending at once and POSTs the outcome there
+                           after --latency, signed with --webhook-secret
+    GET  /charges/<key>    the charge taken under an idempotency key, or 404
+    GET  /stats            counters, to check that retries never charged twice
+
+Failures are injected at the configured rates: --error-rate answers 503 before the
+charge is taken, --timeout-rate stalls for --stall seconds before answering and
+--decline-rate declines the card. Card numbers ending in 0002 are always declined.
+
+    python benchmarks/fake_gateway.py --port 8099 --latency 0.4 --error-rate 0.05 --webhook-secret s3cret
+"""
+import argparse
+import hashlib
+import hmac
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+class Gateway:
+    def __init__(self, args):
+        self.args = args
+        self.charges = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'charges': 0, 'replayed': 0, 'errors': 0, 'stalls': 0, 'declined': 0,
+                      'callbacks': 0, 'callback_failures': 0, 'connections': 0}
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def latency(self):
+        return max(random.gauss(self.args.latency, self.args.latency * self.args.jitter), 0)
+
+    def decide(self, card):
+        declined = str(card.get('number', '')).endswith('0002') or random.random() < self.args.decline_rate
+        return ('declined', 'insufficient funds') if declined else ('succeeded', None)
+
+    def callback(self, url, charge):
+        time.sleep(self.latency())
+        body = json.dumps({'payment_id': charge['payment_id'], 'id': charge['id'], 'status': charge['status'],
+                           'reason': charge['reason']}).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.args.webhook_secret:
+            headers['X-Gateway-Signature'] = hmac.new(self.args.webhook_secret.encode(), body,
+                                                      hashlib.sha256).hexdigest()
+        parts = urlsplit(url)
+        for attempt in range(5):
+            try:
+                conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+                conn.request('POST', parts.path, body=body, headers=headers)
+                status = conn.getresponse().status
+                conn.close()
+                if status < 500:
+                    self.count('callbacks')
+                    return
+            except OSError:
+                pass
+            time.sleep(0.5 * 2 ** attempt)
+        self.count('callback_failures')
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    gateway = None
+
+    def setup(self):
+        super().setup()
+        self.gateway.count('connections')
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        gateway = self.gateway
+        if self.path == '/stats':
+            with gateway.lock:
+                return self.reply(200, dict(gateway.stats))
+        if self.path.startswith('/charges/'):
+            charge = gateway.charges.get(self.path[len('/charges/'):])
+            return self.reply(200, charge) if charge else self.reply(404, {'error': 'no such charge'})
+        self.reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        gateway, args = self.gateway, self.gateway.args
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        if self.path != '/charges':
+            return self.reply(404, {'error': 'not found'})
+        gateway.count('requests')
+        key = self.headers.get('Idempotency-Key')
+        if not key:
+            return self.reply(400, {'error': 'Idempotency-Key header required'})
+        if random.random() < args.error_rate:
+            gateway.count('errors')
+            return self.reply(503, {'error': 'temporarily unavailable'})
+        if random.random() < args.timeout_rate:
+            gateway.count('stalls')
+            time.sleep(args.stall)
+
+        with gateway.lock:
+            charge = gateway.charges.get(key)
+            replayed = charge is not None
+            if not replayed:
+                status, reason = gateway.decide(request.get('card') or {})
+                charge = {'id': f'ch_{uuid.uuid4().hex[:16]}', 'payment_id': key, 'amount': request.get('amount'),
+                          'status': status, 'reason': reason}
+                gateway.charges[key] = charge
+                gateway.stats['charges'] += 1
+                gateway.stats['declined'] += status == 'declined'
+            else:
+                gateway.stats['replayed'] += 1
+
+        if request.get('callback_url'):
+            if not replayed:
+                threading.Thread(target=gateway.callback, args=(request['callback_url'], charge), daemon=True).start()
+            return self.reply(202, {'id': charge['id'], 'status': 'pending'})
+        if not replayed:
+            time.sleep(gateway.latency())
+        self.reply(402 if charge['status'] == 'declined' else 200, charge)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.3, help='mean seconds to process a charge')
+    parser.add_argument('--jitter', type=float, default=0.25, help='standard deviation as a fraction of latency')
+    parser.add_argument('--decline-rate', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of charges answered 503')
+    parser.add_argument('--timeout-rate', type=float, default=0.0, help='share of charges that stall')
+    parser.add_argument('--stall', type=float, default=30.0, help='seconds a stalled charge takes')
+    parser.add_argument('--webhook-secret', help='signs callbacks as the application expects')
+    args = parser.parse_args()
+
+    Handler.gateway = Gateway(args)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.daemon_threads = True
+    print(f'fake gateway on http://{args.host}:{args.port}', flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+class MemoryBackend:
+    """In-process LRU store for a single worker"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class PickleSerializer:
+    """Pickles values, for data only this application writes"""
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+class SQLiteBackend:
+    """LRU store in a local SQLite file shared by every worker on the host"""
+
+    # Trim to max_entries once every this many writes
+    EVICT_EVERY = 100
+
+    # Reads are read-only, so they never queue for the write lock of the shared file. The time
+    # of a hit is remembered in memory, at most once per TOUCH_INTERVAL seconds per entry, and
+    # written with the next set(), which is where eviction needs it
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path, max_entries, serializer=None):
+        self.path = path
+        self.max_entries = max_entries
+        # Anything with dumps and loads; callers storing data others could write pass one that
+        # does not unpickle
+        self.serializer = serializer or PickleSerializer()
+        self._local = threading.local()
+        self._writes = 0
+        self._touched = {}
+        self._lock = threading.Lock()
+
+    def _conn(self):
+        # One connection per thread, reopened after fork
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                         '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_used ON cache (used)')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._conn()
+        row = conn.execute('SELECT value, expires, used FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires, used = row
+        now = time.time()
+        if expires < now:
+            # Left for the set() that follows the miss to replace, or for eviction
+            return None
+        if now - used > self.TOUCH_INTERVAL:
+            with self._lock:
+                self._touched[key] = now
+        return self.serializer.loads(value)
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('INSERT OR REPLACE INTO cache (key, value, expires, used) VALUES (?, ?, ?, ?)',
+                     (key, self.serializer.dumps(value), now + ttl, now))
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+            touched, self._touched = self._touched, {}
+        if touched:
+            conn.executemany('UPDATE cache SET used = ? WHERE key = ? AND used < ?',
+                             [(used, key, used) for key, used in touched.items()])
+        if evict:
+            conn.execute('DELETE FROM cache WHERE key IN '
+                         '(SELECT key FROM cache ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def delete(self, *keys):
+        if keys:
+            self._conn().executemany('DELETE FROM cache WHERE key = ?', [(key,) for key in keys])
+
+    def clear(self):
+        self._conn().execute('DELETE FROM cache')
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+class NullBackend:
+    """Backend that never stores anything, used to switch caching off"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, *keys):
+        pass
+
+    def clear(self):
+        pass
+
+    def __len__(self):
+        return 0
+
+BACKENDS = {
+    'memory': lambda config: MemoryBackend(config['CACHE_MAX_ENTRIES']),
+    'sqlite': lambda config: SQLiteBackend(config['CACHE_PATH'], config['CACHE_MAX_ENTRIES']),
+    'null': lambda config: NullBackend(),
+}
+
+class LookupCache:
+    """Read-through cache for point lookups with invalidation on commit"""
+
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.ttl = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'sqlite')
+        app.config.setdefault('CACHE_MAX_ENTRIES', 10000)
+        app.config.setdefault('CACHE_TTL', 300)
+        app.config.setdefault('CACHE_PATH', os.path.join(app.instance_path, 'cache.db'))
+        self.backend = BACKENDS[app.config['CACHE_BACKEND']](app.config)
+        self.ttl = app.config['CACHE_TTL']
+
+    def get_or_load(self, key, loader):
+        """Return the cached value for key, calling loader on a miss; None results are not cached"""
+        value = self.backend.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+        with self._lock:
+            self.misses += 1
+        value = loader()
+        if value is not None:
+            self.backend.set(key, value, self.ttl)
+        return value
+
+    def invalidate(self, *keys):
+        self.backend.delete(*keys)
+
+    def invalidate_after_commit(self, session, *keys):
+        """Drop keys once the session commits, so readers never repopulate them with pre-commit data"""
+        session.info.setdefault('cache_invalidate', set()).update(keys)
+        self.invalidate(*keys)
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        return {'hits': hits, 'misses': misses, 'size': len(self.backend)}
+
+cache = LookupCache()
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    keys = session.info.pop('cache_invalidate', None)
+    if keys:
+        cache.invalidate(*keys)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('cache_invalidate', None)
+
+def _snapshot(row):
+    data = {column.key: getattr(row, column.key) for column in row.__table__.columns}
+    # Licenses carry their applicant details on a shared profile
+    profile = getattr(row, 'profile', None)
+    if profile is not None:
+        data = {**_snapshot(profile), **data}
+    return data
+
+def _owned(data, user_id):
+    if data is None or data['user_id'] != user_id:
+        return None
+    return SimpleNamespace(**data)
+
+def learning_license_key(application_id):
+    return f'learning_license:{application_id}'
+
+def driving_license_key(license_number):
+    return f'driving_license:{license_number}'
+
+def application_key(application_id):
+    return f'application:{application_id}'
+
+def cached_learning_license(application_id, user_id):
+    """Read-only copy of a learning license owned by user_id"""
+    from models import LearningLicense
+
+    def load():
+        row = LearningLicense.query.filter_by(application_id=application_id).first()
+        return _snapshot(row) if row else None
+    return _owned(cache.get_or_load(learning_license_key(application_id), load), user_id)
+
+def cached_driving_license(license_number, user_id):
+    """Read-only copy of a driving license owned by user_id"""
+    from models import DrivingLicense
+
+    def load():
+        row = DrivingLicense.query.filter_by(license_number=license_number).first()
+        return _snapshot(row) if row else None
+    return _owned(cache.get_or_load(driving_license_key(license_number), load), user_id)
+
+def cached_application(application_id, user_id):
+    """Read-only copy of a registry entry owned by user_id"""
+    from models import Application
+
+    def load():
+        row = Application.query.filter_by(application_id=application_id).first()
+        return _snapshot(row) if row else None
+    return _owned(cache.get_or_load(application_key(application_id), load), user_id)
@@ -0,0 +1,89 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlalchemy.orm import selectinload
+from models import Application, LearningLicense, DrivingLicense
+from registry import APPLICATION_KINDS
+
+def encode_cursor(entry):
+    raw = json.dumps([entry.apply_date.isoformat(), entry.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return (apply_date, id) from a cursor, or None when it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        apply_date, entry_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return datetime.fromisoformat(apply_date), int(entry_id)
+    except (ValueError, TypeError):
+        return None
+
+def _learning_details(learning_license):
+    return {
+        'name': learning_license.name,
+        'document_type': learning_license.document_type,
+        'has_document': bool(learning_license.document_path)
+    }
+
+def _driving_details(driving_license):
+    return {
+        'name': driving_license.name,
+        'license_number': driving_license.license_number,
+        'test_date': driving_license.test_date.isoformat(),
+        'test_time': driving_license.test_time,
+        'expiry_date': driving_license.expiry_date.isoformat(),
+        'renewal_due': driving_license.renewal_due_for == driving_license.expiry_date,
+        'renewals': len(driving_license.renewals),
+        'change_requests': len(driving_license.changes)
+    }
+
+def application_page(user_id, cursor=None, limit=25):
+    """One page of a user's applications, newest first.
+
+    Uses keyset pagination on (apply_date, id) over the registry, so every page
+    costs the same however deep it is, and loads details for the page with a
+    fixed number of IN queries instead of one lazy load per row.
+    """
+    query = Application.query.filter(Application.user_id == user_id)
+    position = decode_cursor(cursor)
+    if position:
+        query = query.filter(tuple_(Application.apply_date, Application.id) < tuple_(*position))
+    entries = query.order_by(Application.apply_date.desc(), Application.id.desc()).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    ids = {kind: [e.application_id for e in entries if e.kind == kind] for kind in ('learning', 'driving')}
+    learning = {}
+    if ids['learning']:
+        learning = {row.application_id: row for row in LearningLicense.query.filter(
+            LearningLicense.application_id.in_(ids['learning']))}
+    driving = {}
+    if ids['driving']:
+        driving = {row.application_id: row for row in DrivingLicense.query.options(
+            selectinload(DrivingLicense.renewals), selectinload(DrivingLicense.changes)
+        ).filter(DrivingLicense.application_id.in_(ids['driving']))}
+
+    items = []
+    for entry in entries:
+        label, estimate = APPLICATION_KINDS[entry.kind]
+        item = {
+            'application_id': entry.application_id,
+            'kind': entry.kind,
+            'type': label,
+            'status': entry.status,
+            'apply_date': entry.apply_date.isoformat(),
+            'license_number': entry.license_number,
+            'estimate': estimate
+        }
+        if entry.application_id in learning:
+            item.update(_learning_details(learning[entry.application_id]))
+        elif entry.application_id in driving:
+            item.update(_driving_details(driving[entry.application_id]))
+        items.append(item)
+
+    return {
+        'items': items,
+        'next_cursor': encode_cursor(entries[-1]) if has_more else None
+    }
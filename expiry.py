@@ -0,0 +1,91 @@
+import time
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import select, tuple_, update
+from app import app, db
+from models import DrivingLicense, SweepCheckpoint, UNPAID_STATUSES
+from cache import cache, driving_license_key
+from jobs import enqueue_many
+
+SWEEP_NAME = 'renewal_reminders'
+
+def _start(name, days_ahead, days_expired, restart):
+    """Return the checkpoint to continue from, starting a new run when the last one finished"""
+    checkpoint = db.session.get(SweepCheckpoint, name)
+    if checkpoint and not checkpoint.finished_at and not restart:
+        return checkpoint
+    now = datetime.now()
+    if checkpoint is None:
+        checkpoint = SweepCheckpoint(name=name)
+        db.session.add(checkpoint)
+    checkpoint.window_start = now - timedelta(days=days_expired)
+    checkpoint.window_end = now + timedelta(days=days_ahead)
+    checkpoint.last_expiry = checkpoint.last_id = checkpoint.finished_at = None
+    checkpoint.processed = 0
+    checkpoint.started_at = now
+    db.session.commit()
+    return checkpoint
+
+def sweep_expiring(days_ahead=30, days_expired=365, batch_size=1000, restart=False, name=SWEEP_NAME):
+    """Mark licenses expiring inside the window as due for renewal and enqueue a reminder for each.
+
+    Walks the expiry_date index in (expiry_date, id) keyset pages, so memory stays
+    flat and every read is a short range scan. Each page is marked, enqueued and
+    checkpointed in one short transaction, so an interrupted sweep resumes after
+    the last committed page and never re-sends a reminder.
+    """
+    checkpoint = _start(name, days_ahead, days_expired, restart)
+    window = (DrivingLicense.expiry_date >= checkpoint.window_start,
+              DrivingLicense.expiry_date <= checkpoint.window_end,
+              DrivingLicense.status.notin_(('Failed',) + UNPAID_STATUSES))
+    now = datetime.now()
+    marked = 0
+    started = time.perf_counter()
+    while True:
+        query = select(DrivingLicense.id, DrivingLicense.expiry_date).where(*window)
+        if checkpoint.last_id is not None:
+            query = query.where(tuple_(DrivingLicense.expiry_date, DrivingLicense.id) >
+                                tuple_(checkpoint.last_expiry, checkpoint.last_id))
+        page = db.session.execute(
+            query.order_by(DrivingLicense.expiry_date, DrivingLicense.id).limit(batch_size)
+        ).all()
+        if not page:
+            break
+
+        # Licenses already reminded for their current expiry date are left alone
+        due = db.session.execute(
+            update(DrivingLicense)
+            .where(DrivingLicense.id.in_([row.id for row in page]), *window,
+                   (DrivingLicense.renewal_due_for.is_(None)) |
+                   (DrivingLicense.renewal_due_for != DrivingLicense.expiry_date))
+            .values(renewal_due_for=DrivingLicense.expiry_date)
+            .returning(DrivingLicense.license_number, DrivingLicense.expiry_date)
+        ).all()
+        enqueue_many('send_renewal_reminder', [
+            (f'send_renewal_reminder:{license_number}:{expiry_date:%Y-%m-%d}',
+             {'license_number': license_number, 'expiry_date': expiry_date.strftime('%Y-%m-%d'),
+              'expired': expiry_date < now})
+            for license_number, expiry_date in due
+        ], lane='low')
+        cache.invalidate_after_commit(db.session, *(driving_license_key(row.license_number) for row in due))
+
+        checkpoint.last_expiry, checkpoint.last_id = page[-1].expiry_date, page[-1].id
+        checkpoint.processed += len(page)
+        db.session.commit()
+        marked += len(due)
+
+    checkpoint.finished_at = datetime.now()
+    db.session.commit()
+    elapsed = time.perf_counter() - started
+    return {'scanned': checkpoint.processed, 'marked': marked, 'elapsed': elapsed}
+
+@app.cli.command('expiry-sweep')
+@click.option('--days-ahead', default=30, show_default=True, help='Remind licenses expiring within this many days.')
+@click.option('--days-expired', default=365, show_default=True, help='Also remind licenses expired this many days ago.')
+@click.option('--batch-size', default=1000, show_default=True, help='Licenses per transaction.')
+@click.option('--resume/--restart', default=True, show_default=True, help='Continue an interrupted sweep.')
+def expiry_sweep(days_ahead, days_expired, batch_size, resume):
+    """Mark licenses due for renewal and enqueue reminders; run nightly."""
+    result = sweep_expiring(days_ahead, days_expired, batch_size, restart=not resume)
+    click.echo(f"Scanned {result['scanned']} licenses, marked {result['marked']} due "
+               f"in {result['elapsed']:.1f}s")
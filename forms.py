@@ -4,6 +4,20 @@ from wtforms import (StringField, PasswordField, DateField, SelectField,
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError
 from datetime import date, datetime, timedelta
 
+# Driving test time slots offered each day and the booking window in days from today
+TEST_TIME_SLOTS = [
+    ('09:00', '9:00 AM'),
+    ('10:00', '10:00 AM'),
+    ('11:00', '11:00 AM'),
+    ('12:00', '12:00 PM'),
+    ('13:00', '1:00 PM'),
+    ('14:00', '2:00 PM'),
+    ('15:00', '3:00 PM'),
+    ('16:00', '4:00 PM')
+]
+TEST_BOOKING_MIN_DAYS = 7
+TEST_BOOKING_MAX_DAYS = 60
+
 # Login form
 class LoginForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
@@ -69,27 +83,18 @@ class DrivingLicenseForm(FlaskForm):
     
     # Test slot booking
     test_date = DateField('Preferred Test Date', validators=[DataRequired()])
-    test_time = SelectField('Preferred Time Slot', choices=[
-        ('09:00', '9:00 AM'),
-        ('10:00', '10:00 AM'),
-        ('11:00', '11:00 AM'),
-        ('12:00', '12:00 PM'),
-        ('13:00', '1:00 PM'),
-        ('14:00', '2:00 PM'),
-        ('15:00', '3:00 PM'),
-        ('16:00', '4:00 PM')
-    ], validators=[DataRequired()])
+    test_time = SelectField('Preferred Time Slot', choices=TEST_TIME_SLOTS, validators=[DataRequired()])
     
     submit = SubmitField('Book Test Slot')
     
     def validate_test_date(self, field):
         # Ensure test date is at least 7 days in the future
-        min_date = datetime.now().date() + timedelta(days=7)
+        min_date = datetime.now().date() + timedelta(days=TEST_BOOKING_MIN_DAYS)
         if field.data < min_date:
             raise ValidationError(f'Test date must be at least 7 days from today ({min_date.strftime("%Y-%m-%d")}).')
         
         # Ensure test date is not more than 60 days in the future
-        max_date = datetime.now().date() + timedelta(days=60)
+        max_date = datetime.now().date() + timedelta(days=TEST_BOOKING_MAX_DAYS)
         if field.data > max_date:
             raise ValidationError(f'Test date cannot be more than 60 days from today ({max_date.strftime("%Y-%m-%d")}).')
 
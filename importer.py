@@ -0,0 +1,308 @@
+import csv
+import json
+import os
+import time
+from datetime import datetime
+import click
+from sqlalchemy import insert, select
+from werkzeug.datastructures import MultiDict
+from app import app, db
+from models import (User, LearningLicense, DrivingLicense, ApplicantProfile, Application, APPLICANT_COLUMNS,
+                    LEARNING_STATUSES, DRIVING_STATUSES)
+from forms import SignupForm, LearningLicenseForm, DrivingLicenseForm
+from search import search_index
+
+class LegacyDrivingLicenseForm(DrivingLicenseForm):
+    """Driving license rules without the booking window, which does not apply to past tests"""
+
+    def validate_test_date(self, field):
+        pass
+
+def read_records(path, fmt):
+    """Stream input rows one at a time as (row, errors); a line that does not parse comes back as text"""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                yield row, {}
+        else:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                if isinstance(row, dict):
+                    yield row, {}
+                else:
+                    yield line.rstrip('\r\n'), {'row': ['Not a valid JSON object.']}
+
+def _parse_datetime(row, name, errors, default=None):
+    """Parse an ISO datetime column, recording a field error instead of raising"""
+    value = row.get(name)
+    if not value:
+        return default
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        errors[name] = ['Not a valid datetime value.']
+        return None
+
+def _validate(form, row, fields=None):
+    """Validate a row with a form's rules; returns the form and a dict of errors"""
+    # Reprocessing one bound form is much cheaper than constructing a form per row
+    form.process(formdata=MultiDict({k: '' if v is None else str(v) for k, v in row.items()}))
+    if fields is None:
+        form.validate()
+        return form, dict(form.errors)
+    errors = {}
+    for name in fields:
+        if not form[name].validate(form):
+            errors[name] = form[name].errors
+    return form, errors
+
+class Importer:
+    """Validates rows of one record kind and bulk inserts them in batches"""
+
+    FORMS = {'users': SignupForm, 'learning': LearningLicenseForm, 'driving': LegacyDrivingLicenseForm}
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.form = self.FORMS[kind](formdata=None, meta={'csrf': False})
+
+    def check(self, row):
+        """Return (values, errors) for a row without touching the database"""
+        if self.kind == 'users':
+            _, errors = _validate(self.form, row, fields=['username', 'email'])
+            if not row.get('password_hash'):
+                errors['password_hash'] = ['This field is required.']
+            created_at = _parse_datetime(row, 'created_at', errors, default=datetime.now())
+            return {
+                'username': row.get('username'),
+                'email': row.get('email'),
+                'password_hash': row.get('password_hash'),
+                'created_at': created_at
+            }, errors
+
+        if self.kind == 'learning':
+            form, errors = _validate(self.form, row)
+            if not row.get('application_id'):
+                errors['application_id'] = ['This field is required.']
+            if row.get('status') and row['status'] not in LEARNING_STATUSES:
+                errors['status'] = ['Not a valid choice.']
+            apply_date = _parse_datetime(row, 'apply_date', errors, default=datetime.now())
+            if errors:
+                return None, errors
+            values = {name: form[name].data for name in APPLICANT_COLUMNS}
+            values.update(
+                application_id=row['application_id'],
+                username=row.get('username'),
+                license_type='Learning License',
+                document_type=form.document_type.data,
+                document_path=row.get('document_path') or '',
+                status=row.get('status') or 'Processing',
+                apply_date=apply_date
+            )
+            return values, errors
+
+        form, errors = _validate(self.form, row)
+        for name in ('application_id', 'license_number', 'expiry_date'):
+            if not row.get(name):
+                errors[name] = ['This field is required.']
+        if row.get('status') and row['status'] not in DRIVING_STATUSES:
+            errors['status'] = ['Not a valid choice.']
+        apply_date = _parse_datetime(row, 'apply_date', errors, default=datetime.now())
+        issue_date = _parse_datetime(row, 'issue_date', errors)
+        expiry_date = _parse_datetime(row, 'expiry_date', errors)
+        if errors:
+            return None, errors
+        return {
+            'application_id': row['application_id'],
+            'license_number': row['license_number'],
+            'username': row.get('username'),
+            'learning_license_id': form.learning_license_id.data,
+            'license_type': 'Driving License',
+            'test_date': form.test_date.data,
+            'test_time': form.test_time.data,
+            'status': row.get('status') or 'Scheduled',
+            'apply_date': apply_date,
+            'issue_date': issue_date,
+            'expiry_date': expiry_date
+        }, errors
+
+    def resolve(self, batch):
+        """Check a batch against the database with one query per lookup; returns (rows, rejects)"""
+        rows, rejects = [], []
+        if self.kind == 'users':
+            usernames = {values['username'] for _, values in batch}
+            emails = {values['email'] for _, values in batch}
+            taken = {name for (name,) in db.session.execute(
+                select(User.username).where(User.username.in_(usernames)))}
+            taken |= {email for (email,) in db.session.execute(
+                select(User.email).where(User.email.in_(emails)))}
+            for line, values in batch:
+                if values['username'] in taken or values['email'] in taken:
+                    rejects.append((line, {'username': ['Username or email already exists']}))
+                    continue
+                taken.update((values['username'], values['email']))
+                rows.append(values)
+            return rows, rejects
+
+        users = dict(db.session.execute(
+            select(User.username, User.id).where(User.username.in_({v['username'] for _, v in batch}))).all())
+        ids = {values['application_id'] for _, values in batch}
+        taken = {app_id for (app_id,) in db.session.execute(
+            select(Application.application_id).where(Application.application_id.in_(ids)))}
+        model = LearningLicense if self.kind == 'learning' else DrivingLicense
+        taken |= {app_id for (app_id,) in db.session.execute(
+            select(model.application_id).where(model.application_id.in_(ids)))}
+
+        learning = {}
+        if self.kind == 'driving':
+            learning = {row.application_id: row for row in db.session.execute(
+                select(LearningLicense.application_id, LearningLicense.user_id, LearningLicense.profile_id)
+                .where(LearningLicense.application_id.in_({v['learning_license_id'] for _, v in batch})))}
+            numbers = {values['license_number'] for _, values in batch}
+            taken |= {number for (number,) in db.session.execute(
+                select(DrivingLicense.license_number).where(DrivingLicense.license_number.in_(numbers)))}
+
+        for line, values in batch:
+            user_id = users.get(values.pop('username'))
+            if user_id is None:
+                rejects.append((line, {'username': ['Unknown user']}))
+                continue
+            if values['application_id'] in taken or values.get('license_number') in taken:
+                rejects.append((line, {'application_id': ['Application or license number already exists']}))
+                continue
+            if self.kind == 'driving':
+                parent = learning.get(values['learning_license_id'])
+                if parent is None or parent.user_id != user_id:
+                    rejects.append((line, {'learning_license_id': ['Learning license not found for this user']}))
+                    continue
+                # The driving license shares the learning license's applicant profile, as payment() does
+                values['profile_id'] = parent.profile_id
+                taken.add(values['license_number'])
+            taken.add(values['application_id'])
+            values['user_id'] = user_id
+            rows.append(values)
+        return rows, rejects
+
+    def insert(self, rows):
+        """Insert a batch with a single executemany per table"""
+        insert_rows(self.kind, rows)
+
+def insert_rows(kind, rows):
+    """Insert prepared users, learning or driving license rows and register the applications"""
+    if not rows:
+        return
+    if kind == 'users':
+        db.session.execute(insert(User), rows)
+        return
+    if kind == 'learning':
+        profile_ids = db.session.execute(
+            insert(ApplicantProfile).returning(ApplicantProfile.id, sort_by_parameter_order=True),
+            [{name: values.pop(name) for name in APPLICANT_COLUMNS} for values in rows]
+        ).scalars().all()
+        for values, profile_id in zip(rows, profile_ids):
+            values['profile_id'] = profile_id
+        search_index.index_profiles(profile_ids)
+    model = LearningLicense if kind == 'learning' else DrivingLicense
+    db.session.execute(insert(model), rows)
+    db.session.execute(insert(Application), [{
+        'application_id': values['application_id'],
+        'kind': kind,
+        'user_id': values['user_id'],
+        'license_number': values.get('license_number'),
+        'status': values['status'],
+        'apply_date': values['apply_date']
+    } for values in rows])
+
+def _read_checkpoint(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f)['processed']
+
+def _write_checkpoint(path, processed):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'processed': processed}, f)
+    os.replace(tmp, path)
+
+@app.cli.command('import-records')
+@click.argument('kind', type=click.Choice(['users', 'learning', 'driving']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per executemany batch.')
+@click.option('--commit-size', default=20000, show_default=True, help='Rows per transaction.')
+@click.option('--rejects', 'rejects_path', type=click.Path(dir_okay=False), help='Defaults to PATH.rejects.jsonl.')
+@click.option('--resume/--restart', default=True, show_default=True, help='Continue from the last checkpoint.')
+def import_records(kind, path, fmt, batch_size, commit_size, rejects_path, resume):
+    """Bulk import legacy users, learning licenses or driving licenses from CSV or JSONL."""
+    fmt = fmt or ('csv' if path.endswith('.csv') else 'jsonl')
+    rejects_path = rejects_path or f'{path}.rejects.jsonl'
+    checkpoint_path = f'{path}.checkpoint'
+    skip = _read_checkpoint(checkpoint_path) if resume else 0
+    processed = skip
+    imported = rejected = uncommitted = 0
+    batch = []
+    start = time.perf_counter()
+
+    with app.test_request_context(), open(rejects_path, 'a' if skip else 'w', encoding='utf-8') as rejects:
+        importer = Importer(kind)
+
+        # Held until the commit that checkpoints past them, so a resumed run does not write them twice
+        pending_rejects = []
+
+        def reject(line, row, errors):
+            pending_rejects.append(json.dumps({'line': line, 'errors': errors, 'row': row}, default=str) + '\n')
+
+        def flush():
+            nonlocal imported, rejected, uncommitted
+            rows, failed = importer.resolve(batch)
+            importer.insert(rows)
+            for line, errors in failed:
+                reject(line, originals[line], errors)
+            imported += len(rows)
+            rejected += len(failed)
+            uncommitted += len(batch)
+            batch.clear()
+            originals.clear()
+
+        def commit():
+            nonlocal uncommitted
+            if batch:
+                flush()
+            db.session.commit()
+            rejects.writelines(pending_rejects)
+            rejects.flush()
+            pending_rejects.clear()
+            _write_checkpoint(checkpoint_path, processed)
+            uncommitted = 0
+
+        originals = {}
+        for line, (row, errors) in enumerate(read_records(path, fmt), start=1):
+            if line <= skip:
+                continue
+            processed = line
+            if not errors:
+                values, errors = importer.check(row)
+            if errors:
+                reject(line, row, errors)
+                rejected += 1
+                uncommitted += 1
+                continue
+            batch.append((line, values))
+            originals[line] = row
+            if len(batch) >= batch_size:
+                flush()
+            if uncommitted >= commit_size:
+                commit()
+
+        commit()
+
+    elapsed = time.perf_counter() - start
+    click.echo(f'Imported {imported} {kind} rows, rejected {rejected} '
+               f'({(imported + rejected) / elapsed if elapsed else 0:.0f} rows/s)')
+    if skip:
+        click.echo(f'Resumed after line {skip}')
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import and_, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import Job, LearningLicense, DrivingLicense, Document
+from storage import documents
+
+logger = logging.getLogger(__name__)
+
+# Priority lanes; lower numbers are claimed first
+LANES = {'high': 0, 'default': 5, 'low': 9}
+
+HANDLERS = {}
+
+def job(name):
+    """Register a function as the handler for jobs called name"""
+    def decorator(fn):
+        HANDLERS[name] = fn
+        return fn
+    return decorator
+
+def enqueue(name, key=None, lane='default', max_attempts=5, delay=0, **payload):
+    """Add a job to the current transaction; a job whose key already exists is not added twice"""
+    if name not in HANDLERS:
+        raise ValueError(f'No handler registered for job {name}')
+    try:
+        with db.session.begin_nested():
+            db.session.add(Job(
+                name=name,
+                key=key or f'{name}:{uuid.uuid4().hex}',
+                payload=json.dumps(payload),
+                priority=LANES[lane],
+                max_attempts=max_attempts,
+                run_at=datetime.utcnow() + timedelta(seconds=delay)
+            ))
+        return True
+    except IntegrityError:
+        return False
+
+def enqueue_many(name, jobs, lane='default', max_attempts=5):
+    """Add (key, payload) jobs with one insert, falling back to enqueue when a key already exists"""
+    if name not in HANDLERS:
+        raise ValueError(f'No handler registered for job {name}')
+    now = datetime.utcnow()
+    rows = [{'name': name, 'key': key, 'payload': json.dumps(payload), 'priority': LANES[lane],
+             'max_attempts': max_attempts, 'run_at': now, 'created_at': now} for key, payload in jobs]
+    if not rows:
+        return 0
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(Job), rows)
+        return len(rows)
+    except IntegrityError:
+        return sum(enqueue(name, key=key, lane=lane, max_attempts=max_attempts, **payload) for key, payload in jobs)
+
+def backoff(attempts, base=5, cap=3600):
+    """Seconds to wait before retry number attempts, exponential with jitter"""
+    return min(cap, base * 2 ** (attempts - 1)) * random.uniform(0.5, 1.0)
+
+class Worker:
+    """Claims and runs jobs; several threads of one worker share nothing but the database"""
+
+    def __init__(self, lanes=None, lease=300, poll_interval=1.0):
+        self.priorities = [LANES[lane] for lane in (lanes or LANES)]
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.worker_id = f'{os.uname().nodename}:{os.getpid()}'
+        self.stopping = threading.Event()
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def claim(self):
+        """Lease the next runnable job, or return None.
+
+        Expired leases of crashed workers are reclaimed while attempts remain; a job
+        whose worker died on its last attempt (e.g. killed while running it) is failed.
+        """
+        now = datetime.utcnow()
+        expired = and_(Job.status == 'running', Job.locked_until < now)
+        runnable = or_(and_(Job.status == 'queued', Job.run_at <= now), expired)
+        candidates = db.session.execute(
+            select(Job.id, Job.name, Job.attempts, Job.max_attempts).where(runnable, Job.priority.in_(self.priorities))
+            .order_by(Job.priority, Job.run_at).limit(10).with_for_update(skip_locked=True)
+        ).all()
+        for job_id, name, attempts, max_attempts in candidates:
+            if attempts >= max_attempts:
+                error = f'Lease expired on attempt {attempts} of {max_attempts}; the worker running it stopped'
+                if db.session.execute(
+                    update(Job).where(Job.id == job_id, expired, Job.attempts >= Job.max_attempts).values(
+                        status='failed', finished_at=now, last_error=error, locked_by=None, locked_until=None
+                    ).execution_options(synchronize_session=False)
+                ).rowcount:
+                    logger.error('Job %s (%s) failed permanently: %s', job_id, name, error)
+                continue
+            # The conditional update makes the claim atomic even without row locks (SQLite)
+            claimed = db.session.execute(
+                update(Job).where(Job.id == job_id, runnable, Job.attempts < Job.max_attempts).values(
+                    status='running',
+                    locked_by=self.worker_id,
+                    locked_until=now + timedelta(seconds=self.lease),
+                    started_at=now,
+                    attempts=Job.attempts + 1
+                ).execution_options(synchronize_session=False)
+            ).rowcount
+            if claimed:
+                db.session.commit()
+                return db.session.get(Job, job_id, populate_existing=True)
+        db.session.commit()
+        return None
+
+    def run_one(self):
+        job_row = self.claim()
+        if job_row is None:
+            return False
+        try:
+            HANDLERS[job_row.name](**json.loads(job_row.payload))
+        except Exception:
+            db.session.rollback()
+            error = traceback.format_exc()
+            if job_row.attempts >= job_row.max_attempts:
+                values = {'status': 'failed', 'finished_at': datetime.utcnow()}
+                logger.error('Job %s (%s) failed permanently: %s', job_row.id, job_row.name, error)
+            else:
+                values = {'status': 'queued',
+                          'run_at': datetime.utcnow() + timedelta(seconds=backoff(job_row.attempts))}
+            values.update(last_error=error, locked_by=None, locked_until=None)
+            with self._lock:
+                self.failed += 1
+        else:
+            values = {'status': 'done', 'finished_at': datetime.utcnow(), 'locked_by': None, 'locked_until': None}
+        db.session.execute(update(Job).where(Job.id == job_row.id, Job.locked_by == self.worker_id)
+                           .values(**values).execution_options(synchronize_session=False))
+        db.session.commit()
+        with self._lock:
+            self.processed += 1
+        return True
+
+    def loop(self, burst=False):
+        with app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    ran = self.run_one()
+                except Exception:
+                    # Database hiccups (e.g. a locked SQLite file) must not kill the worker thread
+                    logger.exception('Job worker error')
+                    db.session.rollback()
+                    self.stopping.wait(self.poll_interval)
+                    continue
+                if not ran:
+                    if burst:
+                        break
+                    self.stopping.wait(self.poll_interval)
+            db.session.remove()
+
+    def run(self, concurrency=1, burst=False):
+        """Run concurrency threads until stopped, or until the queue is empty when burst is set"""
+        threads = [threading.Thread(target=self.loop, args=(burst,), daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stopping.set()
+            for thread in threads:
+                thread.join()
+
+def queue_depth(statuses=('queued', 'running', 'failed')):
+    """{(lane, status): count} of jobs in statuses; done jobs pile up, so they are left out by default"""
+    lane_names = {priority: lane for lane, priority in LANES.items()}
+    rows = db.session.query(Job.priority, Job.status, func.count()).filter(Job.status.in_(statuses)).group_by(
+        Job.priority, Job.status)
+    return {(lane_names.get(priority, str(priority)), status): count for priority, status, count in rows}
+
+def oldest_queued_seconds():
+    """How long the oldest runnable queued job has been waiting to be claimed"""
+    now = datetime.utcnow()
+    oldest = db.session.query(func.min(Job.run_at)).filter(Job.status == 'queued', Job.run_at <= now).scalar()
+    return (now - oldest).total_seconds() if oldest else 0.0
+
+def queue_stats():
+    """Queue depth per lane and status, plus the age of the oldest runnable job and recent wait times"""
+    depth = {}
+    for (lane, status), count in queue_depth(('queued', 'running', 'done', 'failed')).items():
+        depth.setdefault(lane, {})[status] = count
+
+    recent = db.session.query(Job.created_at, Job.started_at, Job.finished_at).filter(
+        Job.status == 'done').order_by(Job.finished_at.desc()).limit(1000).all()
+    waits = sorted((started - created).total_seconds() for created, started, _ in recent)
+    return {
+        'depth': depth,
+        'oldest_queued_seconds': oldest_queued_seconds(),
+        'wait_p50_seconds': waits[len(waits) // 2] if waits else 0.0,
+        'wait_p95_seconds': waits[int(len(waits) * 0.95)] if waits else 0.0,
+    }
+
+# Post-payment jobs
+
+@job('verify_document')
+def verify_document(application_id):
+    """Re-hash a learning license document and compare it with the digest recorded at upload"""
+    learning_license = LearningLicense.query.filter_by(application_id=application_id).first()
+    if not learning_license or not learning_license.document_sha256:
+        return
+    document = Document.query.filter_by(sha256=learning_license.document_sha256).first()
+    if document is None:
+        # Nothing left to compare against; a retry would not bring the row back
+        logger.warning('No stored document %s for application %s', learning_license.document_sha256, application_id)
+        return
+    digest = hashlib.sha256()
+    with documents.store.open(document.storage_key) as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    if digest.hexdigest() != document.sha256:
+        raise ValueError(f'Document for {application_id} does not match its recorded SHA-256')
+
+@job('send_confirmation')
+def send_confirmation(application_id, license_type, email=None):
+    """Confirmation notice for a paid application; delivery is logged until a mail backend is configured"""
+    logger.info('Confirmation for %s application %s sent to %s', license_type, application_id, email)
+
+# Renewal reminders
+
+@job('send_renewal_reminder')
+def send_renewal_reminder(license_number, expiry_date, expired=False):
+    """Reminder that a license is about to expire or has expired; logged until a mail backend is configured"""
+    driving_license = DrivingLicense.query.filter_by(license_number=license_number).first()
+    email = driving_license.email if driving_license else None
+    logger.info('Renewal reminder for license %s %s %s sent to %s', license_number,
+                'expired' if expired else 'expiring', expiry_date, email)
+
+# CLI
+
+@app.cli.command('jobs-worker')
+@click.option('--concurrency', default=4, show_default=True, help='Worker threads.')
+@click.option('--lane', 'lanes', multiple=True, type=click.Choice(list(LANES)), help='Lanes to serve (default all).')
+@click.option('--burst', is_flag=True, help='Exit when the queue is empty.')
+def jobs_worker(concurrency, lanes, burst):
+    """Run background jobs."""
+    worker = Worker(lanes=lanes or None)
+    started = time.perf_counter()
+    worker.run(concurrency=concurrency, burst=burst)
+    elapsed = time.perf_counter() - started
+    click.echo(f'Processed {worker.processed} jobs ({worker.failed} failures) in {elapsed:.1f}s')
+
+@app.cli.command('jobs-stats')
+def jobs_stats():
+    """Show queue depth and latency."""
+    click.echo(json.dumps(queue_stats(), indent=2))
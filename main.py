@@ -1,4 +1,9 @@
+import os
 from app import app
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Development server; run server.py in production, after "flask db-upgrade"
+    from migrations import upgrade
+    with app.app_context():
+        upgrade()
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", "5000")), debug=os.environ.get("FLASK_DEBUG") == "1")
@@ -0,0 +1,275 @@
+import bisect
+import json
+import os
+import threading
+import time
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+def _labels(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+class Counter:
+    shared = True
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def state(self):
+        with self._lock:
+            return [[list(label_values), value] for label_values, value in self.values.items()]
+
+    def merge(self, values, state):
+        for label_values, value in state:
+            key = tuple(label_values)
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values=None):
+        if values is None:
+            # From a snapshot taken under the lock, as observations may add label values meanwhile
+            values = {}
+            self.merge(values, self.state())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for label_values, value in sorted(values.items()):
+            labels = _labels(self.labels, label_values)
+            lines.append(f'{self.name}{{{labels}}} {value}' if labels else f'{self.name} {value}')
+        return lines
+
+class Histogram:
+    shared = True
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        # Counts are kept per bucket and made cumulative only when rendered
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def state(self):
+        with self._lock:
+            return [[list(label_values), [list(counts), total, count]]
+                    for label_values, (counts, total, count) in self.values.items()]
+
+    def merge(self, values, state):
+        for label_values, (counts, total, count) in state:
+            entry = values.setdefault(tuple(label_values), [[0] * (len(self.buckets) + 1), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], counts)]
+            entry[1] += total
+            entry[2] += count
+
+    def render(self, values=None):
+        if values is None:
+            values = {}
+            self.merge(values, self.state())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for label_values, (counts, total, count) in sorted(values.items()):
+            labels = _labels(self.labels, label_values)
+            prefix = f'{labels},' if labels else ''
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {count}')
+        return lines
+
+class Gauge:
+    """Value read from a callback at scrape time; kind='counter' for totals kept elsewhere.
+
+    With labels, the callback returns {label values: value}. Counters are taken to be
+    per process and are summed across workers, while gauges are read by whichever
+    worker answers the scrape.
+    """
+
+    def __init__(self, name, help, read, kind='gauge', labels=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+        self.labels = labels
+        self.shared = kind == 'counter'
+
+    def _values(self):
+        return self.read() if self.labels else {(): self.read()}
+
+    def state(self):
+        return [[list(label_values), value] for label_values, value in self._values().items()]
+
+    def merge(self, values, state):
+        for label_values, value in state:
+            key = tuple(label_values)
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values=None):
+        values = self._values() if values is None else values or {(): 0}
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for label_values, value in sorted(values.items()):
+            labels = _labels(self.labels, label_values)
+            lines.append(f'{self.name}{{{labels}}} {value}' if labels else f'{self.name} {value}')
+        return lines
+
+REQUESTS = Counter('http_requests_total', 'Requests handled', ('endpoint', 'method', 'status'))
+LATENCY = Histogram('http_request_duration_seconds', 'Request latency', ('endpoint',))
+DB_STATEMENTS = Counter('db_statements_total', 'SQL statements executed', ('endpoint',))
+DB_STATEMENTS_PER_REQUEST = Histogram('db_statements_per_request', 'SQL statements per request', ('endpoint',),
+                                      buckets=COUNT_BUCKETS)
+DB_TIME = Histogram('db_duration_seconds', 'Time spent in SQL per request', ('endpoint',))
+PASSWORD_HASH_TIME = Histogram('password_hash_duration_seconds', 'Password hashing time including pool wait',
+                               ('operation',), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+class Metrics:
+    """Request instrumentation exposed in Prometheus text format.
+
+    Metrics are kept per process. With METRICS_DIR set, every process writes its
+    totals there each METRICS_FLUSH_INTERVAL seconds and the worker answering a
+    scrape adds up all the files, so one scrape covers every pre-fork worker.
+    Files of exited workers are kept, so totals never go backwards.
+    """
+
+    def __init__(self, app=None):
+        self.metrics = [REQUESTS, LATENCY, DB_STATEMENTS, DB_STATEMENTS_PER_REQUEST, DB_TIME, PASSWORD_HASH_TIME]
+        self.enabled = False
+        self.directory = None
+        self.flush_interval = 1.0
+        self._local = threading.local()
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 1.0)
+        self.enabled = app.config['METRICS_ENABLED']
+        self.directory = app.config['METRICS_DIR']
+        self.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+        app.before_request(self._start)
+        app.after_request(self._finish)
+
+    def add(self, metric):
+        self.metrics.append(metric)
+
+    def _start(self):
+        if not self.enabled:
+            return
+        self._local.statements = 0
+        self._local.db_time = 0.0
+        self._local.tracking = True
+        g.metrics_started = time.perf_counter()
+
+    def _finish(self, response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        REQUESTS.inc(endpoint, request.method, response.status_code)
+        LATENCY.observe(time.perf_counter() - started, endpoint)
+        DB_STATEMENTS.inc(endpoint, amount=self._local.statements)
+        DB_STATEMENTS_PER_REQUEST.observe(self._local.statements, endpoint)
+        DB_TIME.observe(self._local.db_time, endpoint)
+        self._local.tracking = False
+        if self.directory and self._flusher_pid != os.getpid():
+            self._start_flusher()
+        return response
+
+    def _start_flusher(self):
+        # Threads do not survive fork, so each worker starts its own on its first request
+        with self._flush_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """Write this process's totals to METRICS_DIR"""
+        state = {metric.name: metric.state() for metric in self.metrics if metric.shared}
+        path = os.path.join(self.directory, f'{os.getpid()}.json')
+        with self._flush_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(state, f)
+            os.replace(f'{path}.tmp', path)
+
+    def clear(self):
+        """Forget the totals of earlier runs; the pre-fork master calls this on a fresh start"""
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    os.unlink(os.path.join(self.directory, name))
+
+    def _shared_values(self):
+        self.flush()
+        values = {metric.name: {} for metric in self.metrics if metric.shared}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric in self.metrics:
+                if metric.shared:
+                    metric.merge(values[metric.name], state.get(metric.name, []))
+        return values
+
+    def statement_started(self):
+        if getattr(self._local, 'tracking', False):
+            self._local.statement_started = time.perf_counter()
+
+    def statement_finished(self):
+        if getattr(self._local, 'tracking', False):
+            self._local.statements += 1
+            self._local.db_time += time.perf_counter() - self._local.statement_started
+
+    def render(self):
+        values = self._shared_values() if self.directory else {}
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(values.get(metric.name)))
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics.statement_started()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics.statement_finished()
+
+def observe_password_hash(sender, operation, seconds):
+    PASSWORD_HASH_TIME.observe(seconds, operation)
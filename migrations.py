@@ -0,0 +1,117 @@
+import time
+from collections import namedtuple
+import click
+from sqlalchemy import inspect, insert, select, text
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import LearningLicense, DrivingLicense, Payment, SchemaMigration
+from profiles import migrate_applicant_profiles
+from search import create_search_index
+from registry import backfill_registry
+
+Migration = namedtuple('Migration', 'version name upgrade')
+
+# Columns added to tables that existed before versioned migrations
+ADDED_COLUMNS = [
+    LearningLicense.__table__.c.document_sha256,
+    LearningLicense.__table__.c.document_size,
+    DrivingLicense.__table__.c.renewal_due_for,
+    Payment.__table__.c.method,
+]
+
+# Indexes superseded by a wider one
+DROPPED_INDEXES = ['ix_application_user_id']
+
+def _create_tables(conn):
+    db.metadata.create_all(conn)
+
+def _add_columns(conn):
+    for col in ADDED_COLUMNS:
+        if col.name not in {c['name'] for c in inspect(conn).get_columns(col.table.name)}:
+            conn.execute(text(f'ALTER TABLE {col.table.name} ADD COLUMN {col.name} '
+                              f'{col.type.compile(dialect=conn.dialect)}'))
+
+def _create_indexes(conn):
+    for name in DROPPED_INDEXES:
+        conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+def _create_search_index(conn):
+    create_search_index(conn)
+    if conn.dialect.name == 'sqlite':
+        conn.execute(text('INSERT OR REPLACE INTO applicant_search(rowid, name, phone, city) '
+                          'SELECT id, name, phone, city FROM applicant_profile'))
+
+def _backfill_registry(conn):
+    # In the upgrade's transaction, so the backfill and its migration record commit together
+    backfill_registry(conn, commit=False)
+
+# Applied in order, each at most once per database. Databases created before versioning
+# start from version 1, so every step leaves an already up-to-date schema alone.
+MIGRATIONS = [
+    Migration(1, 'create tables added since the original schema', _create_tables),
+    Migration(2, 'add document digest and renewal reminder columns', _add_columns),
+    Migration(3, 'move applicant details into shared profiles', migrate_applicant_profiles),
+    Migration(4, 'index foreign keys and filter columns', _create_indexes),
+    Migration(5, 'add API tokens for driving schools', _create_tables),
+    Migration(6, 'add gateway payments', _create_tables),
+    Migration(7, 'add officer search index', _create_search_index),
+    Migration(8, 'add payment method for invoiced batch applications', _add_columns),
+    Migration(9, 'register applications created before the registry', _backfill_registry),
+]
+
+def applied_versions():
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    with db.engine.connect() as conn:
+        return set(conn.execute(select(SchemaMigration.version)).scalars())
+
+def _record(conn, migrations):
+    # Written first, so the transaction holds the write lock and a concurrent deploy
+    # running the same migration fails on the primary key instead of repeating it
+    conn.execute(insert(SchemaMigration), [{'version': m.version, 'name': m.name} for m in migrations])
+
+def upgrade():
+    """Apply pending migrations, each in its own transaction; returns the ones applied.
+
+    An empty database gets the current schema in one step and is marked as fully migrated.
+    """
+    applied = applied_versions()
+    pending = [m for m in MIGRATIONS if m.version not in applied]
+    fresh = not applied and set(inspect(db.engine).get_table_names()) <= {SchemaMigration.__tablename__}
+    batches = [(MIGRATIONS, _create_tables)] if fresh else [([m], m.upgrade) for m in pending]
+
+    done = []
+    for migrations, upgrade_schema in batches:
+        with db.engine.connect() as conn:
+            try:
+                _record(conn, migrations)
+            except IntegrityError:
+                # Applied by another process in the meantime
+                conn.rollback()
+                continue
+            upgrade_schema(conn)
+            conn.commit()
+        done.extend(migrations)
+    return done
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Create or upgrade the database schema; run once per deploy."""
+    start = time.perf_counter()
+    done = upgrade()
+    for migration in done:
+        click.echo(f'Applied {migration.version}: {migration.name}')
+    if not done:
+        click.echo('Schema is up to date')
+    else:
+        click.echo(f'Schema at version {MIGRATIONS[-1].version} in {time.perf_counter() - start:.2f}s')
+
+@app.cli.command('db-status')
+def db_status():
+    """List applied and pending schema migrations."""
+    applied = applied_versions()
+    for migration in MIGRATIONS:
+        click.echo(f"{'applied' if migration.version in applied else 'pending'} "
+                   f"{migration.version}: {migration.name}")
@@ -1,7 +1,47 @@
 from datetime import datetime
+from sqlalchemy.ext.associationproxy import association_proxy
 from app import db
 from flask_login import UserMixin
 
+# Allowed values of coded columns; codes are positions, so only ever append
+GENDERS = ('male', 'female', 'other')
+BLOOD_GROUPS = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+RH_FACTORS = ('positive', 'negative')
+DOCUMENT_TYPES = ('aadhar', 'passport', 'voter_id', 'pan_card')
+LEARNING_STATUSES = ('Processing', 'Approved', 'Rejected', 'Expired', 'Payment Pending', 'Payment Failed')
+DRIVING_STATUSES = ('Scheduled', 'Passed', 'Failed', 'Renewed', 'Payment Pending', 'Payment Failed')
+
+# Statuses of applications whose fee has not been collected (see payments.py)
+UNPAID_STATUSES = ('Payment Pending', 'Payment Failed')
+
+# Applicant details kept on the shared profile instead of on each license
+APPLICANT_COLUMNS = ('name', 'dob', 'gender', 'place_of_birth', 'phone', 'email', 'address', 'city',
+                     'state', 'zip_code', 'blood_group', 'rh_factor', 'citizenship')
+
+class CodedEnum(db.TypeDecorator):
+    """A string from a fixed tuple of values, stored as its position in a small integer"""
+    impl = db.SmallInteger
+    cache_ok = True
+
+    def __init__(self, values):
+        super().__init__()
+        self.values = tuple(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value not in self.codes:
+            raise ValueError(f'{value!r} is not one of {self.values}')
+        return self.codes[value]
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else self.values[int(value)]
+
+def _applicant_detail(name):
+    """Read and write an applicant detail through the license's profile, creating it on first write"""
+    return association_proxy('profile', name, creator=lambda value: ApplicantProfile(**{name: value}))
+
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
@@ -18,56 +58,96 @@ class User(UserMixin, db.Model):
 class LearningLicense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     application_id = db.Column(db.String(20), unique=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     
-    # Personal Information
-    name = db.Column(db.String(100), nullable=False)
-    dob = db.Column(db.Date, nullable=False)
-    gender = db.Column(db.String(10), nullable=False)
-    place_of_birth = db.Column(db.String(100), nullable=False)
-    
-    # Contact Information
-    phone = db.Column(db.String(15), nullable=False)
-    email = db.Column(db.String(120), nullable=False)
-    
-    # Address Information
-    address = db.Column(db.String(200), nullable=False)
-    city = db.Column(db.String(50), nullable=False)
-    state = db.Column(db.String(50), nullable=False)
-    zip_code = db.Column(db.String(10), nullable=False)
+    # Applicant details, shared with driving licenses issued from this learning license
+    profile_id = db.Column(db.Integer, db.ForeignKey('applicant_profile.id'), nullable=False, index=True)
+    profile = db.relationship('ApplicantProfile', lazy='joined', innerjoin=True)
     
     # License Information
     license_type = db.Column(db.String(50), default='Learning License')
     
-    # Medical Information
-    blood_group = db.Column(db.String(5), nullable=False)
-    rh_factor = db.Column(db.String(10), nullable=False)
-    
-    # Citizenship Information
-    citizenship = db.Column(db.String(50), nullable=False)
-    
     # Document Information
-    document_type = db.Column(db.String(50), nullable=False)
+    document_type = db.Column(CodedEnum(DOCUMENT_TYPES), nullable=False)
     document_path = db.Column(db.String(255), nullable=True)
+    document_sha256 = db.Column(db.String(64), nullable=True)
+    document_size = db.Column(db.Integer, nullable=True)
     
     # Application Status
-    status = db.Column(db.String(20), default='Processing')
+    status = db.Column(CodedEnum(LEARNING_STATUSES), default='Processing', index=True)
     apply_date = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     driving_licenses = db.relationship('DrivingLicense', backref='learning_license', lazy=True)
 
+    # Applicant details, read and written through the profile
+    name = _applicant_detail('name')
+    dob = _applicant_detail('dob')
+    gender = _applicant_detail('gender')
+    place_of_birth = _applicant_detail('place_of_birth')
+    phone = _applicant_detail('phone')
+    email = _applicant_detail('email')
+    address = _applicant_detail('address')
+    city = _applicant_detail('city')
+    state = _applicant_detail('state')
+    zip_code = _applicant_detail('zip_code')
+    blood_group = _applicant_detail('blood_group')
+    rh_factor = _applicant_detail('rh_factor')
+    citizenship = _applicant_detail('citizenship')
+
 class DrivingLicense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     application_id = db.Column(db.String(20), unique=True, nullable=False)
     license_number = db.Column(db.String(20), unique=True, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    learning_license_id = db.Column(db.String(20), db.ForeignKey('learning_license.application_id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    learning_license_id = db.Column(db.String(20), db.ForeignKey('learning_license.application_id'), nullable=False, index=True)
+    
+    # Applicant details, shared with the learning license
+    profile_id = db.Column(db.Integer, db.ForeignKey('applicant_profile.id'), nullable=False, index=True)
+    profile = db.relationship('ApplicantProfile', lazy='joined', innerjoin=True)
+    
+    # License Information
+    license_type = db.Column(db.String(50), default='Driving License')
+    
+    # Test Information
+    test_date = db.Column(db.Date, nullable=False)
+    test_time = db.Column(db.String(10), nullable=False)
+    
+    # Application Status
+    status = db.Column(CodedEnum(DRIVING_STATUSES), default='Scheduled', index=True)
+    apply_date = db.Column(db.DateTime, default=datetime.utcnow)
+    issue_date = db.Column(db.DateTime, nullable=True)
+    expiry_date = db.Column(db.DateTime, nullable=False, index=True)
+
+    # Expiry date a renewal reminder was issued for; renewing moves expiry_date past it
+    renewal_due_for = db.Column(db.DateTime, nullable=True)
     
-    # Personal Information (copied from Learning License)
+    # Relationships
+    renewals = db.relationship('LicenseRenewal', backref='driving_license', lazy=True)
+    changes = db.relationship('LicenseChangeRequest', backref='driving_license', lazy=True)
+
+    # Applicant details, read and written through the profile
+    name = _applicant_detail('name')
+    dob = _applicant_detail('dob')
+    gender = _applicant_detail('gender')
+    place_of_birth = _applicant_detail('place_of_birth')
+    phone = _applicant_detail('phone')
+    email = _applicant_detail('email')
+    address = _applicant_detail('address')
+    city = _applicant_detail('city')
+    state = _applicant_detail('state')
+    zip_code = _applicant_detail('zip_code')
+    blood_group = _applicant_detail('blood_group')
+    rh_factor = _applicant_detail('rh_factor')
+    citizenship = _applicant_detail('citizenship')
+
+class ApplicantProfile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    
+    # Personal Information
     name = db.Column(db.String(100), nullable=False)
     dob = db.Column(db.Date, nullable=False)
-    gender = db.Column(db.String(10), nullable=False)
+    gender = db.Column(CodedEnum(GENDERS), nullable=False)
     place_of_birth = db.Column(db.String(100), nullable=False)
     
     # Contact Information
@@ -80,34 +160,17 @@ class DrivingLicense(db.Model):
     state = db.Column(db.String(50), nullable=False)
     zip_code = db.Column(db.String(10), nullable=False)
     
-    # License Information
-    license_type = db.Column(db.String(50), default='Driving License')
-    
     # Medical Information
-    blood_group = db.Column(db.String(5), nullable=False)
-    rh_factor = db.Column(db.String(10), nullable=False)
+    blood_group = db.Column(CodedEnum(BLOOD_GROUPS), nullable=False)
+    rh_factor = db.Column(CodedEnum(RH_FACTORS), nullable=False)
     
     # Citizenship Information
     citizenship = db.Column(db.String(50), nullable=False)
-    
-    # Test Information
-    test_date = db.Column(db.Date, nullable=False)
-    test_time = db.Column(db.String(10), nullable=False)
-    
-    # Application Status
-    status = db.Column(db.String(20), default='Scheduled')
-    apply_date = db.Column(db.DateTime, default=datetime.utcnow)
-    issue_date = db.Column(db.DateTime, nullable=True)
-    expiry_date = db.Column(db.DateTime, nullable=False)
-    
-    # Relationships
-    renewals = db.relationship('LicenseRenewal', backref='driving_license', lazy=True)
-    changes = db.relationship('LicenseChangeRequest', backref='driving_license', lazy=True)
 
 class LicenseRenewal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    license_number = db.Column(db.String(20), db.ForeignKey('driving_license.license_number'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    license_number = db.Column(db.String(20), db.ForeignKey('driving_license.license_number'), nullable=False, index=True)
     renewal_date = db.Column(db.DateTime, default=datetime.utcnow)
     renewal_reason = db.Column(db.String(200), nullable=False)
     old_expiry_date = db.Column(db.DateTime, nullable=False)
@@ -115,8 +178,8 @@ class LicenseRenewal(db.Model):
 
 class LicenseChangeRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    license_number = db.Column(db.String(20), db.ForeignKey('driving_license.license_number'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    license_number = db.Column(db.String(20), db.ForeignKey('driving_license.license_number'), nullable=False, index=True)
     request_date = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Old values
@@ -134,4 +197,153 @@ class LicenseChangeRequest(db.Model):
     new_phone = db.Column(db.String(15), nullable=False)
     
     # Status
-    status = db.Column(db.String(20), default='Pending')
+    status = db.Column(db.String(20), default='Pending', index=True)
+
+class TestSlot(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('test_date', 'test_time', name='uq_test_slot_date_time'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    test_date = db.Column(db.Date, nullable=False)
+    test_time = db.Column(db.String(10), nullable=False)
+
+    # Inventory
+    capacity = db.Column(db.Integer, nullable=False)
+    booked = db.Column(db.Integer, nullable=False, default=0)
+
+class Application(db.Model):
+    __table_args__ = (
+        # Serves per-user lookups and keyset pagination of the dashboard, newest first
+        db.Index('ix_application_user_apply_date', 'user_id', 'apply_date', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    application_id = db.Column(db.String(20), unique=True, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+    # License number the application refers to (renewals and change requests)
+    license_number = db.Column(db.String(20), nullable=True)
+
+    # Application Status
+    status = db.Column(db.String(20), nullable=False)
+    apply_date = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Document(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    storage_key = db.Column(db.String(255), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    file_type = db.Column(db.String(10), nullable=False)
+
+    # Number of applications referencing this content; unreferenced documents are collected
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    last_used = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class Job(db.Model):
+    __table_args__ = (
+        db.Index('ix_job_claim', 'status', 'priority', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+
+    # Jobs with the same key are enqueued only once
+    key = db.Column(db.String(120), unique=True, nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=5)
+
+    # Scheduling
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(64), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+
+    # Timings
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class IdSequence(db.Model):
+    name = db.Column(db.String(20), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class SessionRecord(db.Model):
+    id = db.Column(db.String(64), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+class StatusTransitionAudit(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    transition = db.Column(db.String(40), nullable=False, index=True)
+    from_status = db.Column(db.String(100), nullable=False)
+    to_status = db.Column(db.String(20), nullable=False)
+
+    # One row per committed chunk
+    rows = db.Column(db.Integer, nullable=False)
+    first_id = db.Column(db.Integer, nullable=True)
+    last_id = db.Column(db.Integer, nullable=True)
+    filters = db.Column(db.Text, nullable=False, default='{}')
+    actor = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class SweepCheckpoint(db.Model):
+    name = db.Column(db.String(40), primary_key=True)
+
+    # Window of the current run, kept so a resumed run finishes the same window
+    window_start = db.Column(db.DateTime, nullable=False)
+    window_end = db.Column(db.DateTime, nullable=False)
+
+    # Last row processed, in (expiry_date, id) order
+    last_expiry = db.Column(db.DateTime, nullable=True)
+    last_id = db.Column(db.Integer, nullable=True)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class Payment(db.Model):
+    __table_args__ = (
+        # Serves the reconciliation scan of payments still pending
+        db.Index('ix_payment_status_created_at', 'status', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    # Sent to the gateway as the idempotency key, so a retried charge is never taken twice
+    payment_id = db.Column(db.String(32), unique=True, nullable=False)
+    application_id = db.Column(db.String(20), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount = db.Column(db.Integer, nullable=False)
+
+    # card through the gateway, or invoice for batch API accounts billed out of band
+    method = db.Column(db.String(10), nullable=True, default='card')
+
+    # pending until the gateway answers or calls back, then succeeded or failed
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    gateway_reference = db.Column(db.String(64), nullable=True)
+    error = db.Column(db.String(200), nullable=True)
+
+    # What is needed to finish the application once paid, as JSON
+    details = db.Column(db.Text, nullable=False, default='{}')
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class ApiToken(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+
+    # Only the digest is kept; the token itself is shown once when it is created
+    token_sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    revoked_at = db.Column(db.DateTime, nullable=True)
+
+class SchemaMigration(db.Model):
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,140 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from blinker import Namespace
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# Sent with operation ('hash' or 'verify') and seconds after every hashing call
+hash_timed = Namespace().signal('password-hash-timed')
+
+class HasherBusy(Exception):
+    """Raised when the hashing pool is saturated and the request should be retried later"""
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+def _verify(stored_hash, password, method):
+    """Check a password and, when the stored hash uses outdated parameters, rehash it in the same call"""
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if stored_hash.split('$', 1)[0] != method:
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+class PasswordHasher:
+    """Runs password hashing on a bounded process pool instead of the request thread"""
+
+    def __init__(self, app=None):
+        self.method = None
+        self.configured_method = None
+        self.workers = 0
+        self.max_pending = 0
+        self.timeout = None
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', os.cpu_count() or 1)
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING', app.config['PASSWORD_HASH_WORKERS'] * 4)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 10)
+
+        self.configured_method = app.config['PASSWORD_HASH_METHOD']
+        self.method = None
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.max_pending = app.config['PASSWORD_HASH_MAX_PENDING']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+
+    def resolve_method(self):
+        """Normalize the configured method to the prefix Werkzeug stores, e.g. "scrypt" -> "scrypt:32768:8:1".
+
+        This costs a full hash, so it runs on first use rather than at import.
+        """
+        if self.method is None:
+            self.method = generate_password_hash('', method=self.configured_method).split('$', 1)[0]
+        return self.method
+
+    def _pool(self):
+        # The pool is created on first use in each process so forked workers never share one.
+        # By then the process is serving requests on several threads, and forking it could hand
+        # the children locks other threads hold, so the hashing processes come from a forkserver
+        # (or are spawned where that is unavailable) instead
+        with self._lock:
+            if self._pid != os.getpid():
+                self._executor = None
+                self._pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.max_pending)
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+            return self._executor
+
+    def _replace_pool(self, broken):
+        """Drop a pool whose worker died, so the next call starts a fresh one"""
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        pool = self._pool()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool:
+            slots.release()
+            self._replace_pool(pool)
+            return fn(*args)
+        except BaseException:
+            slots.release()
+            raise
+        # The slot is held until the hash has really finished, so hashes that timed out
+        # but still run keep counting against max_pending
+        future.add_done_callback(lambda _: slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise HasherBusy()
+        except BrokenProcessPool:
+            # A worker was killed, e.g. out of memory; hash this one here while the pool restarts
+            self._replace_pool(pool)
+            return fn(*args)
+
+    def _timed(self, operation, fn, *args):
+        started = time.perf_counter()
+        try:
+            return self._run(fn, *args)
+        finally:
+            hash_timed.send(self, operation=operation, seconds=time.perf_counter() - started)
+
+    def hash(self, password):
+        """Hash a password with the configured work factor"""
+        return self._timed('hash', _hash, password, self.resolve_method())
+
+    def verify(self, stored_hash, password):
+        """Return (valid, new_hash); new_hash is set when the stored hash should be replaced"""
+        return self._timed('verify', _verify, stored_hash, password, self.resolve_method())
+
+    def shutdown(self, wait=False):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+
+hasher = PasswordHasher()
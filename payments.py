@@ -0,0 +1,340 @@
+import hashlib
+import hmac
+import http.client
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+import click
+from sqlalchemy import func, select, update
+from app import app, db
+from models import Payment, LearningLicense, DrivingLicense, LicenseRenewal
+from cache import cache, learning_license_key, driving_license_key
+from registry import set_application_status
+from slots import release_slot
+from jobs import enqueue
+from utils import add_years
+
+logger = logging.getLogger(__name__)
+
+# Answers worth asking again; anything else in the 4xx range is final
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Fee for each kind of application
+FEES = {'learning': 500, 'driving': 1000, 'renewal': 750}
+
+class PaymentDeclined(Exception):
+    pass
+
+class GatewayUnavailable(Exception):
+    pass
+
+class ConnectionPool:
+    """Keep-alive HTTP connections to the gateway host, shared by the threads of a process.
+
+    A connection is checked out for one request and response and then returned, so
+    consecutive charges skip the TCP and TLS handshakes. Connects and reads each have
+    their own timeout, so a gateway that stops answering ties a worker thread up for
+    at most one read timeout per attempt.
+    """
+
+    def __init__(self, url, size, connect_timeout, read_timeout):
+        parts = urlsplit(url)
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.base_path = parts.path.rstrip('/')
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conn = cls(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        conn.sock.settimeout(self.read_timeout)
+        return conn
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request; returns (status, headers, body bytes)"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        reused = conn is not None
+        while True:
+            if conn is None:
+                conn = self._connect()
+            try:
+                conn.request(method, self.base_path + path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                conn = None
+                if not reused:
+                    raise
+                # The gateway closed an idle keep-alive connection; try once more on a new one
+                reused = False
+            except BaseException:
+                conn.close()
+                raise
+        if response.will_close:
+            conn.close()
+        else:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+        return response.status, response.headers, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+class PaymentGateway:
+    """Client for the card gateway.
+
+    PAYMENT_MODE off records applications as paid without a gateway, as before. In
+    sync mode payment() waits for the charge result; in async mode the gateway only
+    acknowledges the charge and reports the result to /payments/callback later, so
+    no worker waits for the card network. Every charge carries its payment ID as the
+    idempotency key, so retries after timeouts and 5xx answers never charge twice.
+    """
+
+    def __init__(self, app=None):
+        self.mode = 'off'
+        self.url = None
+        self.api_key = None
+        self.webhook_secret = None
+        self.retries = 2
+        self.retry_backoff = 0.2
+        self.pool_size = 10
+        self.connect_timeout = 2.0
+        self.read_timeout = 8.0
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAYMENT_MODE', 'off')
+        app.config.setdefault('PAYMENT_GATEWAY_URL', 'http://127.0.0.1:8099')
+        app.config.setdefault('PAYMENT_GATEWAY_KEY', None)
+        app.config.setdefault('PAYMENT_WEBHOOK_SECRET', None)
+        app.config.setdefault('PAYMENT_CONNECT_TIMEOUT', 2.0)
+        app.config.setdefault('PAYMENT_READ_TIMEOUT', 8.0)
+        app.config.setdefault('PAYMENT_RETRIES', 2)
+        app.config.setdefault('PAYMENT_RETRY_BACKOFF', 0.2)
+        app.config.setdefault('PAYMENT_POOL_SIZE', 10)
+        if app.config['PAYMENT_MODE'] not in ('off', 'sync', 'async'):
+            raise ValueError(f"PAYMENT_MODE must be off, sync or async, not {app.config['PAYMENT_MODE']!r}")
+        self.mode = app.config['PAYMENT_MODE']
+        self.url = app.config['PAYMENT_GATEWAY_URL']
+        self.api_key = app.config['PAYMENT_GATEWAY_KEY']
+        self.webhook_secret = app.config['PAYMENT_WEBHOOK_SECRET']
+        self.connect_timeout = app.config['PAYMENT_CONNECT_TIMEOUT']
+        self.read_timeout = app.config['PAYMENT_READ_TIMEOUT']
+        self.retries = app.config['PAYMENT_RETRIES']
+        self.retry_backoff = app.config['PAYMENT_RETRY_BACKOFF']
+        self.pool_size = app.config['PAYMENT_POOL_SIZE']
+        if self.mode == 'async' and not self.webhook_secret:
+            raise ValueError('PAYMENT_WEBHOOK_SECRET is required in async payment mode')
+
+    @property
+    def enabled(self):
+        return self.mode != 'off'
+
+    @property
+    def pool(self):
+        # Connections are never shared with a forked child
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ConnectionPool(self.url, self.pool_size, self.connect_timeout, self.read_timeout)
+                self._pid = os.getpid()
+            return self._pool
+
+    def _send(self, method, path, payload=None, idempotency_key=None):
+        body = json.dumps(payload).encode() if payload is not None else None
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+        if self.api_key:
+            headers['Authorization'] = f'Bearer {self.api_key}'
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.0))
+            try:
+                status, response_headers, data = self.pool.request(method, path, body, headers)
+            except (OSError, http.client.HTTPException) as e:
+                # Includes connect and read timeouts; the charge may have gone through, which the
+                # idempotency key makes safe to ask again
+                error = f'{type(e).__name__}: {e}'
+                continue
+            if status in RETRY_STATUSES:
+                error = f'gateway answered {status}'
+                continue
+            return status, json.loads(data) if data else {}
+        raise GatewayUnavailable(error)
+
+    def charge(self, payment_id, amount, card, description, callback_url=None):
+        """Charge a card; returns the gateway's charge, whose status is succeeded or, with a
+        callback_url, pending. Raises PaymentDeclined or GatewayUnavailable."""
+        status, charge = self._send('POST', '/charges', {
+            'amount': amount,
+            'currency': 'INR',
+            'description': description,
+            'card': card,
+            'callback_url': callback_url,
+        }, idempotency_key=payment_id)
+        if status == 402:
+            raise PaymentDeclined(charge.get('reason') or 'declined')
+        if status not in (200, 201, 202):
+            raise GatewayUnavailable(f'gateway answered {status}')
+        return charge
+
+    def retrieve(self, payment_id):
+        """The gateway's charge for a payment ID, or None if it never received it"""
+        status, charge = self._send('GET', f'/charges/{payment_id}')
+        if status == 404:
+            return None
+        if status != 200:
+            raise GatewayUnavailable(f'gateway answered {status}')
+        return charge
+
+    def sign(self, body):
+        return hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+
+    def verify(self, body, signature):
+        return bool(self.webhook_secret and signature) and hmac.compare_digest(self.sign(body), signature)
+
+gateway = PaymentGateway()
+
+def start_payment(kind, application_id, user_id, amount, **details):
+    """Add a pending payment for an application to the session; the caller commits"""
+    payment = Payment(payment_id=uuid.uuid4().hex, application_id=application_id, kind=kind,
+                      user_id=user_id, amount=amount, details=json.dumps(details))
+    db.session.add(payment)
+    return payment
+
+def renew(driving_license, reason, user_id):
+    """Extend a driving license by ten years and record the renewal; the caller commits"""
+    current_expiry = driving_license.expiry_date
+    driving_license.expiry_date = add_years(current_expiry, 10)
+    driving_license.status = 'Renewed'
+    db.session.add(LicenseRenewal(
+        user_id=user_id,
+        license_number=driving_license.license_number,
+        renewal_date=datetime.now(),
+        renewal_reason=reason,
+        old_expiry_date=current_expiry,
+        new_expiry_date=driving_license.expiry_date
+    ))
+    cache.invalidate_after_commit(db.session, driving_license_key(driving_license.license_number))
+    set_application_status(driving_license.application_id, 'Renewed')
+
+def _finish_learning(payment, paid):
+    learning_license = LearningLicense.query.filter_by(application_id=payment.application_id).one()
+    learning_license.status = 'Processing' if paid else 'Payment Failed'
+    set_application_status(payment.application_id, learning_license.status)
+    cache.invalidate_after_commit(db.session, learning_license_key(payment.application_id))
+    return 'Learning License', learning_license.email
+
+def _finish_driving(payment, paid):
+    driving_license = DrivingLicense.query.filter_by(application_id=payment.application_id).one()
+    driving_license.status = 'Scheduled' if paid else 'Payment Failed'
+    if not paid:
+        release_slot(driving_license.test_date, driving_license.test_time)
+    set_application_status(payment.application_id, driving_license.status)
+    cache.invalidate_after_commit(db.session, driving_license_key(driving_license.license_number))
+    return 'Driving License', driving_license.email
+
+def _finish_renewal(payment, paid):
+    details = json.loads(payment.details)
+    driving_license = DrivingLicense.query.filter_by(license_number=details['license_number']).one()
+    if paid:
+        renew(driving_license, details['renewal_reason'], payment.user_id)
+    set_application_status(payment.application_id, 'Completed' if paid else 'Payment Failed')
+    return 'License Renewal', driving_license.email
+
+FINISHERS = {'learning': _finish_learning, 'driving': _finish_driving, 'renewal': _finish_renewal}
+
+def finish_payment(payment_id, paid, reference=None, error=None):
+    """Record the outcome of a pending payment and complete or fail its application.
+
+    Only the first outcome for a payment counts, so repeated callbacks and a
+    reconciliation racing a callback are harmless. Returns whether this call
+    recorded the outcome.
+    """
+    claimed = db.session.execute(
+        update(Payment)
+        .where(Payment.payment_id == payment_id, Payment.status == 'pending')
+        .values(status='succeeded' if paid else 'failed', gateway_reference=reference,
+                error=(error or '')[:200] or None, finished_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return False
+    payment = db.session.execute(select(Payment).where(Payment.payment_id == payment_id)).scalar_one()
+    license_type, email = FINISHERS[payment.kind](payment, paid)
+    if paid:
+        enqueue('send_confirmation', key=f'send_confirmation:{payment.application_id}',
+                application_id=payment.application_id, license_type=license_type, email=email)
+    db.session.commit()
+    return True
+
+@app.cli.command('payments-reconcile')
+@click.option('--older-than', default=15, show_default=True, help='Minutes a payment may stay pending.')
+def payments_reconcile(older_than):
+    """Settle payments still pending, e.g. after a lost callback, by asking the gateway."""
+    cutoff = datetime.utcnow() - timedelta(minutes=older_than)
+    # Invoiced payments never reach the gateway; they are settled with "flask payments-settle"
+    pending = db.session.execute(
+        select(Payment.payment_id).where(Payment.status == 'pending', Payment.created_at < cutoff,
+                                         func.coalesce(Payment.method, 'card') == 'card')
+        .order_by(Payment.created_at)
+    ).scalars().all()
+    db.session.rollback()
+    settled = 0
+    for payment_id in pending:
+        try:
+            charge = gateway.retrieve(payment_id)
+        except GatewayUnavailable as e:
+            raise click.ClickException(f'Gateway unavailable after {settled} payments: {e}')
+        if charge is None:
+            # The charge never reached the gateway and the card details are gone
+            settled += finish_payment(payment_id, False, error='not received by the gateway')
+        elif charge.get('status') in ('succeeded', 'declined'):
+            settled += finish_payment(payment_id, charge['status'] == 'succeeded', reference=charge.get('id'),
+                                      error=charge.get('reason'))
+    click.echo(f'Settled {settled} of {len(pending)} pending payments')
+
+@app.cli.command('payments-settle')
+@click.argument('payment_ids', nargs=-1, required=True)
+@click.option('--reference', help='Invoice or bank transfer reference.')
+@click.option('--failed', is_flag=True, help='Record the invoice as unpaid and fail the applications.')
+def payments_settle(payment_ids, reference, failed):
+    """Record invoiced batch API payments as paid (or unpaid) once the account has settled."""
+    invoiced = set(db.session.execute(
+        select(Payment.payment_id).where(Payment.payment_id.in_(payment_ids), Payment.method == 'invoice')
+    ).scalars())
+    db.session.rollback()
+    unknown = [payment_id for payment_id in payment_ids if payment_id not in invoiced]
+    if unknown:
+        raise click.ClickException(f"Not invoiced payments: {', '.join(unknown)}")
+    settled = sum(finish_payment(payment_id, not failed, reference=reference,
+                                 error='invoice not paid' if failed else None) for payment_id in payment_ids)
+    click.echo(f'Settled {settled} of {len(payment_ids)} invoiced payments')
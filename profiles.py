@@ -0,0 +1,92 @@
+import click
+from sqlalchemy import case, column, exists, func, inspect, insert, select, table, text, update
+from models import (ApplicantProfile, APPLICANT_COLUMNS, GENDERS, BLOOD_GROUPS, RH_FACTORS, DOCUMENT_TYPES,
+                    LEARNING_STATUSES, DRIVING_STATUSES)
+
+# Coded profile columns, and license columns converted in place: (table, column, values, indexed)
+PROFILE_CODES = {'gender': GENDERS, 'blood_group': BLOOD_GROUPS, 'rh_factor': RH_FACTORS}
+LICENSE_CODES = [
+    ('learning_license', 'document_type', DOCUMENT_TYPES, False),
+    ('learning_license', 'status', LEARNING_STATUSES, True),
+    ('driving_license', 'status', DRIVING_STATUSES, True),
+]
+
+# Details change_details() updated on the driving license only; the newest copy wins
+CHANGEABLE_COLUMNS = ('address', 'city', 'state', 'zip_code', 'phone')
+
+def _legacy(name, *columns):
+    return table(name, *(column(c) for c in columns))
+
+def _code(col, values):
+    return case({value: code for code, value in enumerate(values)}, value=col)
+
+def _check_values(conn):
+    """Refuse to migrate values the coded columns cannot represent"""
+    checks = [('learning_license', name, values) for name, values in PROFILE_CODES.items()]
+    checks += [(table_name, name, values) for table_name, name, values, _ in LICENSE_CODES]
+    problems = []
+    for table_name, name, values in checks:
+        col = _legacy(table_name, name).c[name]
+        unknown = conn.execute(select(col).distinct().where(col.is_not(None), col.not_in(values))).scalars().all()
+        if unknown:
+            problems.append(f'{table_name}.{name}: {sorted(map(str, unknown))}')
+    if problems:
+        raise click.ClickException('Values outside the allowed set, fix them first:\n' + '\n'.join(problems))
+
+def migrate_applicant_profiles(conn):
+    """Move applicant details into applicant_profile and store coded columns as small integers.
+
+    One profile is created per learning license, reusing its id, and the driving
+    licenses issued from it point at the same profile. Returns False when the
+    database is already migrated. Needs SQLite 3.35+ (DROP COLUMN) or PostgreSQL.
+    """
+    if 'profile_id' in {c['name'] for c in inspect(conn).get_columns('learning_license')}:
+        return False
+    _check_values(conn)
+
+    ll = _legacy('learning_license', 'id', 'application_id', *APPLICANT_COLUMNS)
+    dl = _legacy('driving_license', 'id', 'learning_license_id', 'profile_id', *APPLICANT_COLUMNS)
+    profile = ApplicantProfile.__table__
+    profile.create(conn, checkfirst=True)
+
+    # One profile per learning license, with the same id
+    conn.execute(insert(profile).from_select(
+        ['id', *APPLICANT_COLUMNS],
+        select(ll.c.id, *(_code(ll.c[name], PROFILE_CODES[name]) if name in PROFILE_CODES else ll.c[name]
+                          for name in APPLICANT_COLUMNS))
+    ))
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text("SELECT setval(pg_get_serial_sequence('applicant_profile', 'id'), "
+                          "COALESCE(MAX(id), 0) + 1, false) FROM applicant_profile"))
+
+    # Contact details changed through a driving license
+    latest = (select(func.max(dl.c.id)).select_from(dl.join(ll, ll.c.application_id == dl.c.learning_license_id))
+              .where(ll.c.id == profile.c.id).correlate(profile).scalar_subquery())
+    conn.execute(update(profile).where(exists(select(dl.c.id).where(dl.c.id == latest))).values(
+        {name: select(dl.c[name]).where(dl.c.id == latest).scalar_subquery() for name in CHANGEABLE_COLUMNS}
+    ))
+
+    conn.execute(text('ALTER TABLE learning_license ADD COLUMN profile_id INTEGER REFERENCES applicant_profile (id)'))
+    conn.execute(text('ALTER TABLE driving_license ADD COLUMN profile_id INTEGER REFERENCES applicant_profile (id)'))
+    conn.execute(text('UPDATE learning_license SET profile_id = id'))
+    conn.execute(update(dl).values(profile_id=select(ll.c.id).where(
+        ll.c.application_id == dl.c.learning_license_id).scalar_subquery()))
+
+    # Coded columns: add, fill, drop the string column and take over its name
+    for table_name, name, values, indexed in LICENSE_CODES:
+        legacy = _legacy(table_name, name, f'{name}_code')
+        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {name}_code SMALLINT'))
+        conn.execute(update(legacy).values({f'{name}_code': _code(legacy.c[name], values)}))
+        if indexed:
+            conn.execute(text(f'DROP INDEX IF EXISTS ix_{table_name}_{name}'))
+        conn.execute(text(f'ALTER TABLE {table_name} DROP COLUMN {name}'))
+        conn.execute(text(f'ALTER TABLE {table_name} RENAME COLUMN {name}_code TO {name}'))
+        if indexed:
+            conn.execute(text(f'CREATE INDEX ix_{table_name}_{name} ON {table_name} ({name})'))
+
+    for table_name in ('learning_license', 'driving_license'):
+        for name in APPLICANT_COLUMNS:
+            conn.execute(text(f'ALTER TABLE {table_name} DROP COLUMN {name}'))
+        conn.execute(text(f'CREATE INDEX ix_{table_name}_profile_id ON {table_name} (profile_id)'))
+    return True
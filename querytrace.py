@@ -0,0 +1,161 @@
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+_IN_LIST = re.compile(r'\(\s*\?(\s*,\s*\?)+\s*\)')
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PARAM = re.compile(r'%\(\w+\)s|%s|:\w+|\$\d+')
+_SPACE = re.compile(r'\s+')
+
+def normalize(statement):
+    """Reduce a statement to its shape: parameters, literals and IN lists become ?"""
+    statement = _PARAM.sub('?', statement)
+    statement = _LITERAL.sub('?', statement)
+    statement = _IN_LIST.sub('(?)', statement)
+    return _SPACE.sub(' ', statement).strip()
+
+def _caller():
+    """First stack frame in this project outside SQLAlchemy and the tracer, as 'file:line in function'"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_ROOT) and filename != __file__:
+            return f'{os.path.relpath(filename, PROJECT_ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return 'unknown'
+
+class QueryTrace:
+    """Statements executed within one request or capture block, grouped by normalized SQL"""
+
+    def __init__(self, label=None):
+        self.label = label
+        self.groups = OrderedDict()
+        self.count = 0
+        self.duration = 0.0
+
+    def add(self, statement, duration, location):
+        shape = normalize(statement)
+        group = self.groups.get(shape)
+        if group is None:
+            group = self.groups[shape] = {'count': 0, 'duration': 0.0, 'locations': OrderedDict()}
+        group['count'] += 1
+        group['duration'] += duration
+        group['locations'][location] = group['locations'].get(location, 0) + 1
+        self.count += 1
+        self.duration += duration
+
+    def repeated(self, threshold):
+        """SELECT shapes executed at least threshold times: the signature of an N+1 pattern"""
+        return [(shape, group) for shape, group in self.groups.items()
+                if group['count'] >= threshold and shape.upper().startswith('SELECT')]
+
+    def report(self, threshold=None):
+        lines = [f'{self.label or "block"}: {self.count} statements in {self.duration * 1000:.1f}ms']
+        for shape, group in self.groups.items():
+            flag = ' [N+1]' if threshold and group['count'] >= threshold and shape.upper().startswith('SELECT') else ''
+            lines.append(f"  {group['count']}x {group['duration'] * 1000:.1f}ms{flag} {shape[:200]}")
+            for location, count in group['locations'].items():
+                lines.append(f'      {count}x at {location}')
+        return '\n'.join(lines)
+
+class QueryTracer:
+    """Traces SQL per request and logs repeated identical-shape queries as N+1 suspects"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.threshold = 3
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_TRACE', app.debug)
+        app.config.setdefault('QUERY_TRACE_THRESHOLD', 3)
+        self.enabled = app.config['QUERY_TRACE']
+        self.threshold = app.config['QUERY_TRACE_THRESHOLD']
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    @property
+    def active(self):
+        traces = getattr(self._local, 'traces', None)
+        if traces is None:
+            traces = self._local.traces = []
+        return traces
+
+    def _start_request(self):
+        if self.enabled:
+            trace = QueryTrace(f'{request.method} {request.path} ({request.endpoint})')
+            trace.request = True
+            self.active.append(trace)
+
+    def _finish_request(self, response):
+        traces = self.active
+        if traces and getattr(traces[-1], 'request', False):
+            trace = traces.pop()
+            if trace.repeated(self.threshold):
+                logger.warning('Possible N+1 queries\n%s', trace.report(self.threshold))
+            else:
+                logger.debug('%s', trace.report())
+        return response
+
+    def statement_started(self):
+        if self.active:
+            self._local.started = time.perf_counter()
+
+    def statement_finished(self, statement):
+        traces = self.active
+        if traces:
+            duration = time.perf_counter() - self._local.started
+            location = _caller()
+            for trace in traces:
+                trace.add(statement, duration, location)
+
+    @contextmanager
+    def capture(self, label=None):
+        """Collect every statement executed in this thread inside the block"""
+        trace = QueryTrace(label)
+        self.active.append(trace)
+        try:
+            yield trace
+        finally:
+            self.active.remove(trace)
+
+tracer = QueryTracer()
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    tracer.statement_started()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    tracer.statement_finished(statement)
+
+@contextmanager
+def assert_max_queries(limit, n_plus_one_threshold=None, label=None):
+    """Fail when the block runs more than limit statements or repeats a SELECT shape.
+
+        with assert_max_queries(4):
+            client.get('/application-status')
+
+    benchmarks/check_query_budgets.py runs every route under one with its budget.
+    """
+    threshold = n_plus_one_threshold or tracer.threshold
+    with tracer.capture(label) as trace:
+        yield trace
+    if trace.count > limit:
+        raise AssertionError(f'Expected at most {limit} queries, got {trace.count}\n{trace.report(threshold)}')
+    if trace.repeated(threshold):
+        raise AssertionError(f'N+1 query pattern detected\n{trace.report(threshold)}')
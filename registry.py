@@ -0,0 +1,96 @@
+from datetime import datetime
+import click
+from sqlalchemy import exists, insert, null, select
+from app import app, db
+from models import Application, LearningLicense, DrivingLicense
+from cache import cache, cached_application, application_key
+
+# Display name and processing estimate per application kind
+APPLICATION_KINDS = {
+    'learning': ('Learning License', '7-10 business days'),
+    'driving': ('Driving License', '14-21 business days'),
+    'renewal': ('License Renewal', '5-7 business days'),
+    'change': ('Change of Details', '3-5 business days'),
+}
+
+def register_application(application_id, kind, user_id, status, license_number=None, apply_date=None):
+    """Add an application to the registry; the caller commits with the application itself"""
+    if kind not in APPLICATION_KINDS:
+        raise ValueError(f'Unknown application kind: {kind}')
+    entry = Application(
+        application_id=application_id,
+        kind=kind,
+        user_id=user_id,
+        license_number=license_number,
+        status=status,
+        apply_date=apply_date or datetime.now()
+    )
+    db.session.add(entry)
+    cache.invalidate_after_commit(db.session, application_key(application_id))
+    return entry
+
+def set_application_status(application_id, status):
+    """Mirror a status change into the registry"""
+    Application.query.filter_by(application_id=application_id).update(
+        {'status': status}, synchronize_session=False
+    )
+    cache.invalidate_after_commit(db.session, application_key(application_id))
+
+def lookup_application(application_id, user_id):
+    """Return the status page details for an application with a single point lookup"""
+    entry = cached_application(application_id, user_id)
+    if not entry:
+        return None
+    label, estimate = APPLICATION_KINDS[entry.kind]
+    return {
+        'type': label,
+        'id': entry.application_id,
+        'status': entry.status,
+        'apply_date': entry.apply_date,
+        'estimate': estimate,
+        'license_number': entry.license_number
+    }
+
+def backfill_registry(conn, chunk_size=1000, commit=True):
+    """Register learning and driving licenses missing from the registry; returns how many were added.
+
+    Licenses are read in id order, chunk_size at a time, with an anti-join against the registry
+    and inserted with one executemany per chunk. With commit every chunk commits on its own, so
+    the write lock is never held for the whole backfill and an interrupted run picks up where it
+    stopped.
+    """
+    registry = Application.__table__
+    added = 0
+    for kind, table in (('learning', LearningLicense.__table__), ('driving', DrivingLicense.__table__)):
+        license_number = table.c.license_number if 'license_number' in table.c else null()
+        last_id = 0
+        while True:
+            rows = conn.execute(
+                select(table.c.id, table.c.application_id, table.c.user_id, license_number.label('license_number'),
+                       table.c.status, table.c.apply_date)
+                .where(table.c.id > last_id, ~exists().where(registry.c.application_id == table.c.application_id))
+                .order_by(table.c.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            conn.execute(insert(registry), [{
+                'application_id': row.application_id,
+                'kind': kind,
+                'user_id': row.user_id,
+                'license_number': row.license_number,
+                'status': row.status,
+                'apply_date': row.apply_date
+            } for row in rows])
+            if commit:
+                conn.commit()
+            last_id = rows[-1].id
+            added += len(rows)
+    return added
+
+@app.cli.command('registry-backfill')
+@click.option('--chunk-size', default=1000, show_default=True, help='Applications registered per transaction.')
+def registry_backfill(chunk_size):
+    """Register learning and driving license applications created before the registry existed."""
+    with db.engine.connect() as conn:
+        added = backfill_registry(conn, chunk_size)
+    click.echo(f'Registered {added} applications')
@@ -0,0 +1,120 @@
+import gzip
+import hashlib
+import os
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_TYPES = {'text/html', 'text/plain', 'text/css', 'text/javascript', 'application/javascript',
+                      'application/json', 'image/svg+xml'}
+
+class ResponseOptimizer:
+    """Smaller and fewer response bodies.
+
+    Pages get a strong ETag of their uncompressed body, tagged with the content
+    coding, and a matching If-None-Match is answered with 304 before anything is
+    compressed. Bodies over the size threshold are compressed with brotli or gzip,
+    whichever the client prefers. Static URLs carry a content fingerprint so the
+    files can be cached for a year.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.compress = False
+        self.etags = False
+        self.min_size = 0
+        self.level = 6
+        self.quality = 5
+        self.static_max_age = 0
+        self._fingerprints = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 5)
+        app.config.setdefault('RESPONSE_ETAGS', True)
+        app.config.setdefault('STATIC_MAX_AGE', 365 * 24 * 60 * 60)
+        self.app = app
+        self.compress = app.config['COMPRESS_ENABLED']
+        self.etags = app.config['RESPONSE_ETAGS']
+        self.min_size = app.config['COMPRESS_MIN_SIZE']
+        self.level = app.config['COMPRESS_LEVEL']
+        self.quality = app.config['COMPRESS_BROTLI_QUALITY']
+        self.static_max_age = app.config['STATIC_MAX_AGE']
+        app.url_defaults(self._fingerprint_static)
+        app.after_request(self._finish)
+
+    def _fingerprint(self, filename):
+        path = os.path.join(self.app.static_folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._fingerprints.get(filename)
+        if cached is None or cached[0] != mtime:
+            with open(path, 'rb') as f:
+                cached = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+            self._fingerprints[filename] = cached
+        return cached[1]
+
+    def _fingerprint_static(self, endpoint, values):
+        # url_for('static', filename=...) gains ?v=<content hash>, so a changed file gets a new URL
+        if endpoint == 'static' and 'filename' in values and 'v' not in values and self.app.static_folder:
+            fingerprint = self._fingerprint(values['filename'])
+            if fingerprint:
+                values['v'] = fingerprint
+
+    def _encoding(self, response):
+        if (not self.compress or response.direct_passthrough or response.is_streamed
+                or response.mimetype not in COMPRESSIBLE_TYPES or 'Content-Encoding' in response.headers):
+            return None
+        if response.calculate_content_length() < self.min_size:
+            return None
+        response.vary.add('Accept-Encoding')
+        return request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+
+    def _finish(self, response):
+        if request.endpoint == 'static':
+            if request.args.get('v') and request.args['v'] == self._fingerprint(request.view_args['filename']):
+                response.cache_control.public = True
+                response.cache_control.max_age = self.static_max_age
+                response.cache_control.immutable = True
+            return response
+
+        encoding = self._encoding(response)
+        if (self.etags and request.method in ('GET', 'HEAD') and response.status_code == 200
+                and not response.direct_passthrough and not response.is_streamed
+                and not response.cache_control.no_store):
+            digest = hashlib.sha1(response.get_data()).hexdigest()
+            response.set_etag(f'{digest}-{encoding}' if encoding else digest)
+            if not response.cache_control.max_age:
+                # Pages are per user; browsers may keep them but must revalidate on every use
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+
+        if encoding == 'br':
+            response.set_data(brotli.compress(response.get_data(), quality=self.quality))
+        elif encoding == 'gzip':
+            response.set_data(gzip.compress(response.get_data(), compresslevel=self.level, mtime=0))
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    def warm_templates(self):
+        """Compile every template ahead of the first request that renders it; returns how many"""
+        env = self.app.jinja_env
+        names = env.list_templates()
+        for name in names:
+            env.get_template(name)
+        return len(names)
+
+response_optimizer = ResponseOptimizer()
@@ -0,0 +1,230 @@
+import re
+import time
+import click
+from sqlalchemy import and_, bindparam, event, func, or_, select, text
+from app import app, db
+from models import ApplicantProfile, LearningLicense, DrivingLicense
+
+# Applicant details officers search by; licenses are found through their applicant
+SEARCH_COLUMNS = ('name', 'phone', 'city')
+
+# Application IDs and license numbers are matched as prefixes on their unique indexes; both have
+# digits right after the letters, so names such as Apparao or Dlamini still go to the text search
+NUMBER_QUERY = re.compile(r'(APP|DL)[0-9][0-9A-Z]*')
+
+class SearchError(ValueError):
+    pass
+
+def create_search_index(conn):
+    """Create the search structures for the connection's database, if missing.
+
+    SQLite gets an FTS5 table of trigrams over the applicant details, keyed by
+    profile ID and ranked with bm25 weighted towards name and phone. PostgreSQL
+    gets pg_trgm GIN indexes on the same columns, which it keeps current itself.
+    """
+    if conn.dialect.name == 'sqlite':
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'applicant_search'")).first()
+        if not exists:
+            conn.execute(text(f"CREATE VIRTUAL TABLE applicant_search USING fts5("
+                              f"{', '.join(SEARCH_COLUMNS)}, tokenize='trigram')"))
+            conn.execute(text("INSERT INTO applicant_search(applicant_search, rank) VALUES ('rank', 'bm25(5.0, 5.0, 1.0)')"))
+    elif conn.dialect.name == 'postgresql':
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        for column in SEARCH_COLUMNS:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_applicant_profile_{column}_trgm '
+                              f'ON applicant_profile USING gin ({column} gin_trgm_ops)'))
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_index(target, connection, **kw):
+    create_search_index(connection)
+
+def _parse(query, min_length):
+    """Split a query into (column or None, term) pairs; 'city:pune' limits a term to one column"""
+    terms = []
+    for word in query.split():
+        column, _, term = word.partition(':') if ':' in word else (None, None, word)
+        if column is not None and column not in SEARCH_COLUMNS:
+            raise SearchError(f"Unknown field {column!r}; use {', '.join(SEARCH_COLUMNS)}")
+        if len(term) < min_length:
+            raise SearchError(f'Search terms need at least {min_length} characters')
+        terms.append((column, term))
+    if not terms:
+        raise SearchError('Enter a name, phone number, city or license number')
+    return terms
+
+class SearchIndex:
+    """Officer search over applicants and their licenses.
+
+    Partial names, phone numbers and cities match anywhere in the value through
+    trigrams, so no query scans the profile table; results are paginated by
+    applicant. Ranking has to score every match, so only match sets up to
+    rank_limit are ranked and broader ones are listed newest applicant first,
+    which FTS5 streams in rowid order. Queries that look like an application ID or license number are
+    prefix matches on the unique indexes instead. On SQLite the write paths update
+    the FTS table with update() or index_profiles(), in the transaction of the change.
+    """
+
+    def __init__(self, app=None):
+        self.page_size = 20
+        self.max_page = 50
+        self.rank_limit = 1000
+        self.min_length = 3
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SEARCH_PAGE_SIZE', 20)
+        app.config.setdefault('SEARCH_MAX_PAGE', 50)
+        app.config.setdefault('SEARCH_RANK_LIMIT', 1000)
+        self.page_size = app.config['SEARCH_PAGE_SIZE']
+        self.max_page = app.config['SEARCH_MAX_PAGE']
+        self.rank_limit = app.config['SEARCH_RANK_LIMIT']
+
+    @property
+    def uses_fts(self):
+        return db.engine.dialect.name == 'sqlite'
+
+    def index_profiles(self, profile_ids):
+        """Write the current details of these profiles to the index; the caller commits"""
+        if not self.uses_fts or not profile_ids:
+            return
+        stmt = text(f"INSERT OR REPLACE INTO applicant_search(rowid, {', '.join(SEARCH_COLUMNS)}) "
+                    f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM applicant_profile WHERE id IN :ids")
+        profile_ids = list(profile_ids)
+        for start in range(0, len(profile_ids), 500):
+            db.session.execute(stmt.bindparams(bindparam('ids', expanding=True)),
+                               {'ids': profile_ids[start:start + 500]})
+
+    def update(self, *profiles):
+        """Index new or changed profiles, flushing them first"""
+        if self.uses_fts:
+            db.session.flush()
+            self.index_profiles([profile.id for profile in profiles])
+
+    def _matching_profiles(self, terms, limit, offset):
+        if self.uses_fts:
+            phrases = ['"' + term.replace('"', '""') + '"' for _, term in terms]
+            match = ' '.join(f'{column} : {phrase}' if column else phrase
+                             for (column, _), phrase in zip(terms, phrases))
+            newest = text('SELECT rowid FROM applicant_search WHERE applicant_search MATCH :match '
+                          'ORDER BY rowid DESC LIMIT :limit OFFSET :offset')
+            broad = len(db.session.execute(newest, {'match': match, 'limit': self.rank_limit + 1, 'offset': 0}).all())
+            order = 'rowid DESC' if broad > self.rank_limit else 'rank'
+            return db.session.execute(
+                text(f'SELECT rowid FROM applicant_search WHERE applicant_search MATCH :match '
+                     f'ORDER BY {order} LIMIT :limit OFFSET :offset'),
+                {'match': match, 'limit': limit, 'offset': offset}
+            ).scalars().all()
+
+        conditions = []
+        for column, term in terms:
+            pattern = '%' + re.sub(r'([\\%_])', r'\\\1', term) + '%'
+            columns = [getattr(ApplicantProfile, column)] if column else \
+                [getattr(ApplicantProfile, name) for name in SEARCH_COLUMNS]
+            conditions.append(or_(*(col.ilike(pattern, escape='\\') for col in columns)))
+        words = ' '.join(term for _, term in terms)
+        score = func.greatest(*(func.similarity(getattr(ApplicantProfile, name), words) for name in SEARCH_COLUMNS))
+        return db.session.execute(
+            select(ApplicantProfile.id).where(and_(*conditions))
+            .order_by(score.desc(), ApplicantProfile.id).limit(limit).offset(offset)
+        ).scalars().all()
+
+    def _numbered_profiles(self, prefix, limit, offset):
+        # IDs only hold 0-9 and A-Z, so every ID starting with prefix sorts between these bounds,
+        # and each column is read in index order up to the end of the requested page
+        high = prefix + 'Z' * (20 - len(prefix))
+        matches = []
+        for column, profile_id in ((LearningLicense.application_id, LearningLicense.profile_id),
+                                   (DrivingLicense.application_id, DrivingLicense.profile_id),
+                                   (DrivingLicense.license_number, DrivingLicense.profile_id)):
+            matches.extend(db.session.execute(
+                select(column, profile_id).where(column.between(prefix, high)).order_by(column).limit(limit + offset)
+            ).all())
+        profile_ids = []
+        for _, profile_id in sorted(matches):
+            if profile_id not in profile_ids:
+                profile_ids.append(profile_id)
+        return profile_ids[offset:offset + limit]
+
+    def _applicants(self, profile_ids):
+        """Applicant details and licenses for a page of profile IDs, in that order, with three queries"""
+        if not profile_ids:
+            return []
+        applicants = {profile.id: {
+            'name': profile.name, 'dob': profile.dob.isoformat(), 'phone': profile.phone, 'city': profile.city,
+            'state': profile.state, 'learning_licenses': [], 'driving_licenses': []
+        } for profile in db.session.execute(
+            select(ApplicantProfile).where(ApplicantProfile.id.in_(profile_ids))).scalars()}
+        for row in db.session.execute(
+                select(LearningLicense.profile_id, LearningLicense.application_id, LearningLicense.status,
+                       LearningLicense.apply_date)
+                .where(LearningLicense.profile_id.in_(profile_ids)).order_by(LearningLicense.id)):
+            applicants[row.profile_id]['learning_licenses'].append({
+                'application_id': row.application_id, 'status': row.status,
+                'apply_date': row.apply_date.isoformat() if row.apply_date else None})
+        for row in db.session.execute(
+                select(DrivingLicense.profile_id, DrivingLicense.application_id, DrivingLicense.license_number,
+                       DrivingLicense.status, DrivingLicense.test_date, DrivingLicense.expiry_date)
+                .where(DrivingLicense.profile_id.in_(profile_ids)).order_by(DrivingLicense.id)):
+            applicants[row.profile_id]['driving_licenses'].append({
+                'application_id': row.application_id, 'license_number': row.license_number,
+                'status': row.status, 'test_date': row.test_date.isoformat(),
+                'expiry_date': row.expiry_date.isoformat()})
+        return [applicants[profile_id] for profile_id in profile_ids if profile_id in applicants]
+
+    def search(self, query, page=1):
+        """One page of applicants matching query, best match first"""
+        query = query.strip()
+        if not 1 <= page <= self.max_page:
+            raise SearchError(f'Page must be between 1 and {self.max_page}; refine the search instead')
+        limit, offset = self.page_size + 1, (page - 1) * self.page_size
+        if NUMBER_QUERY.fullmatch(query.upper()):
+            profile_ids = self._numbered_profiles(query.upper(), limit, offset)
+        else:
+            profile_ids = self._matching_profiles(_parse(query, self.min_length), limit, offset)
+        return {
+            'query': query,
+            'page': page,
+            'results': self._applicants(profile_ids[:self.page_size]),
+            'next_page': page + 1 if len(profile_ids) > self.page_size and page < self.max_page else None
+        }
+
+    def rebuild(self, chunk_size=100000, progress=None):
+        """Index every profile again, one committed chunk of IDs at a time; returns the row count.
+
+        Searches miss profiles whose chunk has not been written yet while this runs;
+        concurrent updates are safe, as both sides replace whole rows.
+        """
+        if not self.uses_fts:
+            for column in SEARCH_COLUMNS:
+                db.session.execute(text(f'REINDEX INDEX ix_applicant_profile_{column}_trgm'))
+            db.session.commit()
+            return 0
+        with db.engine.begin() as conn:
+            conn.execute(text('DROP TABLE IF EXISTS applicant_search'))
+            create_search_index(conn)
+        last_id = db.session.execute(select(func.max(ApplicantProfile.id))).scalar() or 0
+        stmt = text(f"INSERT OR REPLACE INTO applicant_search(rowid, {', '.join(SEARCH_COLUMNS)}) "
+                    f"SELECT id, {', '.join(SEARCH_COLUMNS)} FROM applicant_profile WHERE id > :low AND id <= :high")
+        indexed = 0
+        for low in range(0, last_id, chunk_size):
+            indexed += db.session.execute(stmt, {'low': low, 'high': low + chunk_size}).rowcount
+            db.session.commit()
+            if progress:
+                progress(indexed)
+        db.session.execute(text("INSERT INTO applicant_search(applicant_search) VALUES ('optimize')"))
+        db.session.commit()
+        return indexed
+
+search_index = SearchIndex()
+
+@app.cli.command('search-rebuild')
+@click.option('--chunk-size', default=100000, show_default=True, help='Profiles per committed chunk.')
+def search_rebuild(chunk_size):
+    """Rebuild the officer search index from the applicant profiles."""
+    start = time.perf_counter()
+    indexed = search_index.rebuild(chunk_size, progress=lambda n: click.echo(f'Indexed {n} profiles'))
+    if not search_index.uses_fts:
+        click.echo('Reindexed the trigram indexes')
+    else:
+        click.echo(f'Indexed {indexed} profiles in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,242 @@
+import logging
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# Listening socket handed to the re-executed master on reload
+LISTEN_FD_ENV = 'WEB_LISTEN_FD'
+
+class RequestHandler(WSGIRequestHandler):
+    # One request per connection, so an idle keep-alive client never holds a worker thread
+    protocol_version = 'HTTP/1.0'
+
+    # Seconds a slow client may take to send its request
+    timeout = 30
+
+class PooledWSGIServer(BaseWSGIServer):
+    """Serves requests on a fixed pool of threads; while all are busy it stops accepting,
+    leaving new connections in the shared backlog for another worker"""
+
+    multithread = True
+    multiprocess = True
+
+    def __init__(self, host, port, app, fd, threads, max_requests=0):
+        self.max_requests = max_requests
+        self.handled = 0
+        self._slots = threading.BoundedSemaphore(threads)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='request')
+        self._stopping = threading.Event()
+        super().__init__(host, port, app, handler=RequestHandler, fd=fd)
+        # Every worker waits on the same socket; the ones that lose the race must not block in accept()
+        self.socket.setblocking(False)
+
+    def get_request(self):
+        self._slots.acquire()
+        try:
+            return super().get_request()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def process_request(self, request, client_address):
+        self.handled += 1
+        if self.max_requests and self.handled >= self.max_requests:
+            self.stop()
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def stop(self):
+        """Stop accepting; serve() returns once in-flight requests finish"""
+        if not self._stopping.is_set():
+            self._stopping.set()
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def serve(self):
+        self.serve_forever(poll_interval=0.5)
+        self._pool.shutdown(wait=True)
+
+class PreforkServer:
+    """Pre-forks worker processes that share one listening socket.
+
+    The application is imported once in the master and inherited by every
+    worker. SIGHUP drains the workers and re-executes the master on the same
+    socket to load new code, SIGTERM and SIGINT drain in-flight requests and
+    exit, and workers that die are replaced.
+    """
+
+    def __init__(self, host='0.0.0.0', port=5000, workers=2, threads=8, graceful_timeout=30, max_requests=0,
+                 backlog=2048):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout = graceful_timeout
+        self.max_requests = max_requests
+        self.backlog = backlog
+        self.socket = None
+        self.app = None
+        self.children = {}
+        self._signals = []
+
+    def _listen(self):
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        if fd is not None:
+            sock = socket.socket(fileno=int(fd))
+        else:
+            sock = socket.create_server((self.host, self.port), backlog=self.backlog)
+        sock.set_inheritable(True)
+        return sock
+
+    def _load(self, fresh):
+        from sqlalchemy.orm import configure_mappers
+        from app import app, db
+        from metrics import metrics
+        from passwords import hasher
+        from responses import response_optimizer
+
+        # Totals of a previous run would be added to this one's; a reload keeps them
+        if fresh:
+            metrics.clear()
+
+        # Setup the app leaves for first use runs once here, so every worker inherits it
+        configure_mappers()
+        hasher.resolve_method()
+        response_optimizer.warm_templates()
+
+        # Connections opened while importing must not be shared with the forked workers
+        with app.app_context():
+            db.engine.dispose()
+        return app
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return
+        code = 0
+        try:
+            self._serve()
+        except BaseException:
+            logger.exception('Worker failed')
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _serve(self):
+        from app import db
+        from metrics import metrics
+        from passwords import hasher
+
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGQUIT, signal.SIG_DFL)
+        # Forget the master's pooled connections without closing them underneath it
+        with self.app.app_context():
+            db.engine.dispose(close=False)
+        server = PooledWSGIServer(self.host, self.port, self.app, fd=self.socket.fileno(),
+                                  threads=self.threads, max_requests=self.max_requests)
+        signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+        logger.info('Worker %s serving with %s threads', os.getpid(), self.threads)
+        server.serve()
+        # The worker leaves through os._exit, which skips the pool's own exit handler
+        hasher.shutdown(wait=True)
+        if metrics.directory:
+            metrics.flush()
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if not pid:
+                return
+            started = self.children.pop(pid, None)
+            if started is not None and not self._signals:
+                logger.warning('Worker %s exited with status %s', pid, os.waitstatus_to_exitcode(status))
+                # Back off when workers die straight after starting, e.g. on a broken deploy
+                if time.monotonic() - started < 1:
+                    time.sleep(1)
+
+    def _stop_workers(self, sig=signal.SIGTERM):
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            logger.warning('Worker %s did not stop in %ss, killing it', pid, self.graceful_timeout)
+            os.kill(pid, signal.SIGKILL)
+        while self.children:
+            self._reap()
+            time.sleep(0.05)
+
+    def _reload(self):
+        logger.info('Reloading')
+        self._stop_workers()
+        os.environ[LISTEN_FD_ENV] = str(self.socket.fileno())
+        os.execv(sys.executable, [sys.executable] + sys.argv)
+
+    def run(self):
+        fresh = LISTEN_FD_ENV not in os.environ
+        self.socket = self._listen()
+        self.app = self._load(fresh)
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        logger.info('Listening on %s:%s with %s workers', *self.socket.getsockname()[:2], self.workers)
+
+        while not self._signals:
+            self._reap()
+            while len(self.children) < self.workers and not self._signals:
+                self._spawn()
+            time.sleep(0.2)
+
+        if self._signals[0] == signal.SIGHUP:
+            self._reload()
+        logger.info('Shutting down')
+        self._stop_workers()
+        self.socket.close()
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='[%(process)d] %(levelname)s %(message)s')
+    workers = int(os.environ.get('WEB_CONCURRENCY', str(os.cpu_count() or 1)))
+
+    port = int(os.environ.get('PORT', '5000'))
+
+    # Split the password hashing pool between workers and add up metrics across workers
+    os.environ.setdefault('PASSWORD_HASH_WORKERS', str(max(1, (os.cpu_count() or 1) // workers)))
+    if workers > 1:
+        os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'dlservice-metrics-{port}'))
+
+    PreforkServer(
+        host=os.environ.get('HOST', '0.0.0.0'),
+        port=port,
+        workers=workers,
+        threads=int(os.environ.get('WEB_THREADS', '8')),
+        graceful_timeout=float(os.environ.get('WEB_GRACEFUL_TIMEOUT', '30')),
+        max_requests=int(os.environ.get('WEB_MAX_REQUESTS', '0'))
+    ).run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+import hashlib
+import os
+import secrets
+import time
+from datetime import datetime, timedelta
+import click
+from flask import session as current_session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SecureCookieSession, SessionInterface
+from itsdangerous import BadSignature, Signer
+from sqlalchemy import delete, insert, select, update
+from app import app, db
+from models import SessionRecord
+from cache import MemoryBackend, SQLiteBackend
+
+class ServerSideSession(SecureCookieSession):
+    """Session whose data lives on the server; the cookie only carries the signed session ID"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.replaces = None
+
+    def regenerate(self):
+        """Move the data to a new session ID when saved and delete the old record"""
+        if self.sid is not None:
+            self.replaces = self.sid
+        self.sid = None
+        self.modified = True
+
+def _pack(data, expires_at):
+    """A session record as the file and cache stores keep it: the expiry time on the first line, then the data"""
+    return expires_at.isoformat().encode() + b'\n' + data
+
+def _unpack(record):
+    """Return (data, expires_at) from a packed record; raises ValueError when it is not one"""
+    expires_at, data = record.split(b'\n', 1)
+    return data, datetime.fromisoformat(expires_at.decode())
+
+class RecordSerializer:
+    """Keeps packed session records in a cache backend as they are, without pickling"""
+
+    def dumps(self, value):
+        return value
+
+    def loads(self, data):
+        return bytes(data)
+
+class DatabaseSessionStore:
+    """Sessions in a table of the application database"""
+
+    def load(self, sid):
+        with db.engine.connect() as conn:
+            row = conn.execute(select(SessionRecord.data, SessionRecord.expires_at)
+                               .where(SessionRecord.id == sid)).first()
+        return (row.data, row.expires_at) if row else None
+
+    def save(self, sid, data, expires_at):
+        with db.engine.begin() as conn:
+            updated = conn.execute(update(SessionRecord).where(SessionRecord.id == sid)
+                                   .values(data=data, expires_at=expires_at)).rowcount
+            if not updated:
+                conn.execute(insert(SessionRecord).values(id=sid, data=data, expires_at=expires_at))
+
+    def delete(self, sid):
+        with db.engine.begin() as conn:
+            conn.execute(delete(SessionRecord).where(SessionRecord.id == sid))
+
+    def sweep(self, now):
+        with db.engine.begin() as conn:
+            return conn.execute(delete(SessionRecord).where(SessionRecord.expires_at < now)).rowcount
+
+class FileSessionStore:
+    """One file per session in hash-prefix directories"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, sid):
+        digest = hashlib.sha256(sid.encode()).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def load(self, sid):
+        try:
+            with open(self._path(sid), 'rb') as f:
+                return _unpack(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save(self, sid, data, expires_at):
+        path = self._path(sid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_pack(data, expires_at))
+        os.replace(tmp, path)
+
+    def delete(self, sid):
+        try:
+            os.unlink(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, now):
+        removed = 0
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    with open(path, 'rb') as f:
+                        expires_at = datetime.fromisoformat(f.readline().decode())
+                except OSError:
+                    continue
+                except ValueError:
+                    # Written in an older format, which no longer loads
+                    expires_at = datetime.min
+                if expires_at < now:
+                    os.unlink(path)
+                    removed += 1
+        return removed
+
+class CacheSessionStore:
+    """Sessions in a cache backend, standing in for a shared cache such as Redis or memcached"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def load(self, sid):
+        record = self.backend.get(f'session:{sid}')
+        try:
+            return _unpack(record) if record is not None else None
+        except ValueError:
+            return None
+
+    def save(self, sid, data, expires_at):
+        ttl = max((expires_at - datetime.utcnow()).total_seconds(), 1)
+        self.backend.set(f'session:{sid}', _pack(data, expires_at), ttl)
+
+    def delete(self, sid):
+        self.backend.delete(f'session:{sid}')
+
+    def sweep(self, now):
+        # Entries expire through the backend's own TTL
+        return 0
+
+STORES = {
+    'database': lambda config: DatabaseSessionStore(),
+    'file': lambda config: FileSessionStore(config['SESSION_FILE_DIR']),
+    'cache': lambda config: CacheSessionStore(SQLiteBackend(config['SESSION_CACHE_PATH'], config['SESSION_CACHE_MAX_ENTRIES'],
+                                                            serializer=RecordSerializer())),
+    'memory': lambda config: CacheSessionStore(MemoryBackend(config['SESSION_CACHE_MAX_ENTRIES'])),
+}
+
+class ServerSideSessionInterface(SessionInterface):
+    """Keeps session data in a server-side store behind an opaque, signed session ID cookie"""
+
+    # The same tagged JSON as Flask's cookie sessions, so a writable store does not mean code execution
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='server-side-session')
+
+    def _ttl(self, app, session):
+        if session.permanent:
+            return app.permanent_session_lifetime
+        return timedelta(seconds=app.config['SERVER_SESSION_TTL'])
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            record = self.store.load(sid) if sid else None
+            if record:
+                data, expires_at = record
+                if expires_at > datetime.utcnow():
+                    try:
+                        initial = self.serializer.loads(data)
+                    except (ValueError, TypeError):
+                        # Unreadable data, such as a session saved in an older format, starts over
+                        initial = None
+                    if isinstance(initial, dict):
+                        return ServerSideSession(initial, sid=sid, expires_at=expires_at)
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        # A regenerated session leaves nothing behind under its old ID
+        if session.replaces:
+            self.store.delete(session.replaces)
+
+        # An emptied session (e.g. after logout) is removed together with its cookie
+        if not session:
+            if session.sid:
+                self.store.delete(session.sid)
+            if session.sid or session.replaces:
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       httponly=self.get_cookie_httponly(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+
+        # Unchanged sessions are only written again once half their lifetime has passed
+        now = datetime.utcnow()
+        ttl = self._ttl(app, session)
+        refresh = session.expires_at is None or session.expires_at - now < ttl / 2
+        if not session.modified and not refresh:
+            return
+
+        is_new = session.sid is None
+        if is_new:
+            session.sid = secrets.token_urlsafe(32)
+        session.expires_at = now + ttl
+        self.store.save(session.sid, self.serializer.dumps(dict(session)).encode(), session.expires_at)
+
+        if is_new or session.permanent:
+            response.set_cookie(
+                name,
+                self._signer(app).sign(session.sid).decode(),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
+
+def regenerate_session():
+    """Give the current session a new ID, so an ID planted in the browser before login is worthless"""
+    if isinstance(current_session._get_current_object(), ServerSideSession):
+        current_session.regenerate()
+
+def init_sessions(app):
+    """Install the server-side session interface selected by SESSION_BACKEND"""
+    app.config.setdefault('SESSION_BACKEND', 'database')
+    app.config.setdefault('SERVER_SESSION_TTL', 24 * 60 * 60)
+    app.config.setdefault('SESSION_FILE_DIR', os.path.join(app.instance_path, 'sessions'))
+    app.config.setdefault('SESSION_CACHE_PATH', os.path.join(app.instance_path, 'sessions-cache.db'))
+    app.config.setdefault('SESSION_CACHE_MAX_ENTRIES', 100000)
+    if app.config['SESSION_BACKEND'] == 'cookie':
+        return
+    app.session_interface = ServerSideSessionInterface(STORES[app.config['SESSION_BACKEND']](app.config))
+
+@app.cli.command('sessions-sweep')
+def sessions_sweep():
+    """Delete expired server-side sessions."""
+    interface = app.session_interface
+    if not isinstance(interface, ServerSideSessionInterface):
+        click.echo('Server-side sessions are not enabled')
+        return
+    start = time.perf_counter()
+    removed = interface.store.sweep(datetime.utcnow())
+    click.echo(f'Removed {removed} expired sessions in {time.perf_counter() - start:.2f}s')
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from models import TestSlot
+from forms import TEST_TIME_SLOTS, TEST_BOOKING_MIN_DAYS, TEST_BOOKING_MAX_DAYS
+
+def booking_window():
+    """Return the first and last bookable test dates"""
+    today = datetime.now().date()
+    return today + timedelta(days=TEST_BOOKING_MIN_DAYS), today + timedelta(days=TEST_BOOKING_MAX_DAYS)
+
+def get_availability(start=None, end=None):
+    """Return remaining seats per date and time slot for the booking window in a single query"""
+    if start is None or end is None:
+        start, end = booking_window()
+
+    capacity = current_app.config['TEST_SLOT_CAPACITY']
+    availability = {}
+    day = start
+    while day <= end:
+        availability[day] = {time: capacity for time, _ in TEST_TIME_SLOTS}
+        day += timedelta(days=1)
+
+    # Slots without a row have not been booked yet and keep the default capacity
+    rows = db.session.execute(
+        select(TestSlot.test_date, TestSlot.test_time, TestSlot.capacity - TestSlot.booked)
+        .where(TestSlot.test_date >= start, TestSlot.test_date <= end)
+    )
+    for test_date, test_time, remaining in rows:
+        if test_date in availability and test_time in availability[test_date]:
+            availability[test_date][test_time] = max(remaining, 0)
+    return availability
+
+def slot_available(test_date, test_time):
+    """Check whether a slot still has a free seat"""
+    slot = TestSlot.query.filter_by(test_date=test_date, test_time=test_time).first()
+    if not slot:
+        return True
+    return slot.booked < slot.capacity
+
+def _create_slot(test_date, test_time):
+    """Insert the inventory row for a slot, tolerating a concurrent insert of the same slot"""
+    try:
+        with db.session.begin_nested():
+            db.session.add(TestSlot(
+                test_date=test_date,
+                test_time=test_time,
+                capacity=current_app.config['TEST_SLOT_CAPACITY'],
+                booked=0
+            ))
+    except IntegrityError:
+        pass
+
+def reserve_slot(test_date, test_time, seats=1):
+    """Atomically take seats in a slot; the caller commits together with the booking.
+
+    The seats are taken with a single conditional UPDATE so concurrent workers can
+    never push ``booked`` past ``capacity``. Returns False when the slot has fewer
+    free seats than requested, taking none.
+    """
+    stmt = (
+        update(TestSlot)
+        .where(TestSlot.test_date == test_date,
+               TestSlot.test_time == test_time,
+               TestSlot.booked + seats <= TestSlot.capacity)
+        .values(booked=TestSlot.booked + seats)
+        .execution_options(synchronize_session=False)
+    )
+    if db.session.execute(stmt).rowcount == 1:
+        return True
+
+    exists = db.session.execute(
+        select(TestSlot.id).where(TestSlot.test_date == test_date, TestSlot.test_time == test_time)
+    ).first()
+    if exists:
+        return False
+
+    # First booking for this slot: materialize its inventory row and retry once
+    _create_slot(test_date, test_time)
+    return db.session.execute(stmt).rowcount == 1
+
+def release_slot(test_date, test_time, seats=1):
+    """Give back seats taken by reserve_slot, e.g. for a booking whose payment failed"""
+    db.session.execute(
+        update(TestSlot)
+        .where(TestSlot.test_date == test_date, TestSlot.test_time == test_time, TestSlot.booked >= seats)
+        .values(booked=TestSlot.booked - seats)
+        .execution_options(synchronize_session=False)
+    )
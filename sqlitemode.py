@@ -0,0 +1,157 @@
+import os
+import threading
+from sqlalchemy import event
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within a process
+    fcntl = None
+
+# Statements that run outside a write transaction; anything else, including SAVEPOINT, starts one
+READ_ONLY = ('SELECT', 'PRAGMA', 'EXPLAIN', 'WITH')
+
+def _writes(statement, context):
+    if context is not None and context.compiled is not None and (
+            context.isinsert or context.isupdate or context.isdelete or context.isddl):
+        return True
+    return not statement.lstrip()[:7].upper().startswith(READ_ONLY)
+
+class WriterGate:
+    """Lets one write transaction run at a time, across the threads of a process and, through
+    a lock file, across worker processes; waiting writers sleep in the kernel until their turn
+    instead of retrying through SQLite's busy handler"""
+
+    def __init__(self, path, timeout):
+        self.path = path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def acquire(self):
+        # Give up after the busy timeout, e.g. when a thread writes on a second connection while
+        # holding the gate; SQLite's own locking still applies then
+        if not self._lock.acquire(timeout=self.timeout):
+            return False
+        if fcntl is not None:
+            try:
+                if self._pid != os.getpid():
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+                    self._pid = os.getpid()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        return True
+
+    def release(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+class SQLiteMode:
+    """Production profile for a SQLite database file.
+
+    Every connection gets WAL journaling, so readers and the writer no longer block
+    each other, the configured pragmas and a busy timeout. Reads run outside a
+    transaction, as the driver already does, and a transaction starts with BEGIN
+    IMMEDIATE at its first write. That includes SAVEPOINT, which the driver would let
+    open a deferred transaction that can fail to upgrade to a write. With
+    SQLITE_SINGLE_WRITER the write transactions also queue on a WriterGate.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.pragmas = {}
+        self.gate = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        from app import db
+
+        app.config.setdefault('SQLITE_PROFILE', 'production')
+        app.config.setdefault('SQLITE_JOURNAL_MODE', 'wal')
+        app.config.setdefault('SQLITE_SYNCHRONOUS', 'normal')
+        app.config.setdefault('SQLITE_CACHE_SIZE_KB', 64 * 1024)
+        app.config.setdefault('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+        app.config.setdefault('SQLITE_BUSY_TIMEOUT', 30)
+        app.config.setdefault('SQLITE_SINGLE_WRITER', False)
+
+        with app.app_context():
+            engine = db.engine
+        database = engine.url.database
+        if engine.dialect.name != 'sqlite' or app.config['SQLITE_PROFILE'] != 'production' \
+                or not database or database == ':memory:':
+            return
+        self.enabled = True
+        self.pragmas = {
+            'journal_mode': app.config['SQLITE_JOURNAL_MODE'],
+            'synchronous': app.config['SQLITE_SYNCHRONOUS'],
+            'cache_size': -app.config['SQLITE_CACHE_SIZE_KB'],
+            'mmap_size': app.config['SQLITE_MMAP_SIZE'],
+            'temp_store': 'memory',
+            'busy_timeout': int(app.config['SQLITE_BUSY_TIMEOUT'] * 1000),
+        }
+        if app.config['SQLITE_SINGLE_WRITER']:
+            self.gate = WriterGate(f'{database}-writer.lock', app.config['SQLITE_BUSY_TIMEOUT'])
+
+        event.listen(engine, 'connect', self._connect)
+        for name in ('do_execute', 'do_executemany', 'do_execute_no_params'):
+            event.listen(engine, name, self._before_execute)
+        event.listen(engine, 'commit', self._commit)
+        event.listen(engine, 'rollback', self._rollback)
+        event.listen(engine, 'reset', self._reset)
+        event.listen(engine, 'close', self._close)
+
+    def _connect(self, dbapi_connection, connection_record):
+        # Take transaction control away from the driver, which would begin one before every write
+        dbapi_connection.isolation_level = None
+        for name, value in self.pragmas.items():
+            dbapi_connection.execute(f'PRAGMA {name}={value}')
+
+    def _before_execute(self, cursor, statement, *args):
+        context = args[-1] if args else None
+        if cursor.connection.in_transaction or not _writes(statement, context):
+            return
+        if context is not None and context.execution_options.get('isolation_level') == 'AUTOCOMMIT':
+            # e.g. VACUUM, which cannot run inside a transaction
+            return
+        info = context.root_connection.connection.info if context is not None else {}
+        if self.gate is not None and context is not None and not info.get('writer_gate'):
+            info['writer_gate'] = self.gate.acquire()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+        except BaseException:
+            self._release(info)
+            raise
+
+    def _release(self, info):
+        if info.pop('writer_gate', False):
+            self.gate.release()
+
+    def _end(self, dbapi_connection, info, commit):
+        # Finish the transaction here so the gate is released only once it is over; the
+        # driver's own commit or rollback that follows finds nothing left to do
+        try:
+            if dbapi_connection is not None and dbapi_connection.in_transaction:
+                if commit:
+                    dbapi_connection.commit()
+                else:
+                    dbapi_connection.rollback()
+        finally:
+            self._release(info)
+
+    def _commit(self, conn):
+        self._end(conn.connection.dbapi_connection, conn.connection.info, commit=True)
+
+    def _rollback(self, conn):
+        self._end(conn.connection.dbapi_connection, conn.connection.info, commit=False)
+
+    def _reset(self, dbapi_connection, connection_record, reset_state):
+        self._end(dbapi_connection, connection_record.info, commit=False)
+
+    def _close(self, dbapi_connection, connection_record):
+        self._release(connection_record.info)
+
+sqlite_mode = SQLiteMode()
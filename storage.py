@@ -0,0 +1,201 @@
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+import click
+from flask import current_app, request, send_file
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.wsgi import wrap_file
+from app import app, db
+from models import Document
+
+MIMETYPES = {'pdf': 'application/pdf', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+class DocumentStore(ABC):
+    """Content-addressed blob storage; keys are derived from the SHA-256 of the content"""
+
+    def key_for(self, sha256):
+        # Two levels of hash-prefix directories keep every directory small
+        return f'{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+    @abstractmethod
+    def put(self, upload):
+        """Store a committed-to-be HashingUpload and return its key; existing content is reused"""
+
+    @abstractmethod
+    def exists(self, key):
+        pass
+
+    @abstractmethod
+    def open(self, key):
+        pass
+
+    @abstractmethod
+    def delete(self, key):
+        pass
+
+    def local_path(self, key):
+        """Path on local disk for zero-copy serving, or None when the store is not file backed"""
+        return None
+
+class LocalDocumentStore(DocumentStore):
+    """Hash-prefix sharded directories on the local disk"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, upload):
+        key = self.key_for(upload.sha256)
+        path = self._path(key)
+        if os.path.exists(path):
+            upload.discard()
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            upload.commit(path)
+        return key
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, key):
+        return self._path(key)
+
+class BucketDocumentStore(DocumentStore):
+    """Local stand-in for an object store: flat object names in a bucket, no local paths exposed"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _object(self, key):
+        return os.path.join(self.root, key.replace('/', '%2F'))
+
+    def put(self, upload):
+        key = self.key_for(upload.sha256)
+        if self.exists(key):
+            upload.discard()
+        else:
+            os.makedirs(self.root, exist_ok=True)
+            upload.commit(self._object(key))
+        return key
+
+    def exists(self, key):
+        return os.path.exists(self._object(key))
+
+    def open(self, key):
+        return open(self._object(key), 'rb')
+
+    def delete(self, key):
+        try:
+            os.unlink(self._object(key))
+        except FileNotFoundError:
+            pass
+
+STORES = {
+    'local': lambda config: LocalDocumentStore(os.path.abspath(config['UPLOAD_FOLDER'])),
+    'bucket': lambda config: BucketDocumentStore(os.path.abspath(os.path.join(config['UPLOAD_FOLDER'], 'bucket'))),
+}
+
+class Documents:
+    """Deduplicating document storage with reference counts kept in the database.
+
+    References are only ever added: learning licenses are never deleted and their document is
+    never replaced, so garbage collection only reclaims uploads that never got attached to one.
+    """
+
+    def __init__(self, app=None):
+        self.store = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('DOCUMENT_STORE', 'local')
+        app.config.setdefault('DOCUMENT_ACCEL_REDIRECT', None)
+        app.config.setdefault('DOCUMENT_GC_GRACE_HOURS', 24)
+        self.store = STORES[app.config['DOCUMENT_STORE']](app.config)
+
+    def save(self, upload):
+        """Store an upload and make sure its Document row exists; returns the Document"""
+        # Touch an existing row so garbage collection leaves content that is about to be referenced
+        # alone, and commit that before storing: a collection that already removed the row has
+        # unlinked the blob as well, so put() sees it missing and writes it again
+        db.session.execute(update(Document).where(Document.sha256 == upload.sha256)
+                           .values(last_used=datetime.utcnow()))
+        db.session.commit()
+        key = self.store.put(upload)
+        try:
+            with db.session.begin_nested():
+                db.session.add(Document(sha256=upload.sha256, storage_key=key, size=upload.size,
+                                        file_type=upload.file_type, ref_count=0))
+        except IntegrityError:
+            pass
+        db.session.commit()
+        return Document.query.filter_by(sha256=upload.sha256).one()
+
+    def add_reference(self, sha256):
+        """Count a reference; the caller commits together with the referencing row"""
+        db.session.execute(update(Document).where(Document.sha256 == sha256)
+                           .values(ref_count=Document.ref_count + 1, last_used=datetime.utcnow()))
+
+    def serve(self, key, download_name, file_type=None, size=None):
+        """Response for a document without copying it through Python where the server can do it"""
+        mimetype = MIMETYPES.get(file_type, 'application/octet-stream')
+        accel = current_app.config['DOCUMENT_ACCEL_REDIRECT']
+        path = self.store.local_path(key)
+
+        if accel and path:
+            # nginx serves the file itself (sendfile, ranges) from an internal location
+            rv = current_app.response_class(mimetype=mimetype)
+            rv.headers['X-Accel-Redirect'] = f"{accel.rstrip('/')}/{key}"
+            rv.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+            return rv
+
+        if path:
+            # send_file honours USE_X_SENDFILE, hands the file to wsgi.file_wrapper and answers Range requests
+            return send_file(path, mimetype=mimetype, as_attachment=True, download_name=download_name,
+                             conditional=True)
+
+        data = wrap_file(request.environ, self.store.open(key))
+        rv = current_app.response_class(data, mimetype=mimetype, direct_passthrough=True)
+        rv.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        rv.make_conditional(request, accept_ranges=True, complete_length=size)
+        return rv
+
+    def collect_garbage(self, grace):
+        """Delete unreferenced content not used within the grace period; returns the number removed"""
+        cutoff = datetime.utcnow() - grace
+        removed = 0
+        candidates = db.session.query(Document.id, Document.storage_key).filter(
+            Document.ref_count == 0, Document.last_used < cutoff).all()
+        for document_id, storage_key in candidates:
+            # Delete the row only if it is still unreferenced, and unlink the blob before committing:
+            # a save of the same content waits on the row until then, and stores the content after
+            deleted = db.session.execute(
+                Document.__table__.delete().where(Document.id == document_id, Document.ref_count == 0,
+                                                  Document.last_used < cutoff))
+            if deleted.rowcount:
+                self.store.delete(storage_key)
+                removed += 1
+            db.session.commit()
+        return removed
+
+documents = Documents()
+
+@app.cli.command('documents-gc')
+@click.option('--grace-hours', type=int, help='Defaults to DOCUMENT_GC_GRACE_HOURS.')
+def documents_gc(grace_hours):
+    """Remove stored documents that no application references."""
+    hours = grace_hours if grace_hours is not None else app.config['DOCUMENT_GC_GRACE_HOURS']
+    removed = documents.collect_garbage(timedelta(hours=hours))
+    click.echo(f'Removed {removed} unreferenced documents')
@@ -0,0 +1,134 @@
+import json
+import time
+from collections import namedtuple
+from datetime import datetime
+import click
+from sqlalchemy import select, update
+from app import app, db
+from models import LearningLicense, DrivingLicense, Application, StatusTransitionAudit
+from cache import cache, application_key, learning_license_key, driving_license_key
+from utils import add_years
+
+Transition = namedtuple('Transition', 'model kind from_status to_status values')
+
+def _issue_values():
+    issue_date = datetime.now()
+    return {'issue_date': issue_date, 'expiry_date': add_years(issue_date, 10)}
+
+# Allowed bulk status changes; values returns extra columns to set with the status
+TRANSITIONS = {
+    'learning-approve': Transition(LearningLicense, 'learning', ('Processing',), 'Approved', None),
+    'learning-reject': Transition(LearningLicense, 'learning', ('Processing',), 'Rejected', None),
+    'driving-pass': Transition(DrivingLicense, 'driving', ('Scheduled',), 'Passed', _issue_values),
+    'driving-fail': Transition(DrivingLicense, 'driving', ('Scheduled',), 'Failed', None),
+}
+
+def _conditions(transition, application_ids=None, user_id=None, applied_before=None, test_date=None):
+    model = transition.model
+    conditions = [model.status.in_(transition.from_status)]
+    if application_ids:
+        conditions.append(model.application_id.in_(application_ids))
+    if user_id is not None:
+        conditions.append(model.user_id == user_id)
+    if applied_before is not None:
+        conditions.append(model.apply_date < applied_before)
+    if test_date is not None:
+        if model is not DrivingLicense:
+            raise ValueError('test_date only applies to driving license transitions')
+        conditions.append(model.test_date == test_date)
+    return conditions
+
+def count_matching(name, **filters):
+    """Number of rows a transition would change right now"""
+    transition = TRANSITIONS[name]
+    return transition.model.query.filter(*_conditions(transition, **filters)).count()
+
+def apply_transition(name, actor, chunk_size=1000, **filters):
+    """Move every row matching filters through a transition, chunk_size rows per transaction.
+
+    Each chunk is a single UPDATE over the next chunk_size matching ids that
+    re-checks the from-status, so rows changed concurrently are skipped rather
+    than overwritten. The registry is updated in the same transaction and one
+    audit row is written per chunk.
+    """
+    transition = TRANSITIONS[name]
+    model = transition.model
+    conditions = _conditions(transition, **filters)
+    columns = [model.id, model.application_id]
+    if model is DrivingLicense:
+        columns.append(model.license_number)
+    audit_filters = json.dumps(filters, default=str, sort_keys=True)
+
+    rows = chunks = 0
+    started = time.perf_counter()
+    while True:
+        values = {'status': transition.to_status}
+        if transition.values:
+            values.update(transition.values())
+        chunk = select(model.id).where(*conditions).order_by(model.id).limit(chunk_size)
+        changed = db.session.execute(
+            update(model).where(model.id.in_(chunk), *conditions).values(**values).returning(*columns)
+        ).all()
+        if not changed:
+            db.session.rollback()
+            break
+
+        application_ids = [row.application_id for row in changed]
+        db.session.execute(
+            update(Application).where(Application.application_id.in_(application_ids))
+            .values(status=transition.to_status)
+        )
+        keys = [application_key(application_id) for application_id in application_ids]
+        if model is DrivingLicense:
+            keys += [driving_license_key(row.license_number) for row in changed]
+        else:
+            keys += [learning_license_key(application_id) for application_id in application_ids]
+        cache.invalidate_after_commit(db.session, *keys)
+
+        ids = [row.id for row in changed]
+        db.session.add(StatusTransitionAudit(
+            transition=name,
+            from_status=','.join(transition.from_status),
+            to_status=transition.to_status,
+            rows=len(changed),
+            first_id=min(ids),
+            last_id=max(ids),
+            filters=audit_filters,
+            actor=actor
+        ))
+        db.session.commit()
+        rows += len(changed)
+        chunks += 1
+
+    elapsed = time.perf_counter() - started
+    return {
+        'transition': name,
+        'rows': rows,
+        'chunks': chunks,
+        'elapsed': elapsed,
+        'rows_per_second': rows / elapsed if elapsed else 0.0
+    }
+
+@app.cli.command('transition-status')
+@click.argument('name', type=click.Choice(sorted(TRANSITIONS)))
+@click.option('--application-id', 'application_ids', multiple=True, help='Limit to these applications.')
+@click.option('--user-id', type=int, help='Limit to one applicant.')
+@click.option('--applied-before', type=click.DateTime(), help='Limit to applications made before this date.')
+@click.option('--test-date', type=click.DateTime(formats=['%Y-%m-%d']), help='Limit to tests on this date.')
+@click.option('--chunk-size', default=1000, show_default=True, help='Rows per transaction.')
+@click.option('--actor', required=True, help='Officer recorded in the audit log.')
+@click.option('--dry-run', is_flag=True, help='Only count matching rows.')
+def transition_status(name, application_ids, user_id, applied_before, test_date, chunk_size, actor, dry_run):
+    """Apply a bulk status transition, e.g. approve all pending learning licenses."""
+    filters = {
+        'application_ids': list(application_ids) or None,
+        'user_id': user_id,
+        'applied_before': applied_before,
+        'test_date': test_date.date() if test_date else None
+    }
+    if dry_run:
+        click.echo(f'{count_matching(name, **filters)} rows match {name}')
+        return
+    result = apply_transition(name, actor, chunk_size=chunk_size, **filters)
+    click.echo(f"{result['rows']} rows in {result['chunks']} chunks, "
+               f"{result['elapsed']:.2f}s ({result['rows_per_second']:.0f} rows/s)")
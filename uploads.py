@@ -0,0 +1,97 @@
+import hashlib
+import os
+import tempfile
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+# Leading bytes of the document formats we accept
+FILE_SIGNATURES = {
+    'pdf': b'%PDF-',
+    'jpeg': b'\xff\xd8\xff',
+    'png': b'\x89PNG\r\n\x1a\n',
+}
+SNIFF_BYTES = max(len(signature) for signature in FILE_SIGNATURES.values())
+
+def sniff_type(head):
+    """Return the document type for the leading bytes of a file, or None"""
+    for file_type, signature in FILE_SIGNATURES.items():
+        if head.startswith(signature):
+            return file_type
+    return None
+
+class HashingUpload:
+    """Temp file that hashes, sizes and type-checks an upload as the multipart parser writes it"""
+
+    def __init__(self, directory, max_size, allowed_types):
+        self.max_size = max_size
+        self.allowed_types = allowed_types
+        self.size = 0
+        self.file_type = None
+        self._head = b''
+        self._digest = hashlib.sha256()
+        self._committed = False
+        os.makedirs(directory, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix='.upload-', dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.discard()
+            raise RequestEntityTooLarge(f'Document exceeds {self.max_size // (1024 * 1024)}MB')
+        if self.file_type is None:
+            self._head += data[:SNIFF_BYTES]
+            if len(self._head) >= SNIFF_BYTES:
+                self._check_type()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def _check_type(self):
+        self.file_type = sniff_type(self._head)
+        if self.file_type not in self.allowed_types:
+            self.discard()
+            raise UnsupportedMediaType(f"Documents must be one of: {', '.join(sorted(self.allowed_types))}")
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def commit(self, path):
+        """Move the upload into place atomically; the file is never visible half-written"""
+        if self.file_type is None:
+            self._check_type()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self.temp_path, path)
+        self._committed = True
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        if not self._committed and os.path.exists(self.temp_path):
+            os.unlink(self.temp_path)
+
+    def close(self):
+        # Called when the request ends; uploads that were not committed are removed
+        self.discard()
+
+class StreamingUploadRequest(Request):
+    """Request that streams file parts to disk through HashingUpload instead of buffering them"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        config = current_app.config
+        return HashingUpload(
+            config['UPLOAD_FOLDER'],
+            config['UPLOAD_MAX_FILE_SIZE'],
+            config['UPLOAD_ALLOWED_TYPES']
+        )
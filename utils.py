@@ -1,19 +1,20 @@
-import random
-import string
-from datetime import datetime
 from flask import session
+from ids import id_allocator
 
 def generate_application_id():
-    """Generate a unique application ID with prefix 'APP' followed by timestamp and random chars"""
-    timestamp = datetime.now().strftime('%Y%m%d%H%M')
-    random_chars = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-    return f"APP{timestamp}{random_chars}"
+    """Generate a unique application ID with prefix 'APP' followed by timestamp and a sequence suffix"""
+    return id_allocator.application_id()
 
 def generate_license_number():
-    """Generate a unique license number with prefix 'DL' followed by timestamp and random chars"""
-    timestamp = datetime.now().strftime('%Y%m%d')
-    random_chars = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
-    return f"DL{timestamp}{random_chars}"
+    """Generate a unique license number with prefix 'DL' followed by date and a sequence suffix"""
+    return id_allocator.license_number()
+
+def add_years(value, years):
+    """Return the same date the given number of years later; 29 February falls back to 28 February"""
+    try:
+        return value.replace(year=value.year + years)
+    except ValueError:
+        return value.replace(year=value.year + years, day=28)
 
 def is_logged_in():
     """Check if user is logged in"""